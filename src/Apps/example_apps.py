@@ -0,0 +1,26 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Example radio apps. An app is a function called as app(frame, addr, source) from a
+# MessageRouter worker thread, where frame is a Messaging.j2735.MessageFrame, addr is the
+# (IP, port) it came from and source is 'LAN' or 'VANET'.
+
+import logging
+
+# Child of the OBU logger, so app output lands in Logs/c1t2x_OBU.log
+logger = logging.getLogger("C1T2X_OBU.apps")
+
+def log_message(frame, addr, source):
+	# Logs the type of every routed message without decoding the payload
+	logger.info("%s: %s (%d bytes) from %s", source, frame.name, len(frame.raw), addr[0])
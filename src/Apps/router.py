@@ -0,0 +1,183 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code routes received messages to the radio applications (RADIO_APPS in config/params.yaml).
+#
+# Every packet is looked up by J2735 message ID and by PSID in tables that are built once when the
+# handlers are registered. Matching handlers are not run on the forwarding thread: each handler has
+# its own bounded queue, and a fixed pool of worker threads drains them. A handler only ever runs on
+# one worker at a time, so apps do not need to be thread safe, and a slow app only fills (and then
+# drops from) its own queue.
+
+import time, importlib
+from collections import deque
+from threading import Thread, Lock
+from queue import SimpleQueue
+
+from Messaging.j2735 import MESSAGE_IDS
+
+# Message ID range of a J2735 DSRCmsgID, the lookup table has one entry per ID
+MAX_MESSAGE_ID = 0x7FFF
+
+# Items a worker runs from one handler before giving other handlers a turn
+WORKER_BATCH = 16
+
+_STOP = object()
+
+
+class _Handler:
+	__slots__ = ("name", "fn", "queue", "queue_size", "scheduled",
+		"received", "dropped", "processed", "errors", "max_depth", "latency_total", "latency_max")
+
+	def __init__(self, name, fn, queue_size):
+		self.name = name
+		self.fn = fn
+		self.queue = deque()
+		self.queue_size = queue_size
+		self.scheduled = False
+
+		# Stats
+		self.received = 0
+		self.dropped = 0
+		self.processed = 0
+		self.errors = 0
+		self.max_depth = 0
+		self.latency_total = 0.0
+		self.latency_max = 0.0
+
+	def stats(self):
+		return {
+			'queue_depth': len(self.queue),
+			'max_queue_depth': self.max_depth,
+			'received': self.received,
+			'dropped': self.dropped,
+			'processed': self.processed,
+			'errors': self.errors,
+			'avg_latency_ms': 1000.0 * self.latency_total / self.processed if self.processed else 0.0,
+			'max_latency_ms': 1000.0 * self.latency_max,
+		}
+
+
+class MessageRouter:
+
+	def __init__(self, workers=2, logger=None):
+
+		self.logger = logger
+		self.lock = Lock()
+		self.ready = SimpleQueue()
+		self.handlers = []
+		self.workers = [Thread(target= self._worker, name="RadioApp-{}".format(i)) for i in range(workers)]
+
+		# Lookup tables: message ID -> handlers, PSID -> handlers
+		self.by_message = [()] * (MAX_MESSAGE_ID + 1)
+		self.by_psid = {}
+		self.unrouted = 0
+
+	def register(self, name, fn, messages=(), psids=(), queue_size=64):
+		# fn(frame, addr, source) is called for every frame whose message ID is in messages or
+		# whose PSID is in psids. Messages can be given by J2735 name ('BSM') or ID (20).
+		handler = _Handler(name, fn, queue_size)
+		self.handlers.append(handler)
+		for msg in messages:
+			msg_id = MESSAGE_IDS[msg] if isinstance(msg, str) else int(msg)
+			self.by_message[msg_id] = self.by_message[msg_id] + (handler,)
+		for psid in psids:
+			psid = int(psid, 0) if isinstance(psid, str) else int(psid)
+			self.by_psid[psid] = self.by_psid.get(psid, ()) + (handler,)
+		return handler
+
+	def load(self, configs):
+		# Registers the handlers listed under RADIO_APP_HANDLERS ('module:function' specs)
+		for config in configs or ():
+			module_name, _, fn_name = config['handler'].partition(':')
+			fn = getattr(importlib.import_module(module_name), fn_name)
+			self.register(config.get('name', config['handler']), fn, config.get('messages', ()),
+				config.get('psids', ()), config.get('queue_size', 64))
+			if self.logger:
+				self.logger.info("Registered radio app '{}'".format(config.get('name', config['handler'])))
+
+	def start(self):
+		for worker in self.workers:
+			worker.daemon = True
+			worker.start()
+
+	def close(self):
+		for _ in self.workers:
+			self.ready.put(_STOP)
+		for worker in self.workers:
+			if worker.is_alive():
+				worker.join(1.0)
+
+	def dispatch(self, frame, addr, source, psid=None):
+		# Called on the forwarding thread, only does table lookups and queue appends
+		handlers = self.by_message[frame.message_id]
+		if psid is not None:
+			by_psid = self.by_psid.get(psid)
+			if by_psid:
+				handlers = tuple(dict.fromkeys(handlers + by_psid))
+		if not handlers:
+			self.unrouted += 1
+			return
+		# With a decode pool the payload is decoded on another core while it waits in the queues
+		frame.prefetch()
+		now = time.monotonic()
+		item = (frame, addr, source, now)
+		with self.lock:
+			for handler in handlers:
+				handler.received += 1
+				if len(handler.queue) >= handler.queue_size:
+					handler.dropped += 1
+					continue
+				handler.queue.append(item)
+				if len(handler.queue) > handler.max_depth:
+					handler.max_depth = len(handler.queue)
+				if not handler.scheduled:
+					handler.scheduled = True
+					self.ready.put(handler)
+
+	def stats(self):
+		with self.lock:
+			stats = {handler.name: handler.stats() for handler in self.handlers}
+			stats['unrouted'] = self.unrouted
+		return stats
+
+	def _worker(self):
+		while True:
+			handler = self.ready.get()
+			if handler is _STOP:
+				return
+			for _ in range(WORKER_BATCH):
+				with self.lock:
+					if not handler.queue:
+						handler.scheduled = False
+						break
+					frame, addr, source, queued_at = handler.queue.popleft()
+				try:
+					handler.fn(frame, addr, source)
+				except Exception as excep:
+					handler.errors += 1
+					if self.logger:
+						self.logger.exception("Radio app '{}' failed: {}".format(handler.name, excep))
+				latency = time.monotonic() - queued_at
+				handler.processed += 1
+				handler.latency_total += latency
+				if latency > handler.latency_max:
+					handler.latency_max = latency
+			else:
+				# Batch used up with items left, requeue behind the other handlers
+				with self.lock:
+					if handler.queue:
+						self.ready.put(handler)
+					else:
+						handler.scheduled = False
@@ -15,14 +15,24 @@
 # the License.
 
 
-import os, logging, time
-from ruamel.yaml import YAML
+import os, sys, logging, time
 from threading import Thread, Lock
 from pathlib import Path, PurePath
 import argparse
-from binascii import unhexlify
 
 from Networking.networking import UDP_NET
+from Networking.dispatcher import UDPDispatcher
+from Networking.forwarding import make_forwarder
+from Messaging.j2735 import J2735Codec, LazyCodec
+from Networking.framing import FRAMINGS
+from Networking.metrics import MetricsRegistry, start_endpoints
+from Networking.configs import load_yaml
+from Networking.startup import StartupTimer
+from Networking.logs import start_logging, packet_logger, paused_logging
+from Networking.capture import CaptureWriter
+from Networking.pipeline import Pipeline, POLICIES as PIPELINE_POLICIES, DROP_OLDEST, DROP_NEWEST
+from Networking.profiling import RuntimeProfiler, install_signal_handlers, start_control
+from Apps.router import MessageRouter
 
 # Initialize mutex
 mutex = Lock()
@@ -33,56 +43,71 @@ parser.add_argument("-p", "--print", help="prints output to the terminal", actio
 args = parser.parse_args()
 
 
-# Logging
-c1t2x_logger = None
-LOGGING_LEVEL = logging.INFO
-logs_directory = PurePath.joinpath(Path.cwd(), "Logs")
-
-# IF: Check if the Logs directory does not exist
-if not os.path.exists(logs_directory):
-	# Create Logs directory
-	os.mkdir(logs_directory, 0o775)
-
-# Setup logger with formatting
-log_filename = "c1t2x_OBU.log"
-c1t2x_logger = logging.getLogger(__name__)
-c1t2x_logger.setLevel(LOGGING_LEVEL)
-c1t2x_logger_handler = logging.FileHandler(os.path.join(logs_directory, log_filename), "w")
-c1t2x_logger_handler.setLevel(LOGGING_LEVEL)
-c1t2x_logger_formatter = logging.Formatter("[%(asctime)s.%(msecs)03d] %(levelname)s - %(message)s", datefmt= "%d-%b-%y %H:%M:%S")
-c1t2x_logger_handler.setFormatter(c1t2x_logger_formatter)
-c1t2x_logger.addHandler(c1t2x_logger_handler)
-# Start logging
-c1t2x_logger.info("\n---------------------------\nStarting C1T2X OBU Logger\n---------------------------")
-
 # Initialize error
 error = False
 
-# Initialize waiting for ack
-waiting_for_ack = False
-
 # Sets printData bool to cmd line arg
 printData = args.print
 
+# Logger, file handlers are added once the configs are read
+c1t2x_logger = logging.getLogger("C1T2X_OBU")
+LOGGING_LEVEL = logging.INFO
+logs_directory = PurePath.joinpath(Path.cwd(), "Logs")
+log_filename = "c1t2x_OBU.log"
+
+# Time of each start-up phase and to the first forwarded packet (Networking/startup.py)
+startup = StartupTimer(c1t2x_logger)
+startup.mark('imports')
+
 # Import Configs
 script_dir = os.path.dirname(__file__)
 fpath = 'config/params.yaml'
 file_path = os.path.join(script_dir, fpath)
 try:
-	y = YAML(typ='safe')
-	with open(file_path,'r') as f:
-		params = y.load(f)
+	# Parsed once and cached in binary form, see Networking/configs.py
+	params = load_yaml(file_path)
+
+	# Setup logger, records are written to disk by a background thread (Networking/logs.py)
+	start_logging("C1T2X_OBU", os.path.join(logs_directory, log_filename), LOGGING_LEVEL,
+		max_bytes=params.get('LOG_MAX_BYTES', 0), backups=params.get('LOG_BACKUPS', 3),
+		packet_sample=params.get('PACKET_LOG_SAMPLE', 1), packet_rate=params.get('PACKET_LOG_RATE', 0))
+	# Start logging
+	c1t2x_logger.info("\n---------------------------\nStarting C1T2X OBU Logger\n---------------------------")
+
 	parseLANPacket = params['LAN_DECODE']
 	parseVANETPacket = params['VANET_DECODE']
 	radioApps = params['RADIO_APPS']
+	radioAppWorkers = params.get('RADIO_APP_WORKERS', 2)
+	radioAppHandlers = params.get('RADIO_APP_HANDLERS', [])
 	printData = params['print_data']
 	loopTime = params['loop_time']
 	logLevel = params['logging_level']
+	forwardingMode = params.get('FORWARDING_MODE', 'stop_and_wait')
+	networkBackend = params.get('NETWORK_BACKEND', 'threaded')
+	vanetFraming = params.get('VANET_FRAMING', 'driver')
+	j2735AsnDir = params.get('J2735_ASN_DIR', 'config/J2735')
+	codecCacheDir = params.get('CODEC_CACHE_DIR', 'Cache')
+	decodeWorkers = params.get('DECODE_WORKERS', 0)
+	decodeTimeout = params.get('DECODE_TIMEOUT', 1.0)
+	pipelineSize = params.get('PIPELINE_BUFFER_SIZE', 1024)
+	pipelineOverflow = params.get('PIPELINE_OVERFLOW', 'drop_oldest')
+	pipelineBlockTimeout = params.get('PIPELINE_BLOCK_TIMEOUT', 0.5)
+	captureFile = params.get('CAPTURE_FILE', '')
+	captureMaxBytes = params.get('CAPTURE_MAX_BYTES', 0)
+	captureBackups = params.get('CAPTURE_BACKUPS', 3)
+	statsParams = {key: params.get(key) for key in ('STATS_SOCKET', 'STATS_SNAPSHOT_FILE', 'STATS_SNAPSHOT_INTERVAL')}
+	traceStages = params.get('TRACE_STAGES', False)
+	controlParams = {'CONTROL_SOCKET': params.get('CONTROL_SOCKET')}
+	profileTop = params.get('PROFILE_TOP', 40)
+	tracemallocFrames = params.get('TRACEMALLOC_FRAMES', 10)
+	fastStart = params.get('FAST_START', False)
+	interfaceWait = params.get('INTERFACE_WAIT', 0)
 except Exception as e:
 	c1t2x_logger.error("Unable to import master yaml configs")
 	error = True
 	print("Unable to import yaml configs")
 	raise e
+startup.mark('configs')
 
 if logLevel == 'DEBUG': c1t2x_logger.setLevel(logging.DEBUG)
 elif logLevel == 'INFO': c1t2x_logger.setLevel(logging.INFO)
@@ -93,11 +118,31 @@ else:
 	print("Configured LOGGING LEVEL is invalid. Level is set to WARNING.")
 	c1t2x_logger.warning("Configured LOGGING LEVEL is invalid. Level is set to WARNING.")
 
+if forwardingMode not in ('stop_and_wait', 'sliding_window'):
+	print("Configured FORWARDING_MODE is invalid. Mode is set to stop_and_wait.")
+	c1t2x_logger.warning("Configured FORWARDING_MODE '%s' is invalid. Mode is set to stop_and_wait.", forwardingMode)
+	forwardingMode = 'stop_and_wait'
+
+if pipelineOverflow not in PIPELINE_POLICIES:
+	print("Configured PIPELINE_OVERFLOW is invalid. Policy is set to drop_oldest.")
+	c1t2x_logger.warning("Configured PIPELINE_OVERFLOW '%s' is invalid. Policy is set to drop_oldest.", pipelineOverflow)
+	pipelineOverflow = 'drop_oldest'
+
+if vanetFraming not in FRAMINGS:
+	print("Configured VANET_FRAMING is invalid. Framing is set to driver.")
+	c1t2x_logger.warning("Configured VANET_FRAMING '%s' is invalid. Framing is set to driver.", vanetFraming)
+	vanetFraming = 'driver'
+
+if networkBackend not in ('threaded', 'event'):
+	print("Configured NETWORK_BACKEND is invalid. Backend is set to threaded.")
+	c1t2x_logger.warning("Configured NETWORK_BACKEND '%s' is invalid. Backend is set to threaded.", networkBackend)
+	networkBackend = 'threaded'
+
 
 # Instantiate networks
 # LAN
 try:
-	lan = UDP_NET(CONFIG_FILE='LAN_params.yaml',logger=c1t2x_logger)
+	lan = UDP_NET(CONFIG_FILE='LAN_params.yaml',logger=c1t2x_logger, interface_wait=interfaceWait)
 except:
 	error = True
 try:
@@ -109,7 +154,7 @@ except:
 
 # VANET
 try:
-	vanet = UDP_NET(CONFIG_FILE='VANET_params.yaml',logger=c1t2x_logger)
+	vanet = UDP_NET(CONFIG_FILE='VANET_params.yaml',logger=c1t2x_logger, interface_wait=interfaceWait)
 except:
 	error = True
 try:
@@ -118,49 +163,140 @@ except:
 	c1t2x_logger.warning("Not connected to a VANET interface")
 	if printData:
 		print("Not connected to a VANET interface")
+startup.mark('interfaces')
+
+# Packet capture, shared by both networks so the file keeps the order packets were seen in
+capture = None
+if captureFile and not error:
+	try:
+		capture = CaptureWriter(captureFile, captureMaxBytes, captureBackups)
+		lan.set_capture(capture)
+		vanet.set_capture(capture)
+		c1t2x_logger.info("Capturing packets to {}".format(captureFile))
+	except OSError as e:
+		c1t2x_logger.error("Unable to open capture file {}: {}".format(captureFile, e))
+
+# Per-packet records, sampled/rate limited with PACKET_LOG_SAMPLE and PACKET_LOG_RATE
+packet_log = packet_logger(c1t2x_logger)
+
+# This radio's VANET address, named by the acks of its messages
+selfIP = getattr(vanet, 'selfIP', None) if not error else None
 
 def sendVANET(vPacket):
 	global vanet
 	vanet.send_data(vPacket)
 
-def sendLAN(lPacket):
-	global lan
-	lan.send_data(strip_header(lPacket))
+# J2735 codec, only loaded when VANET_DECODE is enabled
+# With FAST_START it is loaded once the forwarding threads run, unless decode workers need it to fork
+def loadCodec():
+	return J2735Codec.load(os.path.join(script_dir, j2735AsnDir), os.path.join(script_dir, codecCacheDir), logger=c1t2x_logger)
+
+j2735_codec = None
+if parseVANETPacket and fastStart and decodeWorkers <= 0:
+	j2735_codec = LazyCodec(loadCodec, c1t2x_logger)
+elif parseVANETPacket:
+	try:
+		j2735_codec = loadCodec()
+	except Exception as e:
+		c1t2x_logger.error("Unable to load the J2735 codec: {}".format(e))
+
+# Decode worker processes, forked here before the forwarding threads and radio app workers are started
+# and while the log listener is paused, so no other thread is running
+decode_pool = None
+if j2735_codec is not None and decodeWorkers > 0:
+	try:
+		from Messaging.decode_pool import DecodePool
+		with paused_logging():
+			j2735_codec = decode_pool = DecodePool(j2735_codec, workers=decodeWorkers, timeout=decodeTimeout,
+				logger=c1t2x_logger)
+	except Exception as e:
+		c1t2x_logger.error("Unable to start J2735 decode workers: {}".format(e))
+
+# Radio apps, handed every message by the Forwarder when RADIO_APPS is enabled
+router = None
+if radioApps:
+	try:
+		router = MessageRouter(workers=radioAppWorkers, logger=c1t2x_logger)
+		router.load(radioAppHandlers)
+	except Exception as e:
+		c1t2x_logger.error("Unable to load radio apps: {}".format(e))
+		router = None
+
+def makeForwarder(send_lan, call_later):
+	# Acks, retransmits, duplicate suppression, outbound priority, reliability, framing and congestion
+	# control are the same for both backends (Networking/forwarding.py)
+	return make_forwarder(params, send_lan, sendVANET, call_later, c1t2x_logger, parse_lan=parseLANPacket,
+		parse_vanet=parseVANETPacket, print_data=printData, codec=j2735_codec, self_ip=selfIP,
+		fragment_size=vanet.fragmentSize, on_message=router.dispatch if router is not None else None)
+
+# Threaded backend stages (Networking/pipeline.py): the receive threads only hand packets on, so a
+# slow send or decode fills a ring buffer instead of stalling a socket
+#   VANET -> LAN: VANET_listening_thread -> forward (acks, duplicates, header stripping) -> send to LAN
+#   LAN -> VANET: LAN_listening_thread -> forward (radio apps, outbound queue, send to VANET)
+# The Forwarder is not thread-safe, so both forward stages and its timers take forwarder_lock
+vanet_to_lan = Pipeline("vanet_to_lan", pipelineSize, pipelineOverflow, pipelineBlockTimeout, logger=c1t2x_logger)
+lan_to_vanet = Pipeline("lan_to_vanet", pipelineSize, pipelineOverflow, pipelineBlockTimeout, logger=c1t2x_logger)
+forwarder_lock = Lock()
+
+def runLocked(fn, *args):
+	with forwarder_lock:
+		return fn(*args)
+
+def callLater(delay, callback):
+	# Forwarder timers of the threaded backend, run on the dispatcher thread
+	return dispatcher.call_later(delay, lambda: runLocked(callback))
+
+def forwardVANET(pkt):
+	runLocked(forwarder.on_vanet_packet, pkt)
+
+def queueLAN(payload):
+	# Queued for the LAN send stage. The Forwarder acks a message only if this returns True, so
+	# the send stage never drops a packet it already accepted (see lan_send below)
+	queued = lan_send.inbox.put(payload)
+	if not queued:
+		packet_log.warning("VANET -> LAN buffer full, dropped a packet")
+	return queued
+
+def sendLAN(payload):
+	lan.send_data(payload)
+
+def forwardLAN(pkt):
+	runLocked(forwarder.on_lan_packet, pkt)
+
+vanet_to_lan.add_stage("forward", forwardVANET)
+# drop_oldest would drop packets that were already acked, drop the new one instead
+lan_send = vanet_to_lan.add_stage("send", sendLAN, error_delay=0.25,
+	policy=DROP_NEWEST if pipelineOverflow == DROP_OLDEST else pipelineOverflow)
+lan_to_vanet.add_stage("forward", forwardLAN)
+
+# Runs the Forwarder's timers, and with the event backend both sockets as well
+dispatcher = UDPDispatcher(logger=c1t2x_logger)
+forwarder = None
+if not error:
+	if networkBackend == 'event':
+		forwarder = makeForwarder(lan.send_data, dispatcher.call_later)
+	else:
+		forwarder = makeForwarder(queueLAN, callLater)
+
+def handleVANET(pkt):
+	# Hand-off to the VANET -> LAN stages for one received datagram
+	if not vanet_to_lan.put(pkt):
+		packet_log.warning("VANET receive buffer full, dropped a packet")
 
 def VANET_listening_thread():
-	global error, waiting_for_ack
-	previous_packet_received = ""
-	ack = b"1"
+	global error
 	while not vanet.error:
 		with mutex:
 			if error:
 				break
 
 		try:
-			pkt = vanet.recv_packets()
-			c1t2x_logger.debug("Received %s from VANET", pkt)
-			if pkt:
-				if not parseVANETPacket:
-					# Check if ack or payload
-					data = pkt[0].decode('utf-8')
-					if data == "1":  # Ack
-						with mutex:
-							waiting_for_ack = False
-						c1t2x_logger.info("Received ack")
-					elif data == previous_packet_received:  # Duplicate message received, so just resend ack
-						sendVANET(ack)
-						c1t2x_logger.info("Received duplicate message, resending ack")
-					else:  # New message received, forward it to LAN and send ack
-						sendVANET(ack)
-						sendLAN(pkt[0])
-						previous_packet_received = pkt[0]
-						c1t2x_logger.info("Received new message, sent ack")
-				else:
-					# feature to parse incoming VANET message is not yet enabled
-					c1t2x_logger.error("Feature to parse incoming VANET message is not yet enabled")
-					raise NotImplementedError
-				if printData:
-					print(pkt)
+			# Waits for a datagram, then drains every one queued. The ring slots are reused by the
+			# next call, so each datagram is copied out before it is handed on
+			for data, addr in vanet.recv_many(block=True):
+				pkt = (bytes(data), addr)
+				packet_log.debug("Received %s from VANET", pkt)
+				handleVANET(pkt)
 		except:
 			if printData:
 				print("Waiting to configure LAN")
@@ -172,8 +308,13 @@ def VANET_listening_thread():
 		error = True
 		c1t2x_logger.info("Terminating VANET Thread")
 
+def handleLAN(pkt):
+	# Hand-off to the LAN -> VANET stages for one received datagram
+	if not lan_to_vanet.put(pkt):
+		packet_log.warning("LAN -> VANET buffer full, dropped a packet")
+
 def LAN_listening_thread():
-	global error, waiting_for_ack
+	global error
 
 	while not lan.error:
 		with mutex:
@@ -182,30 +323,8 @@ def LAN_listening_thread():
 				break
 
 		try:
-			pkt = lan.recv_packets()
-			if pkt:
-				if not parseLANPacket:
-					sendVANET(pkt[0])
-					# Wait for ack
-					waiting_for_ack = True
-					c1t2x_logger.info("Message sent, waiting for ack")
-					time.sleep(1.0)
-					for i in range(120):  # Attempt to rebroadcast for 2 minutes before giving up
-						with mutex:
-							if waiting_for_ack:
-								sendVANET(pkt[0])
-								c1t2x_logger.info("Still waiting for ack")
-							else:
-								break
-						time.sleep(1.0)
-					if waiting_for_ack:
-						raise Exception("Ack was never received")
-				else:
-					# feature to parse incoming LAN packet is not enabled
-					# this feature may be used for things like responding to requests from the LAN connection, etc.
-					# there is no intent for this feature to be enabled but it is being allocated space in the code
-					c1t2x_logger.error("Feature to parse incoming LAN is not enabled")
-					raise NotImplementedError
+			for data, addr in lan.recv_many(block=True):
+				handleLAN((bytes(data), addr))
 		except:
 			if printData:
 				print("Waiting to configure VANET")
@@ -217,19 +336,112 @@ def LAN_listening_thread():
 		error = True
 		c1t2x_logger.info("Terminating LAN Thread")
 
-# Removes unnecessary RSU header information
-# Source: https://github.com/usdot-fhwa-stol/carma-platform/blob/develop/engineering_tools/msgIntersect.py
-def strip_header(packet):
-    data = packet.decode('ascii')
-    idx = data.find("Payload=")
-    payload = data[idx+8:-1]
-    encoded = payload.encode('utf-8')
-    return unhexlify(encoded)
+def run_event_backend():
+	# Single dispatcher thread: both sockets are non-blocking and registered with epoll,
+	# packets are forwarded from readiness callbacks and retransmits run on dispatcher timers
+	if lan.sock is None or vanet.sock is None:
+		c1t2x_logger.error("Event backend requires both the LAN and VANET sockets to be bound")
+		return None
+
+	dispatcher.register(lan, forwarder.on_lan_packet)
+	dispatcher.register(vanet, forwarder.on_vanet_packet)
+	# The dispatcher keeps the packet callbacks it was given, so only the sockets are traced
+	profiler.add(lan, 'recv_pending', 'lan.socket_recv')
+	profiler.add(vanet, 'recv_pending', 'vanet.socket_recv')
+	profiler.add(forwarder, 'send_lan', 'lan.socket_send')
+	profiler.add(vanet, 'send_data', 'vanet.socket_send')
+	dispatcher.start()
+	c1t2x_logger.debug("Event dispatcher started")
+	return dispatcher
+
+# Stats sources, served on STATS_SOCKET and/or written to STATS_SNAPSHOT_FILE
+registry = MetricsRegistry()
+for name, net in (('lan', lan), ('vanet', vanet)):
+	if not error:
+		registry.register(name, net.stats)
+if forwarder is not None:
+	if networkBackend == 'threaded':
+		registry.register('forwarding', lambda: runLocked(forwarder.stats))
+		registry.register('pipelines', lambda: {'vanet_to_lan': vanet_to_lan.stats(), 'lan_to_vanet': lan_to_vanet.stats()})
+	else:
+		registry.register('forwarding', forwarder.stats)
+if router is not None:
+	registry.register('radio_apps', router.stats)
+if decode_pool is not None:
+	registry.register('decode_pool', decode_pool.stats)
+
+# The first message forwarded in either direction; acks sent before it do not count
+if forwarder is not None:
+	startup.watch(forwarder, 'send_lan', 'VANET -> LAN')
+	startup.watch(forwarder, '_transmit', 'LAN -> VANET')
+registry.register('startup', startup.stats)
+
+# Stage tracing and profiling, switched on with SIGUSR2/SIGUSR1 or on CONTROL_SOCKET (Networking/profiling.py)
+profiler = RuntimeProfiler(logs_directory, c1t2x_logger, top=profileTop, tracemalloc_frames=tracemallocFrames)
+profiler.add(c1t2x_logger, 'handle', 'log')
+profiler.add(packet_log, 'handle', 'log')
+if networkBackend == 'threaded' and not error:
+	this_module = sys.modules[__name__]
+	profiler.add(vanet, 'recv_many', 'vanet.socket_recv')
+	profiler.add(this_module, 'handleVANET', 'vanet.receive')
+	profiler.add(lan, 'recv_many', 'lan.socket_recv')
+	profiler.add(this_module, 'handleLAN', 'lan.receive')
+	for stage in vanet_to_lan.stages + lan_to_vanet.stages:
+		profiler.add(stage, 'fn', stage.name)
+	profiler.add(vanet, 'send_data', 'vanet.socket_send')
+	profiler.add(lan, 'send_data', 'lan.socket_send')
+registry.register('profiler', profiler.stats)
+
+def close_outputs(endpoints):
+	# Stats endpoints and the capture file, closed on shutdown so buffered records are written
+	for endpoint in endpoints:
+		endpoint.close()
+	if capture is not None:
+		capture.close()
+	if decode_pool is not None:
+		decode_pool.close()
+
+def ready():
+	# Forwarding runs, the J2735 codec is loaded now if that was put off (FAST_START)
+	startup.mark('start')
+	startup.set_ready()
+	if isinstance(j2735_codec, LazyCodec):
+		j2735_codec.start()
 
 def main():
 
 	global error
 
+	startup.mark('setup')
+	if router is not None:
+		router.start()
+		c1t2x_logger.debug("Radio app workers started")
+
+	stats_endpoints = start_endpoints(registry, statsParams, c1t2x_logger)
+	stats_endpoints += start_control(profiler, controlParams, c1t2x_logger)
+	stats_endpoints.append(profiler)
+	install_signal_handlers(profiler)
+	if traceStages:
+		profiler.start_tracing()
+
+	if networkBackend == 'event':
+		if run_event_backend() is None:
+			return
+		ready()
+		try:
+			while not error and dispatcher.thread.is_alive():
+				time.sleep(1)
+		except KeyboardInterrupt:
+			c1t2x_logger.critical("Keyboard Interrupt Occurred")
+		finally:
+			error = True
+			dispatcher.stop()
+			close_outputs(stats_endpoints)
+			if router is not None:
+				router.close()
+			c1t2x_logger.critical("\n---------------------------\nTerminating C1T2X OBU Logger\n---------------------------")
+		return
+
 	# set up threads
 	threads = []
 
@@ -239,12 +451,19 @@ def main():
 	threads.append(LAN_mt)
 	threads.append(VANET_mt)
 
+	# Forwarder timers (retransmits, repeats, delayed acks, rate limits) run on the dispatcher thread
+	dispatcher.start()
+	vanet_to_lan.start()
+	lan_to_vanet.start()
+
 	for thread in threads:
 		c1t2x_logger.debug("Starting %s", thread.name)
 		thread.daemon=True
 		thread.start()
-		time.sleep(0.2)
+		if not fastStart:
+			time.sleep(0.2)
 	c1t2x_logger.debug("All Threads Started")
+	ready()
 
 	try:
 		while not error:
@@ -253,6 +472,13 @@ def main():
 		c1t2x_logger.critical("Keyboard Interrupt Occurred")
 	finally:
 		error = True
+		vanet_to_lan.stop()
+		lan_to_vanet.stop()
+		runLocked(forwarder.close)
+		dispatcher.stop()
+		close_outputs(stats_endpoints)
+		if router is not None:
+			router.close()
 		c1t2x_logger.critical("\n---------------------------\nTerminating C1T2X OBU Logger\n---------------------------")
 
 # code starts here
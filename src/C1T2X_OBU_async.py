@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# asyncio runtime for the C1T2X OBU. The LAN and VANET sockets configured through UDP_NET are
+# wrapped in asyncio datagram endpoints, forwarding runs in the protocol callbacks, and retransmits
+# are loop timers. Everything runs on one thread, so there is no mutex and no polling.
+# Radio applications can be added as coroutines with AsyncOBU.add_app().
+
+import os, logging, asyncio, signal
+from pathlib import Path, PurePath
+import argparse
+
+from Networking.networking import UDP_NET
+from Networking.forwarding import make_forwarder
+from Messaging.j2735 import J2735Codec, LazyCodec
+from Networking.metrics import MetricsRegistry, start_endpoints
+from Networking.logs import start_logging, packet_logger, paused_logging
+from Networking.capture import CaptureWriter, DIR_IN, DIR_OUT
+from Networking.profiling import RuntimeProfiler, install_signal_handlers, start_control
+from Networking.configs import load_yaml
+from Networking.startup import StartupTimer
+from Apps.router import MessageRouter
+
+LOG_LEVELS = {'DEBUG': logging.DEBUG, 'INFO': logging.INFO, 'ERROR': logging.ERROR, 'WARNING': logging.WARNING}
+
+LOGS_DIRECTORY = PurePath.joinpath(Path.cwd(), "Logs")
+
+def load_params():
+	script_dir = os.path.dirname(__file__)
+	return load_yaml(os.path.join(script_dir, 'config/params.yaml'))
+
+def make_logger(params):
+	# Log file writes happen on a background thread, see Networking/logs.py
+	log_level = params['logging_level']
+	logger = start_logging("C1T2X_OBU", os.path.join(LOGS_DIRECTORY, "c1t2x_OBU.log"), LOG_LEVELS.get(log_level, logging.WARNING),
+		max_bytes=params.get('LOG_MAX_BYTES', 0), backups=params.get('LOG_BACKUPS', 3),
+		packet_sample=params.get('PACKET_LOG_SAMPLE', 1), packet_rate=params.get('PACKET_LOG_RATE', 0))
+	if log_level not in LOG_LEVELS:
+		print("Configured LOGGING LEVEL is invalid. Level is set to WARNING.")
+		logger.warning("Configured LOGGING LEVEL is invalid. Level is set to WARNING.")
+	return logger
+
+
+class UDPNetProtocol(asyncio.DatagramProtocol):
+
+	def __init__(self, net, on_packet):
+		self.net = net
+		self.on_packet = on_packet
+		self.transport = None
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def datagram_received(self, data, addr):
+		# checks if received packet is from self
+		if self.net.filterSelf and addr[0] == self.net.selfIP:
+			self.net.metrics.self_drops += 1
+			return
+		self.net.metrics.packets_in += 1
+		self.net.metrics.bytes_in += len(data)
+		if self.net.capture is not None:
+			self.net.capture.write(DIR_IN, self.net.netType, addr, data)
+		self.net.packetLogger.debug("%s: Received %d bytes from %s", self.net.netType, len(data), addr[0])
+		# asyncio reads up to 256 KiB per datagram, so only fragments need handling here
+		data = self.net.reassemble(data, addr)
+		if data is not None:
+			self.on_packet((data, addr))
+
+	def error_received(self, exc):
+		self.net.metrics.recv_failures += 1
+		self.net.logger.warning("{}: Socket error: {}".format(self.net.netType, exc))
+
+	def sendto(self, packet):
+		if self.transport is None or self.transport.is_closing():
+			self.net.metrics.send_failures += 1
+			self.net.logger.warning("Attempted to send message to the {} - it may not yet be connected".format(self.net.netType))
+			return
+		if self.net.fragmenter is not None and len(packet) > self.net.fragmentSize:
+			for fragment in self.net.fragmenter.split(packet):
+				self.sendto(fragment)
+			return
+		self.transport.sendto(packet, (self.net.sendIP, self.net.sendPORT))
+		self.net.metrics.packets_out += 1
+		self.net.metrics.bytes_out += len(packet)
+		if self.net.capture is not None:
+			self.net.capture.write(DIR_OUT, self.net.netType, (self.net.sendIP, self.net.sendPORT), packet)
+		self.net.packetLogger.debug("%s: Sent %d bytes to %s", self.net.netType, len(packet), self.net.sendIP)
+
+
+class AsyncOBU:
+
+	def __init__(self, params, logger, print_data=False, startup=None):
+
+		self.params = params
+		self.logger = logger
+		self.print_data = print_data
+		self.startup = startup if startup is not None else StartupTimer(logger)
+
+		self.lan = None
+		self.vanet = None
+		self.lan_protocol = None
+		self.vanet_protocol = None
+		self.forwarder = None
+		self.router = None
+		self.registry = MetricsRegistry()
+		self.stats_endpoints = []
+		self.profiler = RuntimeProfiler(LOGS_DIRECTORY, logger, top=params.get('PROFILE_TOP', 40),
+			tracemalloc_frames=params.get('TRACEMALLOC_FRAMES', 10))
+		self.capture = None
+		self.decode_pool = None
+
+		self.apps = set()
+		self.stopped = None
+
+	async def start(self):
+		loop = asyncio.get_running_loop()
+		self.stopped = asyncio.Event()
+
+		params = self.params
+		interface_wait = params.get('INTERFACE_WAIT', 0)
+		self.lan = UDP_NET(CONFIG_FILE='LAN_params.yaml', logger=self.logger, interface_wait=interface_wait)
+		self.lan.start_connection()
+		self.vanet = UDP_NET(CONFIG_FILE='VANET_params.yaml', logger=self.logger, interface_wait=interface_wait)
+		self.vanet.start_connection()
+		self.startup.mark('interfaces')
+		if params.get('CAPTURE_FILE'):
+			self.capture = CaptureWriter(params['CAPTURE_FILE'], params.get('CAPTURE_MAX_BYTES', 0), params.get('CAPTURE_BACKUPS', 3))
+			self.lan.set_capture(self.capture)
+			self.vanet.set_capture(self.capture)
+			self.logger.info("Capturing packets to {}".format(params['CAPTURE_FILE']))
+
+		codec = None
+		if params['VANET_DECODE']:
+			script_dir = os.path.dirname(__file__)
+			load = lambda: J2735Codec.load(os.path.join(script_dir, params.get('J2735_ASN_DIR', 'config/J2735')),
+				os.path.join(script_dir, params.get('CODEC_CACHE_DIR', 'Cache')), logger=self.logger)
+			if params.get('FAST_START', False) and params.get('DECODE_WORKERS', 0) <= 0:
+				# Loaded in the background once forwarding runs
+				codec = LazyCodec(load, self.logger)
+			else:
+				codec = load()
+			if codec is not None and params.get('DECODE_WORKERS', 0) > 0:
+				# Radio apps get their frames decoded in worker processes
+				from Messaging.decode_pool import DecodePool
+				with paused_logging():
+					codec = self.decode_pool = DecodePool(codec, workers=params['DECODE_WORKERS'],
+						timeout=params.get('DECODE_TIMEOUT', 1.0), logger=self.logger)
+
+		if params['RADIO_APPS']:
+			self.router = MessageRouter(workers=params.get('RADIO_APP_WORKERS', 2), logger=self.logger)
+			self.router.load(params.get('RADIO_APP_HANDLERS', []))
+			self.router.start()
+
+		self.forwarder = make_forwarder(params, self.send_lan, self.send_vanet, loop.call_later, self.logger,
+			parse_lan=params['LAN_DECODE'], parse_vanet=params['VANET_DECODE'], print_data=self.print_data, codec=codec,
+			on_message=self.router.dispatch if self.router is not None else None,
+			self_ip=getattr(self.vanet, 'selfIP', None), fragment_size=self.vanet.fragmentSize)
+
+		_, self.lan_protocol = await loop.create_datagram_endpoint(
+			lambda: UDPNetProtocol(self.lan, self.forwarder.on_lan_packet), sock=self.lan.sock)
+		_, self.vanet_protocol = await loop.create_datagram_endpoint(
+			lambda: UDPNetProtocol(self.vanet, self.forwarder.on_vanet_packet), sock=self.vanet.sock)
+
+		self.registry.register('lan', self.lan.stats)
+		self.registry.register('vanet', self.vanet.stats)
+		self.registry.register('forwarding', self.forwarder.stats)
+		if self.router is not None:
+			self.registry.register('radio_apps', self.router.stats)
+		if self.decode_pool is not None:
+			self.registry.register('decode_pool', self.decode_pool.stats)
+		self.registry.register('profiler', self.profiler.stats)
+		self.registry.register('startup', self.startup.stats)
+		self.stats_endpoints = start_endpoints(self.registry, params, self.logger)
+
+		# The first message forwarded in either direction; acks sent before it do not count
+		self.startup.watch(self.forwarder, 'send_lan', 'VANET -> LAN')
+		self.startup.watch(self.forwarder, '_transmit', 'LAN -> VANET')
+
+		# Traced stages: the forwarding done for each datagram, and the sends
+		profiler = self.profiler
+		profiler.add(self.lan_protocol, 'on_packet', 'lan.receive')
+		profiler.add(self.vanet_protocol, 'on_packet', 'vanet.receive')
+		profiler.add(self.forwarder, 'send_lan', 'lan.socket_send')
+		profiler.add(self.forwarder, 'send_vanet', 'vanet.socket_send')
+		profiler.add(self.logger, 'handle', 'log')
+		profiler.add(packet_logger(self.logger), 'handle', 'log')
+		self.stats_endpoints += start_control(profiler, params, self.logger)
+		self.stats_endpoints.append(profiler)
+		if params.get('TRACE_STAGES', False):
+			profiler.start_tracing()
+		self.logger.info("asyncio OBU started")
+		self.startup.mark('start')
+		self.startup.set_ready()
+		if isinstance(codec, LazyCodec):
+			codec.start()
+
+	def send_lan(self, packet):
+		self.lan_protocol.sendto(packet)
+
+	def send_vanet(self, packet):
+		self.vanet_protocol.sendto(packet)
+
+	def add_app(self, app):
+		# Runs app(obu) as a task that is cancelled when the OBU stops
+		task = asyncio.get_running_loop().create_task(app(self))
+		self.apps.add(task)
+		task.add_done_callback(self._app_done)
+		return task
+
+	def _app_done(self, task):
+		self.apps.discard(task)
+		if not task.cancelled() and task.exception() is not None:
+			self.logger.error("Radio app failed: %r", task.exception())
+
+	def stop(self):
+		if self.stopped is not None:
+			self.stopped.set()
+
+	async def run(self):
+		await self.start()
+		try:
+			await self.stopped.wait()
+		finally:
+			await self.close()
+
+	async def close(self):
+		if self.forwarder is not None:
+			self.forwarder.close()
+		for task in list(self.apps):
+			task.cancel()
+		if self.apps:
+			await asyncio.gather(*self.apps, return_exceptions=True)
+		for protocol in (self.lan_protocol, self.vanet_protocol):
+			if protocol is not None and protocol.transport is not None:
+				protocol.transport.close()
+		for endpoint in self.stats_endpoints:
+			endpoint.close()
+		if self.capture is not None:
+			self.capture.close()
+		if self.router is not None:
+			self.router.close()
+		if self.decode_pool is not None:
+			self.decode_pool.close()
+		self.logger.critical("\n---------------------------\nTerminating C1T2X OBU Logger\n---------------------------")
+
+async def main(print_data):
+	startup = StartupTimer()
+	startup.mark('imports')
+	try:
+		params = load_params()
+	except Exception as e:
+		print("Unable to import yaml configs")
+		raise e
+	startup.mark('configs')
+
+	logger = make_logger(params)
+	startup.logger = logger
+	logger.info("\n---------------------------\nStarting C1T2X OBU Logger (asyncio)\n---------------------------")
+	obu = AsyncOBU(params, logger, print_data=print_data or params['print_data'], startup=startup)
+
+	loop = asyncio.get_running_loop()
+	for sig in (signal.SIGINT, signal.SIGTERM):
+		loop.add_signal_handler(sig, obu.stop)
+	install_signal_handlers(obu.profiler, loop.add_signal_handler)
+
+	await obu.run()
+
+# code starts here
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("-p", "--print", help="prints output to the terminal", action="store_true")
+	args = parser.parse_args()
+
+	# print to terminal that C1T2X radio is starting up
+	print("----------------------------------------------------\nSTARTING C1T2X RADIO\n----------------------------------------------------")
+
+	asyncio.run(main(args.print))
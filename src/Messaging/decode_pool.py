@@ -0,0 +1,298 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code decodes J2735 MessageFrames in worker processes (DECODE_WORKERS in config/params.yaml),
+# so UPER decoding for the radio apps runs on the other cores instead of competing for the GIL
+# with the forwarding threads.
+#
+# Payloads and results are passed through one shared memory block split into slots. A slot holds
+# the UPER payload followed by room for the decoded value, which the worker writes with marshal
+# (asn1tools values are dicts, tuples, bytes, ints and strs). Tasks and results are fixed size
+# struct records on pipes, (slot, length) and (slot, length, status), so nothing is pickled on the
+# way in and only the rare value marshal cannot write is pickled on the way out. Every worker has
+# its own task pipe and all of them share the result pipe; records are smaller than PIPE_BUF, so
+# the workers cannot interleave them.
+#
+# Workers are forked when the pool is created and inherit the loaded codec. A process forked while
+# other threads run can inherit a lock one of them holds, so the pool must be created before the
+# OBU starts its forwarding threads, with the logging listeners paused (logs.paused_logging).
+# For the same reason a worker that dies is not forked again: the decodes it had are done inline
+# by the collector thread, and its share of new decodes goes to the other workers, or is decoded
+# inline by the caller once no worker is left.
+
+import os, marshal, pickle, struct, queue, select, multiprocessing
+from multiprocessing import shared_memory
+from threading import Thread, Lock
+
+from Messaging.j2735 import FRAME_TYPE
+
+TASK = struct.Struct("=II")
+RESULT = struct.Struct("=IIB")
+STOP_SLOT = 0xFFFFFFFF
+
+# Result status: how the result area of the slot was written
+MARSHALED = 0
+PICKLED = 1
+FAILED = 2
+
+def _decode_worker(codec, shm, stride, payload_size, type_name, task_r, result_w):
+	buf = shm.buf
+	result_size = stride - payload_size
+	while True:
+		task = os.read(task_r, TASK.size)
+		if not task:
+			break
+		slot, length = TASK.unpack(task)
+		if slot == STOP_SLOT:
+			break
+		base = slot * stride
+		try:
+			value = codec.decode(type_name, bytes(buf[base:base + length]))
+			try:
+				out, status = marshal.dumps(value), MARSHALED
+			except ValueError:
+				out, status = pickle.dumps(value, pickle.HIGHEST_PROTOCOL), PICKLED
+			if len(out) > result_size:
+				raise ValueError("decoded value of {} bytes does not fit in a {} byte slot".format(len(out), result_size))
+		except Exception as excep:
+			out, status = "{}: {}".format(type(excep).__name__, excep).encode('utf-8')[:result_size], FAILED
+		start = base + payload_size
+		buf[start:start + len(out)] = out
+		os.write(result_w, RESULT.pack(slot, len(out), status))
+
+
+class DecodeFuture:
+	# A held lock instead of an Event, which costs several times more to create per message
+	__slots__ = ("pending", "finished", "value", "error")
+
+	def __init__(self):
+		self.pending = Lock()
+		self.pending.acquire()
+		self.finished = False
+		self.value = None
+		self.error = None
+
+	def done(self):
+		return self.finished
+
+	def set_done(self):
+		self.finished = True
+		self.pending.release()
+
+	def result(self, timeout=None):
+		if not self.finished:
+			if not self.pending.acquire(timeout=-1 if timeout is None else timeout):
+				raise TimeoutError("MessageFrame decode did not finish in time")
+			self.pending.release()
+		if self.error is not None:
+			raise ValueError(self.error)
+		return self.value
+
+
+class _Worker:
+	__slots__ = ("process", "task_w", "alive")
+
+	def __init__(self, process, task_w):
+		self.process = process
+		self.task_w = task_w
+		self.alive = True
+
+
+class DecodePool:
+
+	def __init__(self, codec, workers=2, slots=64, payload_size=2048, result_size=32768, type_name=FRAME_TYPE,
+			timeout=1.0, logger=None):
+
+		self.codec = codec
+		self.type_name = type_name
+		self.logger = logger
+		self.slots = slots
+		self.payload_size = payload_size
+		self.stride = payload_size + result_size
+		# Longest MessageFrame.value waits for a worker before decoding the frame itself
+		self.timeout = timeout
+
+		ctx = multiprocessing.get_context('fork')
+		self.shm = shared_memory.SharedMemory(create=True, size=slots * self.stride)
+		self.buf = self.shm.buf
+		self.result_r, self.result_w = os.pipe()
+		self.free = queue.SimpleQueue()
+		for slot in range(slots):
+			self.free.put(slot)
+		self.futures = [None] * slots
+		self.lengths = [0] * slots
+		# Worker each slot was handed to, so the decodes of a dead worker can be finished
+		self.owners = [None] * slots
+		# Taken to hand a slot to a worker and to retire a dead one, never while decoding
+		self.lock = Lock()
+
+		self.workers = []
+		for i in range(workers):
+			task_r, task_w = os.pipe()
+			process = ctx.Process(target=_decode_worker, name="J2735Decode-{}".format(i), daemon=True,
+				args=(codec, self.shm, self.stride, payload_size, type_name, task_r, self.result_w))
+			process.start()
+			# Only the worker reads its pipe: once it is gone, writing to the pipe fails
+			os.close(task_r)
+			self.workers.append(_Worker(process, task_w))
+		self.next_worker = 0
+		self.collector = Thread(target=self._collect, name="J2735DecodeResults", daemon=True)
+		self.collector.start()
+		self.closed = False
+
+		# Counters
+		self.submitted = 0
+		self.decoded = 0
+		self.failed = 0
+		self.pickled = 0
+		self.inline = 0
+		self.worker_deaths = 0
+		self.recovered = 0
+
+	def submit(self, data):
+		# Starts decoding a UPER MessageFrame in a worker, returns a DecodeFuture
+		# Returns None if the pool is closed, full, has no worker left, or the payload does not fit in a slot
+		if self.closed or len(data) > self.payload_size:
+			return None
+		try:
+			slot = self.free.get_nowait()
+		except queue.Empty:
+			return None
+		base = slot * self.stride
+		self.buf[base:base + len(data)] = data
+		self.lengths[slot] = len(data)
+		future = DecodeFuture()
+		with self.lock:
+			for _ in range(len(self.workers)):
+				worker = self.workers[self.next_worker]
+				self.next_worker = (self.next_worker + 1) % len(self.workers)
+				if not worker.alive:
+					continue
+				self.futures[slot] = future
+				self.owners[slot] = worker
+				try:
+					os.write(worker.task_w, TASK.pack(slot, len(data)))
+				except OSError:
+					# Died since the collector last looked, it is retired when the collector sees it
+					self.futures[slot] = self.owners[slot] = None
+					continue
+				self.submitted += 1
+				return future
+		self.free.put(slot)
+		return None
+
+	def decode(self, type_name, data, timeout=None):
+		# Same interface as J2735Codec.decode, so the pool can be the codec of a MessageFrame
+		# Decodes inline if no worker can take the payload or it is not decoded within timeout
+		# (default: the pool's timeout)
+		future = self.submit(data) if type_name == self.type_name else None
+		if future is None:
+			return self.decode_inline(type_name, data)
+		try:
+			return future.result(self.timeout if timeout is None else timeout)
+		except TimeoutError:
+			return self.decode_inline(type_name, data)
+
+	def decode_inline(self, type_name, data):
+		# Decodes on the calling thread
+		self.inline += 1
+		return self.codec.decode(type_name, data)
+
+	def encode(self, type_name, value):
+		return self.codec.encode(type_name, value)
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		with self.lock:
+			for worker in self.workers:
+				try:
+					os.write(worker.task_w, TASK.pack(STOP_SLOT, 0))
+				except OSError:
+					pass
+		for worker in self.workers:
+			worker.process.join(1.0)
+			if worker.process.is_alive():
+				worker.process.terminate()
+		os.write(self.result_w, RESULT.pack(STOP_SLOT, 0, 0))
+		self.collector.join(1.0)
+		for fd in [worker.task_w for worker in self.workers] + [self.result_r, self.result_w]:
+			os.close(fd)
+		self.shm.close()
+		self.shm.unlink()
+
+	def stats(self):
+		return {'workers': sum(worker.alive for worker in self.workers), 'worker_deaths': self.worker_deaths,
+			'submitted': self.submitted, 'decoded': self.decoded, 'failed': self.failed, 'pickled': self.pickled,
+			'recovered': self.recovered, 'decoded_inline': self.inline, 'free_slots': self.free.qsize()}
+
+	def _collect(self):
+		# Completes the futures of finished decodes and frees their slots, and finishes the decodes
+		# of workers that died
+		while True:
+			sentinels = {worker.process.sentinel: worker for worker in self.workers if worker.alive}
+			ready, _, _ = select.select([self.result_r] + list(sentinels), [], [])
+			if self.result_r in ready:
+				# Results first: a worker may have written its last result just before it died
+				slot, length, status = RESULT.unpack(os.read(self.result_r, RESULT.size))
+				if slot == STOP_SLOT:
+					return
+				self._complete(slot, length, status)
+				continue
+			for fd in ready:
+				self._retire(sentinels[fd])
+
+	def _complete(self, slot, length, status):
+		future = self.futures[slot]
+		self.futures[slot] = self.owners[slot] = None
+		start = slot * self.stride + self.payload_size
+		result = self.buf[start:start + length]
+		if status == MARSHALED:
+			future.value = marshal.loads(result)
+			self.decoded += 1
+		elif status == PICKLED:
+			future.value = pickle.loads(result)
+			self.decoded += 1
+			self.pickled += 1
+		else:
+			future.error = bytes(result).decode('utf-8', 'replace')
+			self.failed += 1
+		result.release()
+		self.free.put(slot)
+		future.set_done()
+
+	def _retire(self, worker):
+		# A worker died: no new decodes go to it, and the ones it had are decoded here
+		with self.lock:
+			worker.alive = False
+			slots = [slot for slot in range(self.slots) if self.owners[slot] is worker]
+			for slot in slots:
+				self.owners[slot] = None
+		self.worker_deaths += 1
+		if self.logger:
+			self.logger.error("J2735 decode worker %s exited with code %s, %d decode(s) finished inline, %d worker(s) left",
+				worker.process.name, worker.process.exitcode, len(slots), sum(w.alive for w in self.workers))
+		for slot in slots:
+			future = self.futures[slot]
+			self.futures[slot] = None
+			base = slot * self.stride
+			try:
+				future.value = self.codec.decode(self.type_name, bytes(self.buf[base:base + self.lengths[slot]]))
+				self.recovered += 1
+			except Exception as excep:
+				future.error = "{}: {}".format(type(excep).__name__, excep)
+				self.failed += 1
+			self.free.put(slot)
+			future.set_done()
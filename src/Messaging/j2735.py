@@ -0,0 +1,232 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code decodes SAE J2735 MessageFrames (BSM, SPaT, MAP, CARMA Mobility messages, etc.)
+#
+# The J2735 ASN.1 files are licensed by SAE and are not part of this repository. Place the *.asn
+# files in the directory set by J2735_ASN_DIR in config/params.yaml. Compiling the full spec takes
+# seconds on a Pi, so the compiled codec is pickled into CODEC_CACHE_DIR and reused on the next boot
+# for as long as the spec files and asn1tools version are unchanged. Loading the cache still imports
+# asn1tools, so with FAST_START the OBU loads it on a background thread once forwarding runs
+# (LazyCodec).
+#
+# Decoding is lazy. In UPER the MessageFrame starts with its extension bit followed by the 15 bit
+# messageId, so the message type is read from the first two bytes without the codec. The full
+# payload is only decoded when MessageFrame.value is accessed, or in the background by a
+# decode_pool.DecodePool after MessageFrame.prefetch().
+
+import os, glob, hashlib, pickle
+from threading import Thread, Event
+
+# DSRCmsgID values (J2735 2016) and the CARMA Mobility messages carried in the test message range
+MESSAGE_NAMES = {
+	18: 'MAP',
+	19: 'SPAT',
+	20: 'BSM',
+	21: 'CSR',
+	22: 'EVA',
+	23: 'ICA',
+	24: 'NMEA',
+	25: 'PDM',
+	26: 'PVD',
+	27: 'RSA',
+	28: 'RTCM',
+	29: 'SRM',
+	30: 'SSM',
+	31: 'TIM',
+	32: 'PSM',
+	240: 'MobilityRequest',
+	241: 'MobilityResponse',
+	242: 'MobilityPath',
+	243: 'MobilityOperation',
+}
+MESSAGE_IDS = {name: msg_id for msg_id, name in MESSAGE_NAMES.items()}
+
+FRAME_TYPE = 'MessageFrame'
+
+def peek_message_id(payload):
+	# Reads the messageId of a UPER encoded MessageFrame without decoding it
+	if len(payload) < 2:
+		raise ValueError("MessageFrame is too short")
+	return ((payload[0] << 8) | payload[1]) & 0x7FFF
+
+
+class MessageFrame:
+	__slots__ = ("raw", "message_id", "codec", "_value", "_future")
+
+	def __init__(self, raw, codec=None):
+		self.raw = raw
+		self.message_id = peek_message_id(raw)
+		self.codec = codec
+		self._value = None
+		self._future = None
+
+	def prefetch(self):
+		# Starts the full decode in a worker process when the codec is a DecodePool
+		if self._value is None and self._future is None and hasattr(self.codec, 'submit'):
+			self._future = self.codec.submit(self.raw)
+
+	@property
+	def name(self):
+		return MESSAGE_NAMES.get(self.message_id, str(self.message_id))
+
+	@property
+	def value(self):
+		# Full decode of the MessageFrame, done on first access and kept
+		if self._value is None:
+			if self._future is not None:
+				future, self._future = self._future, None
+				try:
+					self._value = future.result(self.codec.timeout)
+				except TimeoutError:
+					# The worker is stuck or busy, do not wait on it any longer
+					self._value = self.codec.decode_inline(FRAME_TYPE, bytes(self.raw))
+				return self._value
+			if self.codec is None:
+				raise RuntimeError("No J2735 codec loaded, set J2735_ASN_DIR to decode {} payloads".format(self.name))
+			self._value = self.codec.decode(FRAME_TYPE, bytes(self.raw))
+		return self._value
+
+	def __repr__(self):
+		return "MessageFrame({}, {} bytes)".format(self.name, len(self.raw))
+
+
+class J2735Codec:
+
+	def __init__(self, compiled, source=""):
+		self.compiled = compiled
+		self.source = source
+
+	def decode(self, type_name, data):
+		return self.compiled.decode(type_name, data)
+
+	def encode(self, type_name, value):
+		return self.compiled.encode(type_name, value)
+
+	def frame(self, raw):
+		return MessageFrame(raw, self)
+
+	@classmethod
+	def load(cls, asn_dir, cache_dir, codec='uper', logger=None):
+		# Returns the compiled codec, from the cache when possible
+		# Returns None if there are no ASN.1 files to compile
+		files = sorted(glob.glob(os.path.join(asn_dir, '*.asn')))
+		if not files:
+			if logger:
+				logger.warning("No J2735 ASN.1 files found in {}, payloads will not be decoded".format(asn_dir))
+			return None
+
+		digest = hashlib.sha256(codec.encode('ascii'))
+		for fname in files:
+			with open(fname, 'rb') as f:
+				digest.update(f.read())
+		compiled, cache_file = _compile_cached(digest, cache_dir, "j2735_" + codec,
+			lambda asn1tools: asn1tools.compile_files(files, codec), logger)
+		if cache_file is not None:
+			if logger:
+				logger.info("Loaded cached J2735 codec from {}".format(cache_file))
+			return cls(compiled, cache_file)
+		if logger:
+			logger.info("Compiled J2735 codec from {} ASN.1 files".format(len(files)))
+		return cls(compiled, asn_dir)
+
+
+class LazyCodec:
+	# Stands in for a J2735Codec that is loaded on a background thread (FAST_START), so that loading it,
+	# which imports asn1tools, does not hold up the start of forwarding. Decoding waits for the load.
+
+	def __init__(self, load, logger=None):
+		# load() returns the codec, or None when there is none
+		self.logger = logger
+		self.codec = None
+		self.loaded = Event()
+		self.thread = Thread(target=self._load, args=(load,), name="J2735CodecLoad", daemon=True)
+
+	def start(self):
+		self.thread.start()
+		return self
+
+	def decode(self, type_name, data):
+		return self._codec().decode(type_name, data)
+
+	def encode(self, type_name, value):
+		return self._codec().encode(type_name, value)
+
+	def _codec(self):
+		if not self.loaded.is_set():
+			self.loaded.wait()
+		if self.codec is None:
+			raise RuntimeError("No J2735 codec loaded, set J2735_ASN_DIR to decode payloads")
+		return self.codec
+
+	def _load(self, load):
+		try:
+			self.codec = load()
+		except Exception as excep:
+			if self.logger:
+				self.logger.error("Unable to load the J2735 codec: {}".format(excep))
+		finally:
+			self.loaded.set()
+
+
+def compile_spec(spec, cache_dir, codec='uper'):
+	# asn1tools.compile_string, cached like the J2735 codec (test tools)
+	digest = hashlib.sha256(codec.encode('ascii'))
+	digest.update(spec.encode('utf-8'))
+	return _compile_cached(digest, cache_dir, "spec_" + codec, lambda asn1tools: asn1tools.compile_string(spec, codec))[0]
+
+def _asn1tools_version():
+	# Read from the installed package without importing it, importlib.metadata alone takes longer
+	# to import than the cached codec takes to load
+	try:
+		import importlib.util
+		spec = importlib.util.find_spec('asn1tools')
+		for location in spec.submodule_search_locations or ():
+			with open(os.path.join(location, 'version.py'), 'rb') as f:
+				return f.read()
+	except Exception:
+		pass
+	try:
+		from importlib.metadata import version
+		return version('asn1tools').encode('ascii')
+	except Exception:
+		return b""
+
+def _compile_cached(digest, cache_dir, prefix, compile_fn, logger=None):
+	# Returns (compiled, cache file it was loaded from or None), compile_fn(asn1tools) compiles it
+	# The cache is keyed by digest and the asn1tools version, asn1tools is only imported to compile
+	digest.update(_asn1tools_version())
+	cache_file = os.path.join(cache_dir, "{}_{}.pickle".format(prefix, digest.hexdigest()[:16]))
+
+	if os.path.exists(cache_file):
+		try:
+			with open(cache_file, 'rb') as f:
+				return pickle.load(f), cache_file
+		except Exception as excep:
+			if logger:
+				logger.warning("Unable to load cached codec {}: {}".format(cache_file, excep))
+
+	import asn1tools
+	compiled = compile_fn(asn1tools)
+
+	try:
+		os.makedirs(cache_dir, 0o775, exist_ok=True)
+		tmp_file = cache_file + ".tmp"
+		with open(tmp_file, 'wb') as f:
+			pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_file, cache_file)
+	except Exception as excep:
+		if logger:
+			logger.warning("Unable to cache codec in {}: {}".format(cache_dir, excep))
+	return compiled, None
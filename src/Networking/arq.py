@@ -0,0 +1,383 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code implements a sliding-window automatic repeat request (ARQ) protocol for the VANET.
+# Frames carry a 32 bit sequence number, and acks carry a cumulative ack plus a selective ack bitmap,
+# so many packets can be in flight at once instead of stop-and-wait's single packet.
+#
+# On a broadcast VANET an ack only proves that one radio received a frame. With an ack quorum the
+# sender tracks which radios acked each frame and keeps retransmitting until enough of them did.
+#
+# Neither class owns a socket or a thread. The caller hands in the function used to put bytes on
+# the wire and drives retransmission by calling ARQSender.poll(), so the same code can be run from
+# the OBU threads or from an event loop.
+
+import time, random, struct, socket
+from threading import Condition
+from collections import OrderedDict
+
+from Networking.metrics import Histogram
+from Networking.rtt import RTTEstimator
+
+# Frame layout (network byte order)
+#   DATA: magic(1) type(1) seq(4) window_base(4) payload
+#   ACK:  magic(1) type(1) sender_ip(4) cumulative_ack(4) sack_bitmap(8)
+# window_base is the oldest sequence number the sender still holds, so a receiver never waits on a
+# frame the sender has already given up on. sender_ip is the radio whose frames are acked, every
+# other radio ignores the ack. cumulative_ack is the next sequence number the receiver expects, bit i of the sack bitmap
+# is set when cumulative_ack + 1 + i has also been received.
+ARQ_MAGIC = 0xC1
+ARQ_DATA = 0x01
+ARQ_ACK = 0x02
+
+DATA_HEADER = struct.Struct("!BBII")
+ACK_FRAME = struct.Struct("!BB4sIQ")
+
+SACK_BITS = 64
+SEQ_MASK = 0xFFFFFFFF
+SEQ_HALF = 0x80000000
+
+def seq_diff(a, b):
+	# Signed distance from b to a in 32 bit serial number arithmetic
+	d = (a - b) & SEQ_MASK
+	return d - (SEQ_MASK + 1) if d >= SEQ_HALF else d
+
+def is_arq_frame(data):
+	# Legacy acks (b"1") and driver packets ("Version=...") never start with the magic byte
+	return len(data) >= DATA_HEADER.size and data[0] == ARQ_MAGIC
+
+def frame_type(data):
+	return data[1]
+
+def encode_data(seq, base, payload):
+	return DATA_HEADER.pack(ARQ_MAGIC, ARQ_DATA, seq, base) + bytes(payload)
+
+def decode_data(data):
+	_, _, seq, base = DATA_HEADER.unpack_from(data)
+	return seq, base, data[DATA_HEADER.size:]
+
+def pack_ip(ip):
+	try:
+		return socket.inet_aton(ip)
+	except (OSError, TypeError):
+		return bytes(4)
+
+def encode_ack(sender_ip, cumulative, sack):
+	# sender_ip is packed (pack_ip)
+	return ACK_FRAME.pack(ARQ_MAGIC, ARQ_ACK, sender_ip, cumulative, sack)
+
+def decode_ack(data):
+	_, _, sender_ip, cumulative, sack = ACK_FRAME.unpack_from(data)
+	return sender_ip, cumulative, sack
+
+
+class _Outstanding:
+	__slots__ = ("frame", "sent_at", "deadline", "expires", "attempts", "ackers")
+
+	def __init__(self, frame, now, deadline, expires=None):
+		self.frame = frame
+		self.sent_at = now
+		# Next retransmit, and when the frame is given up on regardless of retries (None: never)
+		self.deadline = deadline
+		self.expires = expires
+		self.attempts = 1
+		# Radios that acked the frame so far, only kept with an ack quorum
+		self.ackers = set()
+
+
+class ARQSender:
+
+	def __init__(self, send_fn, window_size=32, retransmit_interval=0.2, max_retries=50, logger=None, clock=time.monotonic,
+			self_ip=None, rtt=None, ack_quorum=1):
+
+		self.send_fn = send_fn
+		# Acks naming another radio are ignored (None accepts every ack)
+		self.self_ip = pack_ip(self_ip) if self_ip else None
+		# A frame is released once this many different radios acked it. With 1, an ack only says
+		# that some radio received the frame, not that every radio in range did
+		self.ack_quorum = max(int(ack_quorum), 1)
+		# The selective ack bitmap can only describe SACK_BITS frames past the cumulative ack
+		self.window_size = min(window_size, SACK_BITS)
+		self.retransmit_interval = retransmit_interval
+		# Retransmit timeouts, adapted to the measured round trip time. Without an estimator every
+		# frame waits a fixed retransmit_interval
+		self.rtt = rtt if rtt is not None else RTTEstimator(retransmit_interval, retransmit_interval, retransmit_interval, jitter=0)
+		self.max_retries = max_retries
+		self.logger = logger
+		self.clock = clock
+
+		# Random initial sequence number so that a restarted radio is not mistaken for a duplicate
+		# and acks meant for another sender fall outside of this sender's window
+		self.base = random.getrandbits(32)
+		self.next_seq = self.base
+		self.outstanding = {}
+
+		self.cond = Condition()
+		self.closed = False
+
+		# Counters
+		self.sent = 0
+		self.retransmits = 0
+		self.acked = 0
+		self.expired = 0
+		self.foreign_acks = 0
+		# Send to ack time, only for frames acked without a retransmit (Karn's rule)
+		self.ack_latency = Histogram()
+
+	def in_flight(self):
+		return seq_diff(self.next_seq, self.base)
+
+	def send(self, payload, block=True, timeout=None, deadline=None):
+		# Queues a payload for reliable delivery, blocking while the window is full
+		# With a deadline the frame is dropped deadline seconds after it was sent if still unacked
+		# Returns False if the window stayed full for the whole timeout or the sender was closed
+		with self.cond:
+			if block:
+				if not self.cond.wait_for(lambda: self.closed or self.in_flight() < self.window_size, timeout):
+					return False
+			elif self.in_flight() >= self.window_size:
+				return False
+			if self.closed:
+				return False
+
+			seq = self.next_seq
+			self.next_seq = (seq + 1) & SEQ_MASK
+			frame = encode_data(seq, self.base, payload)
+			now = self.clock()
+			self.outstanding[seq] = _Outstanding(frame, now, now + self.rtt.timeout(),
+				now + deadline if deadline else None)
+			self.sent += 1
+
+		self.send_fn(frame)
+		return True
+
+	def on_ack(self, data, addr=None):
+		# addr is the (ip, port) the ack came from, needed to count radios towards the ack quorum
+		sender_ip, cumulative, sack = decode_ack(data)
+		if self.self_ip is not None and sender_ip != self.self_ip:
+			self.foreign_acks += 1
+			return
+		if self.ack_quorum > 1:
+			self._on_quorum_ack(addr[0] if addr else None, cumulative, sack)
+			return
+		with self.cond:
+			# Ignore acks that do not fall in this sender's window (stale or meant for another radio)
+			if not 0 <= seq_diff(cumulative, self.base) <= self.in_flight():
+				return
+			now = self.clock()
+			released = 0
+			while self.base != cumulative:
+				out = self.outstanding.pop(self.base, None)
+				if out is not None:
+					released += 1
+					if out.attempts == 1:
+						self.ack_latency.observe(now - out.sent_at)
+						self.rtt.observe(now - out.sent_at)
+				self.base = (self.base + 1) & SEQ_MASK
+			i = 0
+			while sack:
+				if sack & 1:
+					out = self.outstanding.pop((cumulative + 1 + i) & SEQ_MASK, None)
+					if out is not None:
+						released += 1
+						if out.attempts == 1:
+							self.ack_latency.observe(now - out.sent_at)
+							self.rtt.observe(now - out.sent_at)
+				sack >>= 1
+				i += 1
+			self._advance_base()
+			if released:
+				self.acked += released
+				self.cond.notify_all()
+
+	def _on_quorum_ack(self, acker, cumulative, sack):
+		# Every radio acks with its own cumulative ack, so frames are marked one by one and only
+		# released once enough radios have them
+		with self.cond:
+			# A receiver that lags behind may still ack below the window base, but never ahead of it
+			if not -2 * SACK_BITS <= seq_diff(cumulative, self.base) <= self.in_flight():
+				return
+			now = self.clock()
+			released = 0
+			for seq, out in list(self.outstanding.items()):
+				d = seq_diff(seq, cumulative)
+				if d >= 0 and not (0 < d <= SACK_BITS and sack >> (d - 1) & 1):
+					continue
+				out.ackers.add(acker)
+				if len(out.ackers) < self.ack_quorum:
+					continue
+				del self.outstanding[seq]
+				released += 1
+				if out.attempts == 1:
+					self.ack_latency.observe(now - out.sent_at)
+					self.rtt.observe(now - out.sent_at)
+			self._advance_base()
+			if released:
+				self.acked += released
+				self.cond.notify_all()
+
+	def poll(self, now=None):
+		# Retransmits every frame whose timer expired and drops frames that ran out of retries
+		# Returns the time of the next retransmit or expiry, or None if nothing is in flight
+		if now is None:
+			now = self.clock()
+		resend = []
+		next_deadline = None
+		with self.cond:
+			dropped = 0
+			for seq, out in list(self.outstanding.items()):
+				if out.expires is not None and out.expires <= now:
+					del self.outstanding[seq]
+					dropped += 1
+					continue
+				if out.deadline <= now:
+					if out.attempts > self.max_retries:
+						del self.outstanding[seq]
+						dropped += 1
+						continue
+					out.attempts += 1
+					out.sent_at = now
+					out.deadline = now + self.rtt.timeout(out.attempts - 1)
+					resend.append(out.frame)
+				due = out.deadline if out.expires is None else min(out.deadline, out.expires)
+				if next_deadline is None or due < next_deadline:
+					next_deadline = due
+			if dropped:
+				self.expired += dropped
+				self._advance_base()
+				self.cond.notify_all()
+				if self.logger:
+					self.logger.warning("ARQ: %d frame(s) dropped after %d retransmits or their deadline", dropped, self.max_retries)
+			self.retransmits += len(resend)
+
+		for frame in resend:
+			self.send_fn(frame)
+		return next_deadline
+
+	def close(self):
+		with self.cond:
+			self.closed = True
+			self.cond.notify_all()
+
+	def stats(self):
+		return {'sent': self.sent, 'retransmits': self.retransmits, 'acked': self.acked, 'expired': self.expired,
+			'foreign_acks': self.foreign_acks, 'in_flight': self.in_flight(), 'ack_latency': self.ack_latency.snapshot(),
+			'rtt': self.rtt.stats()}
+
+	def _advance_base(self):
+		# Slides the window past sequence numbers that are no longer outstanding
+		while self.base != self.next_seq and self.base not in self.outstanding:
+			self.base = (self.base + 1) & SEQ_MASK
+
+
+class _PeerWindow:
+	__slots__ = ("ip", "expected", "received", "last_seen")
+
+	def __init__(self, ip, expected, now):
+		self.ip = pack_ip(ip)
+		self.expected = expected
+		self.received = set()
+		self.last_seen = now
+
+
+class ARQReceiver:
+
+	def __init__(self, deliver_fn, send_fn, logger=None, max_peers=64, peer_timeout=60.0, clock=time.monotonic):
+
+		# deliver_fn(payload, addr) is called once for every new frame. A frame it returns False for
+		# is neither recorded nor acked, so the sender retransmits it
+		self.deliver_fn = deliver_fn
+		self.send_fn = send_fn
+		self.logger = logger
+
+		# Receive state per sending radio, keyed by sender IP, least recently heard first. Like the
+		# PeerTable, windows idle for longer than peer_timeout are dropped, and past max_peers the
+		# least recently heard is. A dropped radio that sends again starts from its window base
+		self.max_peers = max_peers
+		self.peer_timeout = peer_timeout
+		self.clock = clock
+		self.peers = OrderedDict()
+
+		# Counters
+		self.delivered = 0
+		self.undelivered = 0
+		self.duplicates = 0
+		self.expired_peers = 0
+
+	def on_data(self, data, addr):
+		seq, base, payload = decode_data(data)
+		now = self.clock()
+		peers = self.peers
+		ip = addr[0]
+		peer = peers.get(ip)
+		if peer is not None:
+			peers.move_to_end(ip)
+			peer.last_seen = now
+		if peer is None or not -2 * SACK_BITS <= seq_diff(seq, peer.expected) < 2 * SACK_BITS:
+			# New peer, or a peer that restarted with a fresh sequence space
+			if peer is None:
+				self._expire(now)
+			peer = peers[ip] = _PeerWindow(ip, base, now)
+			if self.logger:
+				self.logger.debug("ARQ: new sequence space from %s starting at %d", ip, base)
+		elif seq_diff(base, peer.expected) > 0:
+			# The sender gave up on everything below its window base, stop waiting for it
+			peer.received = {s for s in peer.received if seq_diff(s, base) >= 0}
+			peer.expected = base
+			while peer.expected in peer.received:
+				peer.received.discard(peer.expected)
+				peer.expected = (peer.expected + 1) & SEQ_MASK
+
+		d = seq_diff(seq, peer.expected)
+		if d < 0 or seq in peer.received:
+			# Already delivered, the ack was probably lost so send it again
+			self.duplicates += 1
+		elif d >= SACK_BITS:
+			# Too far ahead to be acknowledged, let the sender retransmit it later
+			return
+		else:
+			# Frames are handed over as soon as they arrive; V2X messages are independent of each
+			# other so holding one back for an earlier retransmission would only add latency
+			if self.deliver_fn(payload, addr) is False:
+				self.undelivered += 1
+				return
+			self.delivered += 1
+			peer.received.add(seq)
+			while peer.expected in peer.received:
+				peer.received.discard(peer.expected)
+				peer.expected = (peer.expected + 1) & SEQ_MASK
+
+		self.send_fn(self._ack_for(peer))
+
+	def stats(self):
+		return {'delivered': self.delivered, 'undelivered': self.undelivered, 'duplicates': self.duplicates,
+			'peers': len(self.peers), 'expired_peers': self.expired_peers}
+
+	def _expire(self, now):
+		# Makes room for a new peer
+		peers = self.peers
+		while peers:
+			oldest = next(iter(peers.values()))
+			if now - oldest.last_seen <= self.peer_timeout and len(peers) < self.max_peers:
+				break
+			peers.popitem(last=False)
+			self.expired_peers += 1
+
+	def _ack_for(self, peer):
+		sack = 0
+		for seq in peer.received:
+			d = seq_diff(seq, peer.expected) - 1
+			if 0 <= d < SACK_BITS:
+				sack |= 1 << d
+		return encode_ack(peer.ip, peer.expected, sack)
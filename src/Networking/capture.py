@@ -0,0 +1,129 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code records every datagram a radio sends and receives to a binary capture file, and reads
+# capture files back for replay.py.
+#
+# File layout: an 8 byte file header (CAPTURE_MAGIC), then one record per datagram
+#   time_ns(8) direction(1) interface(1) peer_ip(4) peer_port(2) length(4) data(length)
+# time_ns is wall clock time in nanoseconds, direction is DIR_IN or DIR_OUT, interface indexes
+# INTERFACES and the peer is the sender of a received datagram or the destination of a sent one.
+# Files are rotated like log files: capture.bin, capture.bin.1, ... capture.bin.N (oldest).
+
+import os, time, struct, socket
+from threading import Lock
+
+CAPTURE_MAGIC = b"C1TCAP\x00\x01"
+RECORD_HEADER = struct.Struct("!QBB4sHI")
+
+DIR_IN = 0
+DIR_OUT = 1
+DIRECTIONS = ('in', 'out')
+
+INTERFACES = ('LAN', 'VANET')
+INTERFACE_IDS = {name: i for i, name in enumerate(INTERFACES)}
+OTHER_INTERFACE = 255
+
+class CaptureWriter:
+
+	def __init__(self, path, max_bytes=0, backups=3, buffer_size=1 << 16):
+
+		# max_bytes: rotate once the file is this large (0 = never), keeping `backups` old files
+		self.path = path
+		self.max_bytes = max_bytes
+		self.backups = backups
+		self.buffer_size = buffer_size
+		self.lock = Lock()
+		self.records = 0
+		self.file = None
+		self.size = 0
+
+		capture_dir = os.path.dirname(path)
+		if capture_dir and not os.path.exists(capture_dir):
+			os.makedirs(capture_dir, 0o775)
+		self._open()
+
+	def write(self, direction, interface, addr, data):
+		# addr is an (ip, port) tuple, data can be bytes or a memoryview
+		try:
+			ip = socket.inet_aton(addr[0])
+		except (OSError, TypeError):
+			ip = bytes(4)
+		header = RECORD_HEADER.pack(time.time_ns(), direction, INTERFACE_IDS.get(interface, OTHER_INTERFACE),
+			ip, addr[1] & 0xFFFF, len(data))
+		with self.lock:
+			if self.file is None:
+				return
+			self.file.write(header)
+			self.file.write(data)
+			self.size += RECORD_HEADER.size + len(data)
+			self.records += 1
+			if self.max_bytes and self.size >= self.max_bytes:
+				self._rotate()
+
+	def flush(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.flush()
+
+	def close(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+	def _open(self):
+		self.file = open(self.path, 'wb', buffering=self.buffer_size)
+		self.file.write(CAPTURE_MAGIC)
+		self.size = len(CAPTURE_MAGIC)
+
+	def _rotate(self):
+		self.file.close()
+		if self.backups:
+			for i in range(self.backups - 1, 0, -1):
+				src = "{}.{}".format(self.path, i)
+				if os.path.exists(src):
+					os.replace(src, "{}.{}".format(self.path, i + 1))
+			os.replace(self.path, self.path + ".1")
+		self._open()
+
+
+def read_capture(path):
+	# Yields (time_ns, direction, interface, (ip, port), data) for every record in the file
+	with open(path, 'rb') as f:
+		if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+			raise ValueError("{} is not a C1T2X capture file".format(path))
+		while True:
+			header = f.read(RECORD_HEADER.size)
+			if len(header) < RECORD_HEADER.size:
+				return
+			time_ns, direction, interface, ip, port, length = RECORD_HEADER.unpack(header)
+			data = f.read(length)
+			if len(data) < length:
+				# Truncated last record, e.g. the radio was powered off mid write
+				return
+			name = INTERFACES[interface] if interface < len(INTERFACES) else None
+			yield time_ns, direction, name, (socket.inet_ntoa(ip), port), data
+
+def capture_files(path):
+	# The rotated files of a capture, oldest first
+	files = []
+	i = 1
+	while os.path.exists("{}.{}".format(path, i)):
+		files.append("{}.{}".format(path, i))
+		i += 1
+	files.reverse()
+	if os.path.exists(path):
+		files.append(path)
+	return files
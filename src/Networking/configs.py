@@ -0,0 +1,62 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code reads the YAML config files, keeping a parsed copy of each one in CACHE_DIR so that a
+# boot-time start does not import and run ruamel.yaml. The copy is written with marshal, which
+# loads a dict of plain values faster than any other format in the standard library, and is used
+# for as long as the size and modification time of the YAML file are unchanged. A config that
+# marshal cannot write (e.g. YAML timestamps) is parsed from the YAML every time.
+
+import os, hashlib, marshal
+
+# Next to config/, like CODEC_CACHE_DIR
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Cache')
+
+# Bumped when the cache file layout changes
+CACHE_VERSION = 1
+
+def load_yaml(path, cache_dir=CACHE_DIR):
+	# Returns the parsed YAML file, from the cache when it is up to date (cache_dir None never caches)
+	stat = os.stat(path)
+	key = (CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+	cache_file = None
+	if cache_dir:
+		name = os.path.splitext(os.path.basename(path))[0]
+		digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]
+		cache_file = os.path.join(cache_dir, "config_{}_{}.marshal".format(name, digest))
+		try:
+			with open(cache_file, 'rb') as f:
+				cached_key, data = marshal.load(f)
+			if cached_key == key:
+				return data
+		except (OSError, EOFError, ValueError, TypeError):
+			pass
+
+	from ruamel.yaml import YAML
+	with open(path, 'r') as f:
+		data = YAML(typ='safe').load(f)
+
+	if cache_file is not None:
+		try:
+			os.makedirs(cache_dir, 0o775, exist_ok=True)
+			tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+			with open(tmp_file, 'wb') as f:
+				marshal.dump((key, data), f)
+			os.replace(tmp_file, cache_file)
+		except (OSError, ValueError):
+			try:
+				os.unlink(tmp_file)
+			except OSError:
+				pass
+	return data
@@ -0,0 +1,185 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code limits how fast a radio puts LAN data on the shared VANET channel (CONGESTION_CONTROL in
+# config/params.yaml), in the spirit of the SAE J2945/1 adaptive transmit rate: the more radios
+# share the channel, the less often each one transmits.
+#
+# Every data transmission (new messages, retransmits and repeats, not acks) takes a token from one
+# bucket that refills at the current rate. New messages wait for a token; retransmits and repeats
+# are never held back, they take the bucket into debt (at most burst tokens) so that they delay the
+# new messages behind them instead. Every interval seconds the rate is recomputed from what the
+# radio heard and sent during the interval:
+#
+#   density   with N distinct radios heard, at most max_rate * density_coefficient / N (J2945/1)
+#   load      share of the interval the channel was busy with the frames heard and sent, acks
+#             included, each taking (bytes + frame_overhead) * 8 / bitrate seconds of airtime. This
+#             stands in for the channel busy percentage J2945/1 reads from the radio. Above target_load
+#             the radio's own data rate is cut by target_load / load; acks follow the data they
+#             answer, so every radio cutting its data by that factor brings the load back
+#   loss      ack timeouts per acknowledged message, and retransmits per reliable transmission;
+#             above loss_threshold the rate is multiplied by decrease. Collided frames are never
+#             heard, so on a crowded channel this is the signal that sees what the load misses
+#
+# Load and loss are smoothed over intervals with weight SMOOTHING, like the channel busy percentage
+# in J2945/1. Cuts start from the rate the radio actually sent at, when that is below the rate it
+# was allowed, so that they take effect. Otherwise the rate grows by increase packets per second
+# every second, up to the lower of the density and load limits. Cutting by a factor and growing by a constant is what makes radios that started with
+# different rates converge on equal shares (AIMD). The rate stays within [min_rate, max_rate], so
+# a radio is never silenced completely.
+
+import time
+
+# Weight of the newest interval in the smoothed load and loss
+SMOOTHING = 0.5
+
+class CongestionController:
+
+	def __init__(self, max_rate=100.0, min_rate=2.0, burst=10, interval=1.0, bitrate=6e6, frame_overhead=128, target_load=0.6,
+			density_coefficient=25, loss_threshold=0.2, decrease=0.7, increase=5.0, loss_source=None, clock=time.monotonic):
+
+		self.max_rate = max_rate
+		self.min_rate = min(min_rate, max_rate)
+		self.burst = burst
+		self.interval = interval
+		# Channel bit rate, and the bytes a frame costs in airtime on top of its payload (headers,
+		# preamble, inter-frame space and backoff)
+		self.bitrate = bitrate
+		self.frame_overhead = frame_overhead
+		self.target_load = target_load
+		self.density_coefficient = density_coefficient
+		self.loss_threshold = loss_threshold
+		self.decrease = decrease
+		self.increase = increase
+		# loss_source() returns running totals (acknowledged messages sent, retransmits, ack timeouts)
+		self.loss_source = loss_source
+		self.clock = clock
+
+		now = clock()
+		self.rate = max_rate
+		self.tokens = float(burst)
+		self.refilled = now
+
+		# Current interval
+		self.window_start = now
+		self.window_rx = 0
+		self.window_tx = 0
+		self.window_bytes = 0
+		self.window_peers = set()
+		self.loss_totals = loss_source() if loss_source is not None else (0, 0, 0)
+
+		# Last interval, for the stats
+		self.peers = 0
+		self.rx_rate = 0.0
+		self.load = 0.0
+		self.loss = 0.0
+
+		# Counters
+		self.transmissions = 0
+		self.limited = 0
+		self.updates = 0
+		self.decreases = 0
+		self.min_seen = max_rate
+
+	def on_receive(self, ip, size):
+		# Any datagram heard from another radio, acks included
+		self.window_rx += 1
+		self.window_bytes += size + self.frame_overhead
+		self.window_peers.add(ip)
+
+	def on_transmit(self, size, data=True):
+		# One datagram sent. Data is taken from the bucket even when it has no token left, acks only
+		# count towards the channel load
+		self.window_bytes += size + self.frame_overhead
+		if not data:
+			return
+		self.refill(self.clock())
+		self.tokens = max(self.tokens - 1, -self.burst)
+		self.window_tx += 1
+		self.transmissions += 1
+
+	def ready(self, now=None):
+		# True if a new message may be sent now
+		if now is None:
+			now = self.clock()
+		if now - self.window_start >= self.interval:
+			self.update(now)
+		self.refill(now)
+		if self.tokens >= 1:
+			return True
+		self.limited += 1
+		return False
+
+	def delay(self, now=None):
+		# Seconds until the bucket holds a token again
+		if now is None:
+			now = self.clock()
+		self.refill(now)
+		return max(1 - self.tokens, 0) / self.rate
+
+	def refill(self, now):
+		if self.tokens < self.burst:
+			self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+		self.refilled = now
+
+	def update(self, now):
+		# Ends the current interval and sets the rate for the next one
+		elapsed = now - self.window_start
+		if elapsed <= 0:
+			return
+		self.refill(now)
+		peers = len(self.window_peers)
+		self.peers = peers
+		self.rx_rate = self.window_rx / elapsed
+		tx_rate = self.window_tx / elapsed
+		load = self.window_bytes * 8 / self.bitrate / elapsed
+		self.load += SMOOTHING * (load - self.load)
+
+		sent = retransmits = timeouts = 0
+		if self.loss_source is not None:
+			totals = self.loss_source()
+			sent, retransmits, timeouts = (new - old for new, old in zip(totals, self.loss_totals))
+			self.loss_totals = totals
+		loss = max(timeouts / sent if sent else 0.0, retransmits / (sent + retransmits) if sent + retransmits else 0.0)
+		self.loss += SMOOTHING * (loss - self.loss)
+
+		target = self.max_rate
+		if peers > self.density_coefficient:
+			target = self.max_rate * self.density_coefficient / peers
+		if self.load > self.target_load:
+			target = min(target, tx_rate * self.target_load / self.load)
+
+		if self.loss > self.loss_threshold:
+			rate = min(self.rate, tx_rate) * self.decrease
+			self.decreases += 1
+		elif target < self.rate:
+			rate = target
+			self.decreases += 1
+		else:
+			rate = min(target, self.rate + self.increase * elapsed)
+		self.rate = min(max(rate, self.min_rate), self.max_rate)
+		if self.rate < self.min_seen:
+			self.min_seen = self.rate
+
+		self.window_start = now
+		self.window_rx = 0
+		self.window_tx = 0
+		self.window_bytes = 0
+		self.window_peers = set()
+		self.updates += 1
+
+	def stats(self):
+		return {'rate': round(self.rate, 2), 'min_rate_seen': round(self.min_seen, 2), 'tokens': round(self.tokens, 2),
+			'peers': self.peers, 'rx_pps': round(self.rx_rate, 1), 'load': round(self.load, 3), 'loss': round(self.loss, 3),
+			'transmissions': self.transmissions, 'limited': self.limited, 'updates': self.updates, 'decreases': self.decreases}
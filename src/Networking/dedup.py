@@ -0,0 +1,72 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code suppresses duplicate VANET messages, i.e. retransmissions of a message that was already
+# forwarded to the LAN because the ack back to the sender was lost.
+#
+# Keys are (sender IP, sender ID, sequence number) for compact frames and (sender IP,
+# sessions.message_digest of the packet) for driver packets. They live in an OrderedDict kept in
+# expiry order: a key expires ttl seconds after it was first seen, however often it is seen again,
+# so a sender that keeps retransmitting cannot keep its key alive. Expired keys are dropped from the
+# front and the oldest key is evicted once the cache is full. Every operation is O(1).
+
+import time
+from collections import OrderedDict
+
+class DedupCache:
+
+	def __init__(self, max_entries=1024, ttl=30.0, clock=time.monotonic):
+
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.clock = clock
+		self.entries = OrderedDict()
+
+		# Counters
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+
+	def seen(self, key):
+		# Returns True if key was first seen less than ttl seconds ago, otherwise remembers it
+		now = self.clock()
+		entries = self.entries
+		while entries:
+			oldest, expires = next(iter(entries.items()))
+			if expires > now:
+				break
+			del entries[oldest]
+			self.expirations += 1
+
+		if key in entries:
+			self.hits += 1
+			return True
+		self.misses += 1
+		if len(entries) >= self.max_entries:
+			entries.popitem(last=False)
+			self.evictions += 1
+		entries[key] = now + self.ttl
+		return False
+
+	def forget(self, key):
+		# Drops key, so the next copy of the message is treated as new
+		self.entries.pop(key, None)
+
+	def clear(self):
+		self.entries.clear()
+
+	def stats(self):
+		return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+			'evictions': self.evictions, 'expirations': self.expirations}
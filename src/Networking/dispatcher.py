@@ -0,0 +1,128 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code runs any number of UDP_NET sockets from a single thread. Sockets are switched to
+# non-blocking and registered with selectors (epoll on Linux), and a readiness callback is called
+# with every datagram as soon as the kernel has it, so there is no polling loop or loop_time sleep.
+# One-shot timers are run on the same thread, which is where retransmits are scheduled.
+
+import time, heapq, socket, selectors, itertools
+from threading import Thread, current_thread
+
+class TimerHandle:
+	__slots__ = ("when", "callback", "cancelled")
+
+	def __init__(self, when, callback):
+		self.when = when
+		self.callback = callback
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+
+class UDPDispatcher:
+
+	def __init__(self, logger=None):
+
+		self.logger = logger
+		self.selector = selectors.DefaultSelector()
+		self.timers = []
+		self.counter = itertools.count()
+		self.running = False
+		self.thread = None
+
+		# Self-pipe so that stop() and call_later() from another thread wake the selector
+		self.wake_recv, self.wake_send = socket.socketpair()
+		self.wake_recv.setblocking(False)
+		self.wake_send.setblocking(False)
+		self.selector.register(self.wake_recv, selectors.EVENT_READ, None)
+
+	def register(self, net, callback):
+		# callback(packet) is called with every (data, address) tuple received on net
+		net.setblocking(False)
+		self.selector.register(net.sock, selectors.EVENT_READ, (net, callback))
+
+	def unregister(self, net):
+		self.selector.unregister(net.sock)
+
+	def call_later(self, delay, callback):
+		# Timers are only safe to add from another thread because the heap push is atomic under the GIL
+		handle = TimerHandle(time.monotonic() + delay, callback)
+		heapq.heappush(self.timers, (handle.when, next(self.counter), handle))
+		self._wake()
+		return handle
+
+	def start(self):
+		self.running = True
+		self.thread = Thread(target= self.run, name="UDPDispatcher")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		self._wake()
+		if self.thread is not None and self.thread is not current_thread():
+			self.thread.join(1.0)
+
+	def run(self):
+		self.running = True
+		while self.running:
+			for key, _ in self.selector.select(self._next_timeout()):
+				if key.data is None:
+					self._drain_wake()
+					continue
+				net, callback = key.data
+				try:
+					for packet in net.recv_pending():
+						callback(packet)
+				except Exception as excep:
+					if self.logger:
+						self.logger.exception("{}: Callback failed: {}".format(net.netType, excep))
+			self._run_timers()
+		self.selector.close()
+		self.wake_recv.close()
+		self.wake_send.close()
+
+	def _next_timeout(self):
+		while self.timers and self.timers[0][2].cancelled:
+			heapq.heappop(self.timers)
+		if not self.timers:
+			return None
+		return max(self.timers[0][0] - time.monotonic(), 0)
+
+	def _run_timers(self):
+		now = time.monotonic()
+		while self.timers and self.timers[0][0] <= now:
+			_, _, handle = heapq.heappop(self.timers)
+			if handle.cancelled:
+				continue
+			try:
+				handle.callback()
+			except Exception as excep:
+				if self.logger:
+					self.logger.exception("Timer callback failed: {}".format(excep))
+
+	def _wake(self):
+		try:
+			self.wake_send.send(b"\0")
+		except (BlockingIOError, OSError):
+			pass
+
+	def _drain_wake(self):
+		try:
+			while self.wake_recv.recv(512):
+				pass
+		except BlockingIOError:
+			pass
@@ -0,0 +1,486 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code holds the OBU forwarding logic (LAN -> VANET with acks and retransmits, VANET -> LAN)
+# as callbacks that never block. Packets are pushed in with on_lan_packet/on_vanet_packet, and
+# retransmits are scheduled through a call_later(delay, callback) function supplied by whatever
+# runs the sockets, e.g. UDPDispatcher.call_later or asyncio's loop.call_later. Every backend runs
+# this same code; the threaded one calls it from its pipeline stages and timer thread under one lock.
+# Packets from the VANET have the driver header stripped here, so send_lan is handed the raw UPER payload.
+# With compact framing, driver packets from the LAN are translated into compact VANET frames before
+# they are queued, and the frames from the VANET are handed to send_lan without their 13 byte header.
+# With congestion control, LAN data goes out no faster than the rate the channel load allows
+# (Networking/congestion.py); acks are never held back.
+
+import time, random
+
+from Networking.arq import ARQSender, ARQReceiver, is_arq_frame, frame_type, ARQ_ACK, ARQ_DATA
+from Networking.framing import parse_dsrc, vanet_payload, packet_psid, frame_id, is_compact, CompactFramer, sender_id
+from Networking.metrics import ForwardingCounters
+from Networking.logs import packet_logger
+from Networking.dedup import DedupCache
+from Networking.scheduler import OutboundScheduler
+from Networking.reliability import ReliabilityPolicy
+from Networking.rtt import RTTEstimator
+from Networking.congestion import CongestionController
+from Networking.fragments import fragment_sizes
+from Networking.sessions import PeerTable, message_digest, encode_saw_ack, decode_saw_ack, is_saw_ack
+from Messaging.j2735 import MessageFrame
+
+# Stop-and-wait protocol. Acks are addressed, see sessions.py
+SAW_MAX_RETRANSMITS = 120
+# Copies of a repeated driver packet are suppressed for its repeats plus this long
+REPEAT_DEDUP_SLACK = 0.1
+
+def dedup_key(ip, data, digest):
+	# Compact frames carry a sequence number, driver packets are told apart by their digest
+	frame = frame_id(data)
+	if frame is not None:
+		return (ip,) + frame
+	return ip, digest
+
+class Forwarder:
+
+	def __init__(self, send_lan, send_vanet, call_later, logger, mode='stop_and_wait', window_size=32,
+			retransmit_interval=0.2, max_retries=50, parse_lan=False, parse_vanet=False, print_data=False,
+			codec=None, on_message=None, dedup_size=1024, dedup_ttl=30.0, self_ip=None, ack_jitter=0.0,
+			ack_quorum=1, max_peers=64, peer_timeout=60.0, outbound_classes=None, outbound_default=None, reliability=None,
+			reliability_default=None, rto_initial=1.0, rto_min=0.02, rto_max=4.0, rto_jitter=0.25, framing='driver',
+			congestion=None, fragment_size=0, clock=time.monotonic):
+
+		self.send_lan = send_lan
+		self.send_vanet = send_vanet
+		self.call_later = call_later
+		self.logger = logger
+		self.packet_log = packet_logger(logger)
+		self.sliding_window = mode == 'sliding_window'
+		self.parse_lan = parse_lan
+		self.parse_vanet = parse_vanet
+		self.print_data = print_data
+		# Time source of every timestamp kept here, must match the call_later timers (e.g. simulated time)
+		self.clock = clock
+
+		# VANET_DECODE / RADIO_APPS: payloads are wrapped in lazily decoded MessageFrames. With an
+		# on_message(frame, addr, source, psid) hook (e.g. MessageRouter.dispatch), frames from both
+		# the VANET and the LAN are handed to it in addition to being forwarded
+		self.codec = codec
+		self.on_message = on_message
+
+		# LAN packets waiting for the VANET, in priority order (OUTBOUND_CLASSES)
+		self.pending = OutboundScheduler(outbound_classes, outbound_default, clock)
+		self.release_timer = None
+		# RELIABILITY: only acknowledged messages go through the forwarding mode, the others are
+		# broadcast (and repeated) right away, even while an acknowledged message is in flight
+		self.reliability = ReliabilityPolicy(reliability, reliability_default)
+
+		# Stop-and-wait state
+		self.in_flight = None
+		self.in_flight_digest = None
+		self.in_flight_ackers = set()
+		self.in_flight_sent = 0.0
+		self.in_flight_expires = None
+		self.retransmits = 0
+		self.dedup = DedupCache(dedup_size, dedup_ttl, clock)
+		# Unacknowledged driver packets carry no sequence number, so a new message can have the
+		# same bytes as an earlier one: only copies within the sender's repeat window are dropped,
+		# and best effort packets are never taken for copies
+		self.repeat_dedup = {policy: DedupCache(dedup_size, policy.repeats * policy.repeat_interval + REPEAT_DEDUP_SLACK, clock)
+			for policy in self.reliability.policies if policy.repeats}
+		# Adaptive retransmit timeout, starting from rto_initial until the first ack is measured
+		self.rtt = RTTEstimator(rto_initial, rto_min, rto_max, rto_jitter)
+
+		# Per-peer sessions. self_ip is this radio's VANET address: only acks naming it release the
+		# in-flight message (None accepts any ack of the message). With ack_jitter, acks are sent
+		# after a random delay of up to ack_jitter seconds and dropped if another radio acks first.
+		# An ack only proves that one radio received the message: with an ack_quorum above 1, a
+		# message is released once that many different radios acked it, and no ack is dropped.
+		self.self_ip = self_ip
+		self.ack_jitter = ack_jitter
+		self.ack_quorum = max(int(ack_quorum), 1)
+		self.peers = PeerTable(max_peers, peer_timeout, clock)
+
+		# VANET_FRAMING: 'compact' translates LAN packets at ingress, 'driver' forwards them unchanged
+		self.framer = CompactFramer(sender_id(self_ip)) if framing == 'compact' else None
+
+		# Sliding window state. Frames go through self._transmit looked up on every send, so a
+		# wrapper set on the instance (startup timing, profiling) sees them too
+		self.arq_sender = ARQSender(lambda frame: self._transmit(frame), window_size=window_size, retransmit_interval=retransmit_interval,
+			max_retries=max_retries, logger=logger, clock=clock, self_ip=self_ip,
+			rtt=RTTEstimator(retransmit_interval, rto_min, rto_max, rto_jitter), ack_quorum=self.ack_quorum)
+		self.arq_receiver = ARQReceiver(self._deliver, self._send_control, logger=logger, max_peers=max_peers,
+			peer_timeout=peer_timeout, clock=clock)
+
+		self.timer = None
+		self.closed = False
+
+		self.counters = ForwardingCounters()
+
+		# CONGESTION_CONTROL: options of the CongestionController, None sends at the full rate of the LAN
+		self.congestion = CongestionController(loss_source=self._loss_totals, clock=clock, **congestion) if congestion else None
+		# FRAGMENT_SIZE of the VANET: a datagram above it goes on the air as several fragments, and
+		# every fragment is counted as a transmission of its own (0 never fragments)
+		self.fragment_size = fragment_size
+
+	def on_lan_packet(self, pkt):
+		if self.closed:
+			return
+		if self.parse_lan:
+			# feature to parse incoming LAN packet is not enabled
+			self.logger.error("Feature to parse incoming LAN is not enabled")
+			return
+		data = pkt[0]
+		if self.on_message is not None or self.framer is not None:
+			try:
+				packet = parse_dsrc(data)
+			except ValueError:
+				packet = None
+				self.packet_log.debug("LAN packet from %s is not a driver packet", pkt[1][0])
+			if packet is not None and self.on_message is not None:
+				self._route(packet.payload, packet.psid, pkt[1], 'LAN')
+			if self.framer is not None:
+				data = self.framer.frame(data, packet)
+
+		# Looked up once here, the scheduler hands the policy back with the packet
+		policy = self.reliability.lookup(data)
+		if not self.pending.push(data, pkt[1], policy, held=policy.acknowledged):
+			self.counters.backlog_drops += 1
+			self.logger.warning("VANET backlog full, dropped oldest LAN packet of its class")
+		self._pump()
+
+	def on_vanet_packet(self, pkt):
+		if self.closed:
+			return
+		data = pkt[0]
+		if self.print_data:
+			print(pkt)
+		if self.congestion is not None:
+			# Reassembled datagrams arrived as fragments of the same size this radio sends
+			for size in fragment_sizes(len(data), self.fragment_size):
+				self.congestion.on_receive(pkt[1][0], size)
+
+		if self.sliding_window and is_arq_frame(data):
+			if frame_type(data) == ARQ_ACK:
+				self.counters.acks_received += 1
+				self.arq_sender.on_ack(data, pkt[1])
+				self._pump()
+			elif frame_type(data) == ARQ_DATA:
+				self.arq_receiver.on_data(data, pkt[1])
+		elif is_saw_ack(data):
+			self._on_saw_ack(data, pkt[1])
+		else:
+			peer = self.peers.get(pkt[1][0])
+			digest = message_digest(data)
+			key = dedup_key(peer.ip, data, digest)
+			policy = self.reliability.lookup(data)
+			if not policy.acknowledged:
+				# Best effort or blind repeats: never acked, repeated copies are only delivered once
+				dedup = self.dedup if is_compact(data) else self.repeat_dedup.get(policy)
+				if dedup is not None and dedup.seen(key):
+					peer.duplicates += 1
+					self.counters.duplicates += 1
+				elif self._deliver(data, pkt[1]):
+					peer.messages += 1
+				elif dedup is not None:
+					dedup.forget(key)
+			elif self.dedup.seen(key):
+				# Duplicate message received, so just resend ack
+				peer.duplicates += 1
+				self.counters.duplicates += 1
+				self._ack(peer, digest)
+				self.packet_log.info("Received duplicate message from %s, resending ack", peer.ip)
+			elif self._deliver(data, pkt[1]):
+				# New message received and forwarded to the LAN, ack it
+				peer.messages += 1
+				self._ack(peer, digest)
+				self.packet_log.info("Received new message from %s", peer.ip)
+			else:
+				# Not handed to the LAN, so no ack: the sender retransmits and the copy counts as new
+				self.dedup.forget(key)
+
+	def _on_saw_ack(self, data, addr):
+		sender_ip, digest = decode_saw_ack(data)
+		acker = self.peers.get(addr[0])
+		acker.acks_received += 1
+		self.counters.acks_received += 1
+
+		if self.in_flight is not None and digest == self.in_flight_digest and (self.self_ip is None or sender_ip == self.self_ip):
+			self.packet_log.info("Received ack from %s", acker.ip)
+			self.in_flight_ackers.add(acker.ip)
+			if len(self.in_flight_ackers) < self.ack_quorum:
+				return
+			if self.retransmits == 0:
+				# Karn's rule: an ack after a retransmit could belong to either copy
+				rtt = self.clock() - self.in_flight_sent
+				self.counters.ack_latency.observe(rtt)
+				self.rtt.observe(rtt)
+			self._saw_release()
+			return
+		if self.self_ip is not None and sender_ip != self.self_ip:
+			self.counters.foreign_acks += 1
+
+		# Another radio acked a message we are about to ack, ours is not needed unless the sender
+		# waits for a quorum of radios
+		if self.ack_quorum > 1:
+			return
+		peer = self.peers.find(sender_ip)
+		if peer is not None and peer.pending_ack == digest:
+			peer.ack_timer.cancel()
+			peer.ack_timer = None
+			peer.pending_ack = None
+			peer.acks_suppressed += 1
+			self.counters.acks_suppressed += 1
+
+	def _ack(self, peer, digest):
+		if self.ack_jitter <= 0:
+			self._send_ack(peer, digest)
+		elif peer.pending_ack != digest:
+			if peer.ack_timer is not None:
+				# Ack for an earlier message still waiting, send it now
+				peer.ack_timer.cancel()
+				self._send_ack(peer, peer.pending_ack)
+			peer.pending_ack = digest
+			peer.ack_timer = self.call_later(random.uniform(0, self.ack_jitter), lambda: self._ack_due(peer))
+
+	def _ack_due(self, peer):
+		digest = peer.pending_ack
+		peer.pending_ack = None
+		peer.ack_timer = None
+		if digest is not None and not self.closed:
+			self._send_ack(peer, digest)
+
+	def _send_ack(self, peer, digest):
+		self._send_control(encode_saw_ack(peer.ip, digest))
+		peer.acks_sent += 1
+		self.counters.acks_sent += 1
+
+	def _deliver(self, data, addr):
+		# Forwarding only needs the payload, the driver header is not parsed
+		# Returns False if the payload was not handed to the LAN (send_lan returned False)
+		try:
+			payload = vanet_payload(data)
+		except ValueError as excep:
+			self.logger.warning("Dropped VANET packet from {}: {}".format(addr[0], excep))
+			return False
+		if self.send_lan(payload) is False:
+			self.counters.lan_drops += 1
+			return False
+		self.counters.vanet_to_lan += 1
+		# Forward first, the apps only get the frame afterwards
+		if self.on_message is not None:
+			self._route(payload, packet_psid(data), addr, 'VANET')
+		elif self.parse_vanet:
+			self._route(payload, None, addr, 'VANET')
+		return True
+
+	def _route(self, payload, psid, addr, source):
+		# Wraps the payload in a MessageFrame and hands it to on_message
+		try:
+			frame = MessageFrame(payload, self.codec)
+		except ValueError:
+			self.logger.warning("Payload from {} is not a J2735 MessageFrame".format(addr[0]))
+			return
+		self.packet_log.debug("Received %s from %s", frame.name, addr[0])
+		if self.on_message is not None:
+			self.on_message(frame, addr, source, psid)
+
+	def close(self):
+		self.closed = True
+		self._cancel_timer()
+		if self.release_timer is not None:
+			self.release_timer.cancel()
+			self.release_timer = None
+		self.arq_sender.close()
+
+	def stats(self):
+		stats = self.counters.snapshot()
+		stats['pending'] = len(self.pending)
+		stats['outbound'] = self.pending.stats()
+		stats['reliability'] = self.reliability.stats()
+		stats['rtt'] = self.arq_sender.rtt.stats() if self.sliding_window else self.rtt.stats()
+		stats['dedup'] = self.dedup.stats()
+		if self.repeat_dedup:
+			stats['repeat_dedup'] = {policy.name: dedup.stats() for policy, dedup in self.repeat_dedup.items()}
+		stats['peers'] = self.peers.stats()
+		if self.framer is not None:
+			stats['framing'] = self.framer.stats()
+		if self.congestion is not None:
+			stats['congestion'] = self.congestion.stats()
+		if self.sliding_window:
+			# Frames, acks and retransmits of the sliding window are counted by the ARQ classes
+			stats['arq_sender'] = self.arq_sender.stats()
+			stats['arq_receiver'] = self.arq_receiver.stats()
+		return stats
+
+	def _pump(self):
+		# Sends waiting LAN packets in priority order: unacknowledged ones right away, acknowledged
+		# ones while the forwarding mode has room for them
+		while not self.closed:
+			if self.congestion is not None and self.pending and not self.congestion.ready():
+				self._wait_for_tokens()
+				return
+			hold = not self._can_send_acknowledged()
+			entry = self.pending.pop_entry(hold=hold)
+			if entry is None:
+				self._wait_for_release(hold)
+				return
+			packet, policy = entry
+			policy.sent += 1
+			if not policy.acknowledged:
+				self._broadcast(packet, policy)
+			elif self.sliding_window:
+				self._arq_send(packet, policy)
+			else:
+				self._saw_send(packet, policy)
+
+	def _can_send_acknowledged(self):
+		if self.sliding_window:
+			return self.arq_sender.in_flight() < self.arq_sender.window_size
+		return self.in_flight is None
+
+	def _wait_for_release(self, hold):
+		# Packets are waiting on a class rate limit, look again once a token is available
+		delay = self.pending.next_ready(hold=hold)
+		if delay is None or self.release_timer is not None:
+			return
+		self.release_timer = self.call_later(max(delay, 0.001), self._release)
+
+	def _wait_for_tokens(self):
+		# The channel is busy, look again once the congestion control bucket has a token
+		if self.release_timer is None:
+			self.release_timer = self.call_later(max(self.congestion.delay(), 0.001), self._release)
+
+	def _release(self):
+		self.release_timer = None
+		self._pump()
+
+	def _transmit(self, packet):
+		# LAN data on the VANET, counted against the congestion control rate once per fragment
+		if self.congestion is not None:
+			for size in fragment_sizes(len(packet), self.fragment_size):
+				self.congestion.on_transmit(size)
+		self.send_vanet(packet)
+
+	def _send_control(self, data):
+		# Acks are never held back, they only count towards the channel load
+		if self.congestion is not None:
+			self.congestion.on_transmit(len(data), data=False)
+		self.send_vanet(data)
+
+	def _loss_totals(self):
+		# (acknowledged messages sent, retransmits, ack timeouts) for the congestion control
+		if self.sliding_window:
+			return self.arq_sender.sent, self.arq_sender.retransmits, self.arq_sender.expired
+		counters = self.counters
+		return counters.lan_to_vanet - counters.unacknowledged, counters.retransmits, counters.ack_timeouts
+
+	# Best effort and blind repeats: broadcast without waiting for an ack
+	def _broadcast(self, packet, policy):
+		self._transmit(packet)
+		self.counters.lan_to_vanet += 1
+		self.counters.unacknowledged += 1
+		if policy.repeats:
+			self.call_later(policy.repeat_interval, lambda: self._repeat(packet, policy, policy.repeats))
+
+	def _repeat(self, packet, policy, remaining):
+		if self.closed:
+			return
+		self._transmit(packet)
+		self.counters.repeats += 1
+		if remaining > 1:
+			self.call_later(policy.repeat_interval, lambda: self._repeat(packet, policy, remaining - 1))
+
+	# Stop-and-wait: a single packet in flight, retransmitted with exponential backoff until acked or its deadline
+	def _saw_send(self, packet, policy):
+		self.in_flight = packet
+		self.in_flight_digest = message_digest(packet)
+		self.in_flight_ackers.clear()
+		self.in_flight_sent = self.clock()
+		self.in_flight_expires = self.in_flight_sent + policy.deadline if policy.deadline else None
+		self.retransmits = 0
+		self._transmit(packet)
+		self.counters.lan_to_vanet += 1
+		self.packet_log.info("Message sent, waiting for ack")
+		self._saw_timer()
+
+	def _saw_retransmit(self):
+		self.timer = None
+		if self.in_flight is None or self.closed:
+			return
+		if self.retransmits >= SAW_MAX_RETRANSMITS or (self.in_flight_expires is not None and self.clock() >= self.in_flight_expires):
+			self.logger.error("Ack was never received")
+			self.counters.ack_timeouts += 1
+			self.in_flight = None
+			self._pump()
+			return
+		self.retransmits += 1
+		self.counters.retransmits += 1
+		self._transmit(self.in_flight)
+		self.packet_log.info("Still waiting for ack")
+		self._saw_timer()
+
+	def _saw_timer(self):
+		# Next retransmit, or the deadline if that comes first
+		delay = self.rtt.timeout(self.retransmits)
+		if self.in_flight_expires is not None:
+			delay = min(delay, max(self.in_flight_expires - self.clock(), 0.001))
+		self.timer = self.call_later(delay, self._saw_retransmit)
+
+	def _saw_release(self):
+		self._cancel_timer()
+		self.in_flight = None
+		self._pump()
+
+	# Sliding window: queue into the ARQ window while there is room, retransmit from a timer
+	def _arq_send(self, packet, policy):
+		if self.arq_sender.send(packet, block=False, deadline=policy.deadline):
+			self.counters.lan_to_vanet += 1
+		if self.timer is None and self.arq_sender.in_flight():
+			self.timer = self.call_later(self.arq_sender.rtt.rto, self._arq_tick)
+
+	def _arq_tick(self):
+		self.timer = None
+		if self.closed:
+			return
+		next_deadline = self.arq_sender.poll()
+		# Frames that ran out of retries free up the window
+		self._pump()
+		if self.timer is None and next_deadline is not None:
+			self.timer = self.call_later(max(next_deadline - self.clock(), 0.001), self._arq_tick)
+
+	def _cancel_timer(self):
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+
+
+def forwarding_options(params):
+	# Forwarder options from config/params.yaml. The callers add what depends on how they run it
+	# (decoding, codec, own VANET address, fragment size of the VANET)
+	return dict(mode=params.get('FORWARDING_MODE', 'stop_and_wait'), window_size=params.get('ARQ_WINDOW_SIZE', 32),
+		retransmit_interval=params.get('ARQ_RETRANSMIT_INTERVAL', 0.2), max_retries=params.get('ARQ_MAX_RETRIES', 50),
+		dedup_size=params.get('DEDUP_CACHE_SIZE', 1024), dedup_ttl=params.get('DEDUP_TTL', 30.0),
+		ack_jitter=params.get('ACK_JITTER', 0.0), ack_quorum=params.get('ACK_QUORUM', 1),
+		max_peers=params.get('MAX_PEERS', 64), peer_timeout=params.get('PEER_TIMEOUT', 60.0),
+		outbound_classes=params.get('OUTBOUND_CLASSES'), outbound_default=params.get('OUTBOUND_DEFAULT_CLASS'),
+		reliability=params.get('RELIABILITY'), reliability_default=params.get('RELIABILITY_DEFAULT'),
+		rto_initial=params.get('RTO_INITIAL', 1.0), rto_min=params.get('RTO_MIN', 0.02),
+		rto_max=params.get('RTO_MAX', 4.0), rto_jitter=params.get('RTO_JITTER', 0.25),
+		framing=params.get('VANET_FRAMING', 'driver'), congestion=params.get('CONGESTION_CONTROL'))
+
+def make_forwarder(params, send_lan, send_vanet, call_later, logger, **options):
+	# Forwarder configured from params.yaml, options are added to or override forwarding_options.
+	# Shared by both OBUs and replay, so they all forward the way the configuration says
+	kwargs = forwarding_options(params)
+	kwargs.update(options)
+	return Forwarder(send_lan, send_vanet, call_later, logger, **kwargs)
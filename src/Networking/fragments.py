@@ -0,0 +1,200 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code splits VANET datagrams larger than FRAGMENT_SIZE into fragments and puts them back
+# together on the receiving radio (VANET_params.yaml), so that large MAP messages fit both the
+# WiFi MTU and the receive buffers (BUFFER_SIZE) of the other radios. Each fragment is
+#
+#   magic 0xC3 | version | message ID (2 bytes) | index | count | total length (4 bytes) | data
+#
+# The message ID counts fragmented datagrams per sender. A retransmitted message is fragmented
+# again under a new ID, so a lost fragment only costs that copy.
+#
+# Partly received messages are kept per (sender, message ID) until all fragments arrived, for at
+# most timeout seconds, and within max_messages and max_bytes; the oldest partial message is
+# dropped to make room.
+
+import time, struct, random
+from collections import OrderedDict
+
+FRAGMENT_MAGIC = 0xC3
+FRAGMENT_VERSION = 1
+FRAGMENT_HEADER = struct.Struct("!BBHBBI")
+MAX_FRAGMENTS = 255
+# Recently completed datagrams remembered, so that late duplicate fragments do not start a new one
+RECENT_COMPLETED = 256
+
+def is_fragment(data):
+	# Compact frames start with 0xC2, ARQ frames and acks with 0xC1, driver packets are ASCII
+	return len(data) >= FRAGMENT_HEADER.size and data[0] == FRAGMENT_MAGIC
+
+
+def fragment_sizes(size, fragment_size):
+	# Sizes of the datagrams Fragmenter(fragment_size).split sends for a size byte packet
+	if not fragment_size or size <= fragment_size:
+		return (size,)
+	chunk = fragment_size - FRAGMENT_HEADER.size
+	count, last = divmod(size, chunk)
+	sizes = [fragment_size] * count
+	if last:
+		sizes.append(last + FRAGMENT_HEADER.size)
+	return sizes
+
+
+class Fragmenter:
+
+	def __init__(self, fragment_size=1400):
+		# fragment_size is the largest datagram sent, header included
+		if fragment_size <= FRAGMENT_HEADER.size:
+			raise ValueError("FRAGMENT_SIZE must be larger than the {} byte fragment header".format(FRAGMENT_HEADER.size))
+		self.fragment_size = fragment_size
+		self.chunk = fragment_size - FRAGMENT_HEADER.size
+		# Random start, so a restarted radio's fragments are not taken for ones completed before
+		self.msg_id = random.getrandbits(16)
+
+		# Counters
+		self.fragmented = 0
+		self.fragments = 0
+
+	def split(self, packet):
+		# Returns the datagrams to send for packet, [packet] when it fits in one
+		size = len(packet)
+		if size <= self.fragment_size:
+			return [packet]
+		chunk = self.chunk
+		count = -(-size // chunk)
+		if count > MAX_FRAGMENTS:
+			raise ValueError("{} byte packet needs more than {} fragments".format(size, MAX_FRAGMENTS))
+		self.msg_id = (self.msg_id + 1) & 0xFFFF
+		view = memoryview(packet)
+		fragments = [FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, FRAGMENT_VERSION, self.msg_id, i, count, size) + view[i * chunk:(i + 1) * chunk]
+			for i in range(count)]
+		self.fragmented += 1
+		self.fragments += count
+		return fragments
+
+	def stats(self):
+		return {'fragment_size': self.fragment_size, 'fragmented': self.fragmented, 'fragments': self.fragments}
+
+
+class _Partial:
+	__slots__ = ("buf", "received", "missing", "chunk", "expires")
+
+	def __init__(self, total, count, chunk, expires):
+		self.buf = bytearray(total)
+		self.received = bytearray(count)
+		self.missing = count
+		self.chunk = chunk
+		self.expires = expires
+
+
+class Reassembler:
+
+	def __init__(self, timeout=2.0, max_messages=64, max_bytes=1048576, clock=time.monotonic):
+
+		self.timeout = timeout
+		self.max_messages = max_messages
+		self.max_bytes = max_bytes
+		self.clock = clock
+		# (sender IP, message ID) -> _Partial, oldest first
+		self.partial = OrderedDict()
+		self.buffered = 0
+		self.completed = OrderedDict()
+
+		# Counters
+		self.fragments = 0
+		self.reassembled = 0
+		self.duplicates = 0
+		self.invalid = 0
+		self.timeouts = 0
+		self.evicted = 0
+		self.max_buffered = 0
+
+	def add(self, data, addr):
+		# Takes one fragment, returns the whole datagram once its last fragment arrived, otherwise None
+		self.fragments += 1
+		now = self.clock()
+		self._expire(now)
+		try:
+			magic, version, msg_id, index, count, total = FRAGMENT_HEADER.unpack_from(data)
+		except struct.error:
+			self.invalid += 1
+			return None
+		chunk_len = len(data) - FRAGMENT_HEADER.size
+		if version != FRAGMENT_VERSION or index >= count or total > self.max_bytes or not chunk_len:
+			self.invalid += 1
+			return None
+
+		key = (addr[0], msg_id)
+		partial = self.partial.get(key)
+		if partial is None:
+			if key in self.completed:
+				self.duplicates += 1
+				return None
+			# The first fragment to arrive sets the chunk size, every fragment but the last is full size
+			chunk = chunk_len if index < count - 1 else -(-(total - chunk_len) // max(count - 1, 1))
+			if count > 1 and chunk * (count - 1) >= total:
+				self.invalid += 1
+				return None
+			self._make_room(total)
+			partial = self.partial[key] = _Partial(total, count, chunk, now + self.timeout)
+			self.buffered += total
+			if self.buffered > self.max_buffered:
+				self.max_buffered = self.buffered
+		elif len(partial.received) != count or len(partial.buf) != total:
+			self.invalid += 1
+			return None
+
+		if partial.received[index]:
+			self.duplicates += 1
+			return None
+		start = index * partial.chunk
+		end = total if index == count - 1 else start + partial.chunk
+		if end - start != chunk_len or end > total:
+			self.invalid += 1
+			return None
+		partial.buf[start:end] = data[FRAGMENT_HEADER.size:]
+		partial.received[index] = 1
+		partial.missing -= 1
+		if partial.missing:
+			return None
+		del self.partial[key]
+		self.buffered -= total
+		self.reassembled += 1
+		self.completed[key] = None
+		if len(self.completed) > RECENT_COMPLETED:
+			self.completed.popitem(last=False)
+		return bytes(partial.buf)
+
+	def _expire(self, now):
+		partial = self.partial
+		while partial:
+			key, oldest = next(iter(partial.items()))
+			if oldest.expires > now:
+				return
+			self._drop(key)
+			self.timeouts += 1
+
+	def _make_room(self, size):
+		while self.partial and (len(self.partial) >= self.max_messages or self.buffered + size > self.max_bytes):
+			self._drop(next(iter(self.partial)))
+			self.evicted += 1
+
+	def _drop(self, key):
+		self.buffered -= len(self.partial.pop(key).buf)
+
+	def stats(self):
+		return {'fragments': self.fragments, 'reassembled': self.reassembled, 'pending': len(self.partial),
+			'buffered_bytes': self.buffered, 'max_buffered_bytes': self.max_buffered, 'duplicates': self.duplicates,
+			'invalid': self.invalid, 'timeouts': self.timeouts, 'evicted': self.evicted}
@@ -0,0 +1,280 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code handles the packet format used by the carma-cohda-dsrc-driver on the LAN.
+# The driver sends an ASCII header of Key=Value lines followed by the hex encoded UPER payload:
+#
+#   Version=0.7
+#   Type=BSM
+#   PSID=0x20
+#   Priority=7
+#   TxMode=CONT
+#   TxChannel=172
+#   TxInterval=0
+#   DeliveryStart=
+#   DeliveryStop=
+#   Signature=False
+#   Encryption=False
+#   Payload=0014...
+#
+# A stream of the same message type repeats the exact same header bytes, so the header is parsed
+# once per distinct header and cached. Per packet the work is one search for Payload= and one
+# unhexlify of the payload slice. Slicing bytes and unhexlifying was measured faster than decoding to
+# str for bytes.fromhex or passing unhexlify a memoryview; for memoryview input (recv_many) only the
+# header prefix is copied to search it.
+#
+# Over the VANET the header and the hex encoding are not needed, so the OBU translates driver
+# packets once at LAN ingress into a compact binary frame (VANET_FRAMING in config/params.yaml):
+#
+#   magic 0xC2 | version | flags | PSID (4 bytes) | sequence (2 bytes) | sender ID (4 bytes) | raw UPER
+#
+# The sequence counts messages per sender (retransmits and repeats reuse it) and the sender ID is
+# the sender's VANET IPv4 address. Receiving radios pass the UPER bytes after the 13 byte header
+# straight to the LAN. Either format is accepted from the VANET, so radios still sending driver
+# packets keep working.
+
+import random, socket, struct
+from binascii import unhexlify
+from functools import lru_cache
+
+PAYLOAD_KEY = b"Payload="
+
+# The header is always well under this many bytes, memoryview input only copies this much to search it
+HEADER_SCAN = 512
+
+# Header keys and the DSRCPacket attribute and type they map to
+HEADER_FIELDS = {
+	b"Version": ("version", str),
+	b"Type": ("msg_type", str),
+	b"PSID": ("psid", lambda v: int(v, 0)),
+	b"Priority": ("priority", int),
+	b"TxMode": ("tx_mode", str),
+	b"TxChannel": ("tx_channel", int),
+	b"TxInterval": ("tx_interval", int),
+	b"DeliveryStart": ("delivery_start", str),
+	b"DeliveryStop": ("delivery_stop", str),
+	b"Signature": ("signature", lambda v: v == "True"),
+	b"Encryption": ("encryption", lambda v: v == "True"),
+}
+HEADER_SLOTS = tuple(attr for attr, _ in HEADER_FIELDS.values())
+HEADER_INDEX = {key: i for i, key in enumerate(HEADER_FIELDS)}
+
+
+class DSRCPacket:
+	__slots__ = ("fields", "extra", "header", "payload")
+
+	def __init__(self, fields, extra, header, payload):
+		# fields is the cached tuple of header values in HEADER_SLOTS order, shared by every packet
+		# with the same header, and is exposed as read-only attributes (packet.psid, packet.msg_type, ...)
+		self.fields = fields
+		self.extra = extra
+		self.header = header
+		self.payload = payload
+
+	def __repr__(self):
+		return "DSRCPacket(type={}, psid={}, payload={} bytes)".format(self.msg_type, self.psid, len(self.payload))
+
+for _i, _attr in enumerate(HEADER_SLOTS):
+	setattr(DSRCPacket, _attr, property(lambda self, i=_i: self.fields[i]))
+
+@lru_cache(maxsize=64)
+def parse_header(header):
+	# Parses the Key=Value lines in front of Payload= into (fields, extra)
+	# Missing or unparseable fields are left as None, unknown keys are kept in extra
+	fields = [None] * len(HEADER_SLOTS)
+	extra = []
+	for line in header.splitlines():
+		key, sep, value = line.partition(b"=")
+		if not sep:
+			continue
+		value = value.strip().decode('ascii', 'replace')
+		i = HEADER_INDEX.get(key.strip())
+		if i is None:
+			extra.append((key.strip().decode('ascii', 'replace'), value))
+			continue
+		try:
+			fields[i] = HEADER_FIELDS[key.strip()][1](value)
+		except ValueError:
+			fields[i] = None
+	return tuple(fields), tuple(extra)
+
+def _split(packet):
+	# Returns (header end, payload start, payload end) without copying anything
+	if type(packet) is memoryview:
+		idx = packet[:HEADER_SCAN].tobytes().find(PAYLOAD_KEY)
+	else:
+		idx = packet.find(PAYLOAD_KEY)
+	if idx < 0:
+		raise ValueError("Packet has no Payload= field")
+	# The hex payload is terminated by a newline
+	end = len(packet)
+	if packet[end - 1] == 10:
+		end -= 1
+	return idx, idx + 8, end
+
+def parse_dsrc(packet):
+	# Parses a full driver packet (bytes, bytearray or memoryview) into a DSRCPacket
+	idx, start, end = _split(packet)
+	header = bytes(packet[:idx])
+	fields, extra = parse_header(header)
+	return DSRCPacket(fields, extra, header, unhexlify(packet[start:end]))
+
+PSID_INDEX = HEADER_SLOTS.index('psid')
+
+def peek_dsrc(packet):
+	# Returns (PSID, J2735 message ID) of a driver packet from the header and the first payload
+	# bytes, without decoding the rest of the payload. Either is None when it is missing.
+	idx, start, end = _split(packet)
+	fields, _ = parse_header(bytes(packet[:idx]))
+	msg_id = None
+	if end - start >= 4:
+		try:
+			msg_id = int(bytes(packet[start:start + 4]), 16) & 0x7FFF
+		except ValueError:
+			pass
+	return fields[PSID_INDEX], msg_id
+
+# Removes unnecessary RSU header information, returning the raw UPER payload
+# Originally from: https://github.com/usdot-fhwa-stol/carma-platform/blob/develop/engineering_tools/msgIntersect.py
+def strip_header(packet):
+	# Same as parse_dsrc(packet).payload, without looking at the header
+	if type(packet) is memoryview:
+		_, start, end = _split(packet)
+		return unhexlify(packet[start:end])
+	idx = packet.find(PAYLOAD_KEY)
+	if idx < 0:
+		raise ValueError("Packet has no Payload= field")
+	if packet[-1] == 10:
+		return unhexlify(packet[idx + 8:-1])
+	return unhexlify(packet[idx + 8:])
+
+
+# Compact VANET frames
+COMPACT_MAGIC = 0xC2
+COMPACT_VERSION = 1
+COMPACT_HEADER = struct.Struct("!BBBIHI")
+# PSID of packets whose driver header has none
+NO_PSID = 0xFFFFFFFF
+
+FRAMINGS = ('compact', 'driver')
+
+class CompactFrame:
+	__slots__ = ("version", "flags", "psid", "seq", "sender", "payload")
+
+	def __init__(self, version, flags, psid, seq, sender, payload):
+		self.version = version
+		self.flags = flags
+		self.psid = psid
+		self.seq = seq
+		self.sender = sender
+		self.payload = payload
+
+	def __repr__(self):
+		return "CompactFrame(psid={}, seq={}, sender={}, payload={} bytes)".format(self.psid, self.seq,
+			socket.inet_ntoa(struct.pack("!I", self.sender)), len(self.payload))
+
+def is_compact(data):
+	# Driver packets are ASCII, ARQ frames and acks start with 0xC1
+	return len(data) >= COMPACT_HEADER.size and data[0] == COMPACT_MAGIC
+
+def sender_id(ip):
+	# 32 bit sender ID of a dotted IPv4 address, 0 when unknown
+	try:
+		return struct.unpack("!I", socket.inet_aton(ip))[0]
+	except (OSError, TypeError):
+		return 0
+
+def frame_id(data):
+	# (sender ID, sequence number) of a compact frame, None for driver packets
+	if is_compact(data):
+		fields = COMPACT_HEADER.unpack_from(data)
+		return fields[5], fields[4]
+	return None
+
+def encode_compact(payload, psid, seq, sender, flags=0):
+	return COMPACT_HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, flags, NO_PSID if psid is None else psid, seq, sender) + payload
+
+def decode_compact(data):
+	magic, version, flags, psid, seq, sender = COMPACT_HEADER.unpack_from(data)
+	if version != COMPACT_VERSION:
+		raise ValueError("Unsupported VANET frame version {}".format(version))
+	return CompactFrame(version, flags, None if psid == NO_PSID else psid, seq, sender, bytes(data[COMPACT_HEADER.size:]))
+
+
+class CompactFramer:
+	# Translates driver packets from the LAN into compact frames, numbering them per sender.
+	# Numbering starts at a random point so a restarted radio does not reuse the sequence numbers
+	# its receivers still remember (see dedup.py).
+
+	def __init__(self, sender=0, seq=None):
+		self.sender = sender
+		self.seq = random.getrandbits(16) if seq is None else seq
+
+		# Counters, bytes before and after translation
+		self.framed = 0
+		self.passed = 0
+		self.bytes_in = 0
+		self.bytes_out = 0
+
+	def frame(self, data, packet=None):
+		# packet is parse_dsrc(data) if the caller already has it. Packets that are not driver
+		# packets are forwarded unchanged, as they were before compact framing.
+		if packet is None:
+			try:
+				packet = parse_dsrc(data)
+			except ValueError:
+				self.passed += 1
+				return data
+		self.seq = (self.seq + 1) & 0xFFFF
+		frame = encode_compact(packet.payload, packet.psid, self.seq, self.sender)
+		self.framed += 1
+		self.bytes_in += len(data)
+		self.bytes_out += len(frame)
+		return frame
+
+	def stats(self):
+		return {'framed': self.framed, 'passed': self.passed, 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+			'saved_pct': round(100.0 * (1 - self.bytes_out / self.bytes_in), 1) if self.bytes_in else 0.0}
+
+
+# Either VANET format: compact frame or driver packet
+def parse_vanet_packet(data):
+	# CompactFrame or DSRCPacket, both have .psid and .payload
+	if is_compact(data):
+		return decode_compact(data)
+	return parse_dsrc(data)
+
+def vanet_payload(data):
+	# Raw UPER payload of a VANET packet
+	if is_compact(data):
+		if data[1] != COMPACT_VERSION:
+			raise ValueError("Unsupported VANET frame version {}".format(data[1]))
+		return bytes(data[COMPACT_HEADER.size:])
+	return strip_header(data)
+
+def packet_psid(data):
+	# PSID of a compact frame or driver packet from its header, None when it has none
+	if is_compact(data):
+		psid = COMPACT_HEADER.unpack_from(data)[3]
+		return None if psid == NO_PSID else psid
+	return parse_header(bytes(data[:_split(data)[0]]))[0][PSID_INDEX]
+
+def peek_packet(data):
+	# (PSID, J2735 message ID) of a compact frame or driver packet, see peek_dsrc
+	if is_compact(data):
+		psid = COMPACT_HEADER.unpack_from(data)[3]
+		start = COMPACT_HEADER.size
+		msg_id = ((data[start] << 8) | data[start + 1]) & 0x7FFF if len(data) - start >= 2 else None
+		return None if psid == NO_PSID else psid, msg_id
+	return peek_dsrc(data)
@@ -0,0 +1,90 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code waits for a network interface to get its IPv4 address, for an OBU started at boot
+# before the LAN or the radio is up (INTERFACE_WAIT in config/params.yaml).
+#
+# The address is checked again whenever the kernel announces a link or address change on a
+# netlink socket, so the wait ends as soon as the interface is configured. Between announcements it
+# is also polled, starting at min_delay and doubling up to max_delay, which is all that is left
+# where netlink is not available.
+
+import time, socket, select
+import netifaces as ni
+
+# rtnetlink multicast groups: link up/down and IPv4 address changes
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+def interface_address(interface):
+	# IPv4 address of the interface, None while it has none (or does not exist yet)
+	try:
+		return ni.ifaddresses(interface)[ni.AF_INET][0]['addr']
+	except (ValueError, KeyError, IndexError):
+		return None
+
+def wait_for_interface(interface, timeout, logger=None, min_delay=0.02, max_delay=1.0):
+	# Returns the IPv4 address of interface, or None if it has none after timeout seconds
+	address = interface_address(interface)
+	if address is not None or timeout <= 0:
+		return address
+
+	if logger:
+		logger.info("Waiting up to {} s for interface {}".format(timeout, interface))
+	start = time.monotonic()
+	deadline = start + timeout
+	delay = min_delay
+	monitor = _netlink_monitor()
+	try:
+		while True:
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				if logger:
+					logger.warning("Interface {} has no IPv4 address after {} s".format(interface, timeout))
+				return None
+			wait = min(delay, remaining)
+			if monitor is None:
+				time.sleep(wait)
+			elif select.select([monitor], [], [], wait)[0]:
+				_drain(monitor)
+			delay = min(delay * 2, max_delay)
+			address = interface_address(interface)
+			if address is not None:
+				if logger:
+					logger.info("Interface {} up with {} after {:.3f} s".format(interface, address, time.monotonic() - start))
+				return address
+	finally:
+		if monitor is not None:
+			monitor.close()
+
+def _netlink_monitor():
+	try:
+		sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+	except (AttributeError, OSError):
+		return None
+	try:
+		sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+		sock.setblocking(False)
+	except OSError:
+		sock.close()
+		return None
+	return sock
+
+def _drain(sock):
+	# The announcements themselves are not parsed, the address is read with netifaces
+	try:
+		while sock.recv(65536):
+			pass
+	except OSError:
+		pass
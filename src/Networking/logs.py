@@ -0,0 +1,163 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code sets up the radio loggers so that logging never writes to disk on a forwarding thread.
+#
+# Records are put on a queue by a QueueHandler and written by a QueueListener thread, through a
+# rotating file handler. Messages are formatted on the listener thread too, so a record that is
+# logged with %-style arguments costs little more than the queue put.
+#
+# Per-packet records (sent, received, acked) go to the "<logger>.packets" child logger returned by
+# packet_logger(). That logger can be sampled (every Nth record) and rate limited (records per
+# second), so INFO level logging can stay on while forwarding at full rate.
+
+import os, time, atexit, logging
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+
+LOG_FORMAT = "[%(asctime)s.%(msecs)03d] %(levelname)s - %(message)s"
+LOG_DATE_FORMAT = "%d-%b-%y %H:%M:%S"
+
+_listeners = []
+
+
+_IMMUTABLE = (str, bytes, int, float, complex, bool, type(None))
+
+
+class _Mutable(Exception):
+	pass
+
+
+def _snapshot(arg):
+	# Returns an immutable copy of a log argument, raising _Mutable when it cannot be copied
+	if isinstance(arg, _IMMUTABLE):
+		return arg
+	if isinstance(arg, (bytearray, memoryview)):
+		# Receive buffers are reused for the next datagram, so copy what the record points at
+		return bytes(arg)
+	if isinstance(arg, tuple):
+		return tuple(_snapshot(item) for item in arg)
+	raise _Mutable
+
+
+class _LazyQueueHandler(QueueHandler):
+	# QueueHandler.prepare formats the message on the calling thread so the record can be pickled.
+	# The listener runs in the same process, so the record is queued as is and formatted there.
+	# Arguments are read only when formatted, so mutable ones (a reused receive buffer, a list)
+	# are copied now, or the message is formatted now when they cannot be copied.
+	def prepare(self, record):
+		args = record.args
+		if not args:
+			return record
+		try:
+			if isinstance(args, dict):
+				record.args = {key: _snapshot(value) for key, value in args.items()}
+			else:
+				record.args = _snapshot(args)
+		except _Mutable:
+			record.msg = record.getMessage()
+			record.args = None
+		return record
+
+
+class PacketSampler(logging.Filter):
+
+	def __init__(self, sample=1, rate=0):
+		super().__init__()
+		# sample: keep every Nth record, rate: keep at most this many records per second (0 = no limit)
+		self.sample = max(int(sample), 1)
+		self.rate = rate
+		self.seen = 0
+		self.window = 0
+		self.window_count = 0
+		self.skipped = 0
+
+	def filter(self, record):
+		self.seen += 1
+		if self.seen % self.sample:
+			self.skipped += 1
+			return False
+		if self.rate:
+			window = int(time.monotonic())
+			if window != self.window:
+				self.window = window
+				self.window_count = 0
+			if self.window_count >= self.rate:
+				self.skipped += 1
+				return False
+			self.window_count += 1
+		return True
+
+
+def start_logging(name, log_file, level=logging.INFO, max_bytes=0, backups=3, packet_sample=1, packet_rate=0):
+	# Returns the named logger, writing to log_file from a background thread
+	# With max_bytes the file is rotated, keeping `backups` old files; without it the file is
+	# truncated on start like before
+	log_dir = os.path.dirname(log_file)
+	if log_dir and not os.path.exists(log_dir):
+		os.mkdir(log_dir, 0o775)
+	if max_bytes:
+		file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups)
+	else:
+		file_handler = logging.FileHandler(log_file, "w")
+	file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt= LOG_DATE_FORMAT))
+
+	queue = SimpleQueue()
+	listener = QueueListener(queue, file_handler)
+	listener.start()
+	if not _listeners:
+		atexit.register(stop_logging)
+	_listeners.append(listener)
+
+	# LOG_FORMAT does not use the caller, thread or process of a record, so skip collecting them
+	# for every record (see "Optimization" in the logging HOWTO)
+	logging._srcfile = None
+	logging.logThreads = False
+	logging.logProcesses = False
+	logging.logMultiprocessing = False
+
+	logger = logging.getLogger(name)
+	logger.setLevel(level)
+	logger.addHandler(_LazyQueueHandler(queue))
+
+	packets = packet_logger(logger)
+	packets.filters = [f for f in packets.filters if not isinstance(f, PacketSampler)]
+	if packet_sample > 1 or packet_rate:
+		packets.addFilter(PacketSampler(packet_sample, packet_rate))
+	return logger
+
+def packet_logger(logger):
+	# Child logger for per-packet records, sharing the parent's level and handlers
+	return logging.getLogger(logger.name + ".packets")
+
+def skipped_packet_records(logger):
+	return sum(f.skipped for f in packet_logger(logger).filters if isinstance(f, PacketSampler))
+
+@contextmanager
+def paused_logging():
+	# Stops the listener threads for the duration, e.g. to fork worker processes without a thread
+	# running. Records logged meanwhile stay queued and are written once the listeners run again.
+	for listener in _listeners:
+		listener.stop()
+	try:
+		yield
+	finally:
+		for listener in _listeners:
+			listener.start()
+
+def stop_logging():
+	# Writes out everything still queued, called at exit
+	while _listeners:
+		_listeners.pop().stop()
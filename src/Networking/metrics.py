@@ -0,0 +1,250 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code keeps in-memory counters for UDP_NET and the OBU forwarding logic, and serves them as
+# JSON on a local Unix socket and/or in a periodically rewritten snapshot file.
+#
+# Counters are plain attribute increments with no locking. An increment can very rarely be lost when
+# two threads update the same counter, which is fine for monitoring and keeps the hot path cheap.
+#
+# To read the stats of a running radio:
+#   python -m Networking.metrics /tmp/c1t2x_stats.sock
+
+import os, sys, json, time, socket, bisect
+from threading import Thread, Event
+
+class NetCounters:
+	__slots__ = ("packets_in", "bytes_in", "packets_out", "bytes_out", "self_drops", "send_failures", "recv_failures",
+		"truncated")
+
+	def __init__(self):
+		for name in self.__slots__:
+			setattr(self, name, 0)
+
+	def snapshot(self):
+		return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ForwardingCounters:
+	__slots__ = ("lan_to_vanet", "vanet_to_lan", "acks_sent", "acks_received", "acks_suppressed", "foreign_acks",
+		"retransmits", "ack_timeouts", "unacknowledged", "repeats", "duplicates", "backlog_drops", "lan_drops",
+		"ack_latency")
+
+	def __init__(self):
+		for name in self.__slots__:
+			setattr(self, name, 0)
+		self.ack_latency = Histogram()
+
+	def snapshot(self):
+		stats = {name: getattr(self, name) for name in self.__slots__ if name != "ack_latency"}
+		stats['ack_latency'] = self.ack_latency.snapshot()
+		return stats
+
+
+# Histogram bucket upper bounds in seconds: 50 us doubling up to ~52 s
+LATENCY_BOUNDS = tuple(50e-6 * 2 ** i for i in range(21))
+
+class Histogram:
+	__slots__ = ("bounds", "counts", "count", "total", "max")
+
+	def __init__(self, bounds=LATENCY_BOUNDS):
+		self.bounds = bounds
+		self.counts = [0] * (len(bounds) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.total += value
+		if value > self.max:
+			self.max = value
+
+	def quantile(self, q):
+		# Upper bound of the bucket holding the q quantile
+		if not self.count:
+			return None
+		target = q * self.count
+		seen = 0
+		for i, n in enumerate(self.counts):
+			seen += n
+			if seen >= target:
+				return self.bounds[i] if i < len(self.bounds) else self.max
+		return self.max
+
+	def snapshot(self):
+		return {
+			'count': self.count,
+			'mean_ms': 1000.0 * self.total / self.count if self.count else None,
+			'p50_ms': _ms(self.quantile(0.50)),
+			'p99_ms': _ms(self.quantile(0.99)),
+			'max_ms': 1000.0 * self.max,
+			'buckets_ms': {"{:g}".format(1000.0 * b): n for b, n in zip(self.bounds, self.counts) if n},
+		}
+
+def _ms(value):
+	return None if value is None else 1000.0 * value
+
+def socket_drops(sock):
+	# Datagrams the kernel dropped for this socket (receive buffer full), from /proc/net/udp
+	# Returns None where that is not available
+	try:
+		inode = str(os.fstat(sock.fileno()).st_ino)
+		with open("/proc/net/udp") as f:
+			next(f)
+			for line in f:
+				fields = line.split()
+				if fields[9] == inode:
+					return int(fields[12])
+	except (OSError, ValueError, IndexError, StopIteration):
+		pass
+	return None
+
+
+class MetricsRegistry:
+
+	def __init__(self):
+		self.sources = {}
+		self.started = time.time()
+
+	def register(self, name, fn):
+		# fn() returns a JSON serializable dict, called on every snapshot
+		self.sources[name] = fn
+
+	def snapshot(self):
+		stats = {'time': time.time(), 'uptime_s': time.time() - self.started}
+		for name, fn in list(self.sources.items()):
+			try:
+				stats[name] = fn()
+			except Exception as excep:
+				stats[name] = {'error': str(excep)}
+		return stats
+
+	def to_json(self):
+		return json.dumps(self.snapshot(), indent=1, sort_keys=True, default=str)
+
+
+class StatsServer:
+
+	def __init__(self, registry, path, logger=None):
+
+		self.registry = registry
+		self.path = path
+		self.logger = logger
+		self.sock = None
+		self.thread = None
+
+	def start(self):
+		# Every connection to the socket gets one JSON snapshot, then the socket is closed
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.bind(self.path)
+		self.sock.listen(4)
+		self.thread = Thread(target= self._serve, name="StatsServer")
+		self.thread.daemon = True
+		self.thread.start()
+		if self.logger:
+			self.logger.info("Stats available on {}".format(self.path))
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+		try:
+			os.unlink(self.path)
+		except OSError:
+			pass
+
+	def _serve(self):
+		while self.sock is not None:
+			try:
+				conn, _ = self.sock.accept()
+			except OSError:
+				return
+			with conn:
+				try:
+					conn.sendall(self.registry.to_json().encode('utf-8'))
+				except OSError as excep:
+					if self.logger:
+						self.logger.warning("Unable to send stats: {}".format(excep))
+
+
+class SnapshotWriter:
+
+	def __init__(self, registry, path, interval=10.0, logger=None):
+
+		self.registry = registry
+		self.path = path
+		self.interval = interval
+		self.logger = logger
+		self.stopped = Event()
+		self.thread = None
+
+	def start(self):
+		self.thread = Thread(target= self._run, name="StatsSnapshot")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def close(self):
+		self.stopped.set()
+
+	def write(self):
+		# Written to a temporary file and renamed, so readers never see a partial snapshot
+		tmp_path = self.path + ".tmp"
+		with open(tmp_path, 'w') as f:
+			f.write(self.registry.to_json())
+		os.replace(tmp_path, self.path)
+
+	def _run(self):
+		while not self.stopped.wait(self.interval):
+			try:
+				self.write()
+			except OSError as excep:
+				if self.logger:
+					self.logger.warning("Unable to write stats snapshot {}: {}".format(self.path, excep))
+
+
+def start_endpoints(registry, params, logger=None):
+	# Starts the stats socket and snapshot writer configured in config/params.yaml, returns them for closing
+	endpoints = []
+	if params.get('STATS_SOCKET'):
+		try:
+			server = StatsServer(registry, params['STATS_SOCKET'], logger)
+			server.start()
+			endpoints.append(server)
+		except OSError as excep:
+			if logger:
+				logger.warning("Unable to open stats socket {}: {}".format(params['STATS_SOCKET'], excep))
+	if params.get('STATS_SNAPSHOT_FILE'):
+		writer = SnapshotWriter(registry, params['STATS_SNAPSHOT_FILE'], params.get('STATS_SNAPSHOT_INTERVAL', 10), logger)
+		writer.start()
+		endpoints.append(writer)
+	return endpoints
+
+
+def read_stats(path):
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+		s.connect(path)
+		chunks = []
+		while True:
+			chunk = s.recv(65536)
+			if not chunk:
+				break
+			chunks.append(chunk)
+	return b"".join(chunks).decode('utf-8')
+
+if __name__ == '__main__':
+	print(read_stats(sys.argv[1] if len(sys.argv) > 1 else "/tmp/c1t2x_stats.sock"))
@@ -13,15 +13,32 @@
 # the License.
 
 # This code creates a socket based on inputted variables, enables logging, and allows for sending/receiving
+#
+# TRANSPORT selects how packets reach the other radios. 'broadcast' sends to the subnet broadcast
+# address, and the kernel also delivers every sent packet back to our own socket, where it is
+# dropped by source IP. 'multicast' joins MULTICAST_GROUP on INTERFACE and sends to the group with
+# IP_MULTICAST_LOOP off, so the kernel never hands our own packets back.
+#
+# Datagrams larger than FRAGMENT_SIZE are sent as fragments and put back together on receive
+# (Networking/fragments.py). Datagrams larger than BUFFER_SIZE cannot be received whole; they are
+# detected by reading one byte more than BUFFER_SIZE, counted and dropped instead of being passed
+# on cut short. (recvmsg would report MSG_TRUNC as well, but costs more per datagram.)
 
-import os, logging
-from ruamel.yaml import YAML
+import os, logging, struct
 import socket
 import netifaces as ni
 
+from Networking.metrics import NetCounters, socket_drops
+from Networking.logs import start_logging, packet_logger
+from Networking.capture import DIR_IN, DIR_OUT
+from Networking.fragments import Fragmenter, Reassembler, FRAGMENT_MAGIC, is_fragment
+from Networking.configs import load_yaml
+from Networking.interfaces import wait_for_interface
+
 class UDP_NET:
 
-	def __init__(self, CONFIG_FILE='VANET_params.yaml', logging_level=logging.DEBUG, print_data=False, logger=None):
+	def __init__(self, CONFIG_FILE='VANET_params.yaml', logging_level=logging.DEBUG, print_data=False, logger=None, params=None,
+			interface_wait=0):
 
 		self.print_data = print_data
 
@@ -36,40 +53,44 @@ class UDP_NET:
 		else:
 			logs_directory = os.path.join(os.getcwd(), "Logs")
 
-			# IF: Check if the Logs directory does not exist
-			if not os.path.exists(logs_directory):
-				# Create Logs directory
-				os.mkdir(logs_directory, 0o777)
-
 			# Log filename
 			log_filename = "Network_{}.log".format(self.netType)
 
 			# Initialize logger
-			self.logger = logging.getLogger(__name__)
-			self.logger.setLevel(logging_level)
+			self.logger = start_logging("{}.{}".format(__name__, self.netType), os.path.join(logs_directory, log_filename), logging_level)
 
-			logger_handler = logging.FileHandler(os.path.join(logs_directory, log_filename), "w")
-			logger_handler.setLevel(logging_level)
-
-			logger_formatter = logging.Formatter("[%(asctime)s.%(msecs)03d] %(levelname)s - %(message)s", datefmt= "%d-%b-%y %H:%M:%S")
-
-			logger_handler.setFormatter(logger_formatter)
-			self.logger.addHandler(logger_handler)
+		# Per-packet records, sampled/rate limited when configured
+		self.packetLogger = packet_logger(self.logger)
 
 		# Import Configs
+		# A params dict can be passed in place of the yaml file (benchmarks, loopback testing)
 		script_dir = os.path.dirname(__file__)
 		fpath = 'config/' + CONFIG_FILE
 		file_path = os.path.join(script_dir, fpath)
 		try:
-			y=YAML(typ='safe')
-			with open(file_path,'r') as f:
-				params = y.load(f)
+			if params is None:
+				params = load_yaml(file_path)
 			self.sendIP = params['sendIP']
 			self.sendPORT = params['sendPORT']
 			self.recvIP = params['recvIP']
 			self.recvPORT = params['recvPORT']
 			self.bufferSize = params['BUFFER_SIZE']
 			INTERFACE = params['INTERFACE']
+			# Optional: disable dropping packets from our own IP (e.g. several endpoints on loopback)
+			self.filterSelf = params.get('FILTER_SELF', True)
+			# Optional: number of preallocated receive buffers used by recv_many
+			self.recvBatch = params.get('RECV_BATCH', 64)
+			# Optional: 'broadcast' or 'multicast', with the multicast group, TTL and loopback
+			self.transport = params.get('TRANSPORT', 'broadcast')
+			self.multicastGroup = params.get('MULTICAST_GROUP', '239.192.0.17')
+			self.multicastTTL = params.get('MULTICAST_TTL', 1)
+			self.multicastLoop = params.get('MULTICAST_LOOP', False)
+			self.interface = INTERFACE
+			# Optional: fragment datagrams above FRAGMENT_SIZE bytes (0 never fragments), and the
+			# limits of the fragments held for reassembly (REASSEMBLY_MAX_BYTES 0 does not reassemble)
+			self.fragmentSize = params.get('FRAGMENT_SIZE', 0)
+			reassemblyParams = (params.get('REASSEMBLY_TIMEOUT', 2.0), params.get('REASSEMBLY_MAX_MESSAGES', 64),
+				params.get('REASSEMBLY_MAX_BYTES', 0))
 		except Exception as e:
 			if logger:
 				self.logger.error("{}: Unable to import yaml configs".format(self.netType))
@@ -78,6 +99,9 @@ class UDP_NET:
 			if self.print_data:
 				print("Unable to import yaml configs")
 
+		# Started at boot, the interface may only come up after the OBU (INTERFACE_WAIT in params.yaml)
+		if interface_wait:
+			wait_for_interface(INTERFACE, interface_wait, self.logger)
 		try:
 			self.selfIP = ni.ifaddresses(INTERFACE)[ni.AF_INET][0]['addr']
 		except:
@@ -86,20 +110,53 @@ class UDP_NET:
 				print("Not connected to the {} interface".format(self.netType))
 				raise e
 
+		if self.transport == 'multicast':
+			# Packets go to and are received from the group, sendIP/recvIP are not used
+			self.sendIP = self.recvIP = self.multicastGroup
+			if not self.multicastLoop:
+				# The kernel does not loop our own packets back, nothing to filter
+				self.filterSelf = False
+		elif self.transport != 'broadcast':
+			self.logger.warning("{}: Unknown TRANSPORT '{}', using broadcast".format(self.netType, self.transport))
+			self.transport = 'broadcast'
+
+		self.fragmenter = Fragmenter(self.fragmentSize) if self.fragmentSize else None
+		self.reassembler = Reassembler(*reassemblyParams) if reassemblyParams[2] else None
+		if self.fragmentSize > self.bufferSize:
+			self.logger.warning("{}: FRAGMENT_SIZE {} is larger than BUFFER_SIZE {}, fragments will be truncated".format(
+				self.netType, self.fragmentSize, self.bufferSize))
+
 		# Initialize socket to None
 		self.sock=None
 
+		# Receive ring for recv_many, allocated on first use
+		self.rxRing = None
+		self.rxNext = 0
+
+		# Packet and byte counters, see stats()
+		self.metrics = NetCounters()
+
+		# Capture file every datagram is recorded to, see set_capture()
+		self.capture = None
+
 		# Log initial data
 		self.logger.info("{}: HARDWARE INTERFACE: {}".format(self.netType, INTERFACE))
 		self.logger.info("{}: SEND IP | PORT: {} | {}".format(self.netType,self.sendIP,self.sendPORT))
 		self.logger.info("{}: RECV IP | PORT: {} | {}".format(self.netType,self.recvIP, self.recvPORT))
+		if self.transport == 'multicast':
+			self.logger.info("{}: MULTICAST TTL | LOOP: {} | {}".format(self.netType, self.multicastTTL, self.multicastLoop))
 
 	def start_connection(self):
 		# Attempts to create a bound socket to the target IP:PORT
 		try:
 			self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-			self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-			self.sock.bind((self.recvIP, self.recvPORT))
+			if self.transport == 'multicast':
+				self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+				self.sock.bind((self.recvIP, self.recvPORT))
+				self.join_group()
+			else:
+				self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+				self.sock.bind((self.recvIP, self.recvPORT))
 			self.logger.info("{}: Socket bound at: {} | {}".format(self.netType,self.recvIP,self.recvPORT))
 		except Exception as excep:
 			self.logger.critical("{}: Unable to bind socket".format(self.netType))
@@ -111,32 +168,231 @@ class UDP_NET:
 				print("{}: Unable to bind socket".format(self.netType))
 			raise NotImplementedError
 
+	def join_group(self):
+		# Joins the multicast group on INTERFACE and sends from it, with explicit TTL and loopback
+		try:
+			ifindex = socket.if_nametoindex(self.interface)
+		except OSError:
+			ifindex = 0
+		local = socket.inet_aton(getattr(self, 'selfIP', None) or '0.0.0.0')
+		mreqn = struct.pack("=4s4si", socket.inet_aton(self.multicastGroup), local, ifindex)
+		self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreqn)
+		self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, mreqn)
+		self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.multicastTTL)
+		self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1 if self.multicastLoop else 0)
+		self.logger.info("{}: Joined multicast group {} on {}".format(self.netType, self.multicastGroup, self.interface))
+
 	def send_data(self, packet, encoded_status = True):
 		# Attempts to encode and send a packet to the target IP:PORT
+		# Returns False if the packet could not be handed to the kernel
 		try: 
 			if not encoded_status:
-				self.logger.debug("{}: Packet encoded as type 'ascii'".format(self.netType))
+				self.packetLogger.debug("%s: Packet encoded as type 'ascii'", self.netType)
 				packet = str(packet).encode('ascii')
+			if self.fragmenter is not None and len(packet) > self.fragmentSize:
+				fragments = self.fragmenter.split(packet)
+				return self.send_many(fragments) == len(fragments)
 			self.sock.sendto(packet,(self.sendIP,self.sendPORT))
-			self.logger.info("{}: Packet '{}' sent to {}".format(self.netType,packet,self.sendIP))
+			self.metrics.packets_out += 1
+			self.metrics.bytes_out += len(packet)
+			if self.capture is not None:
+				self.capture.write(DIR_OUT, self.netType, (self.sendIP, self.sendPORT), packet)
+			self.packetLogger.info("%s: Packet '%s' sent to %s", self.netType, packet, self.sendIP)
+			return True
 		except:
+			self.metrics.send_failures += 1
 			self.logger.warning("Attempted to send message to the {} - it may not yet be connected".format(self.netType))
 			if self.print_data:
 				print("{} may not yet be connected".format(self.netType))
+			return False
 
 	def recv_packets(self):
 		# Attempts to retrieve packets from the current packet buffer
+		# Returns None for a fragment of a datagram that is not complete yet
 		try:
-			packet = self.sock.recvfrom(self.bufferSize)
+			packet = self.sock.recvfrom(self.bufferSize + 1)
+			data, addr = packet
+			if len(data) > self.bufferSize:
+				self.drop_truncated(addr)
+				return None
 			# checks if received packet is from self
-			if packet[1][0] != self.selfIP:
-				self.logger.info("{}: Received '{}' from {}".format(self.netType, packet[0], packet[1][0]))
+			if not self.filterSelf or packet[1][0] != self.selfIP:
+				self.metrics.packets_in += 1
+				self.metrics.bytes_in += len(packet[0])
+				if self.capture is not None:
+					self.capture.write(DIR_IN, self.netType, packet[1], packet[0])
+				self.packetLogger.info("%s: Received '%s' from %s", self.netType, packet[0], packet[1][0])
+				if self.reassembler is not None and data and data[0] == FRAGMENT_MAGIC:
+					data = self.reassembler.add(data, addr)
+					return None if data is None else (data, addr)
 				return packet
 			else:
-				self.logger.debug("{}: Received packet from self @ IP: {}".format(self.netType,packet[1][0]))
+				self.metrics.self_drops += 1
+				self.packetLogger.debug("%s: Received packet from self @ IP: %s", self.netType, packet[1][0])
 				return None
 		except:
+			self.metrics.recv_failures += 1
 			self.logger.warning("Attempted to receive message from the {} - it may not yet be connected".format(self.netType))
 			if self.print_data:
 				print("Network may not yet be connected")
 			return None
+
+	def fileno(self):
+		# Lets a UDP_NET be registered directly with selectors/epoll
+		return self.sock.fileno()
+
+	def setblocking(self, flag):
+		self.sock.setblocking(flag)
+
+	def recv_pending(self):
+		# Yields every datagram currently queued on a non-blocking socket, then returns
+		# Packets from our own IP are dropped the same way as in recv_packets
+		while True:
+			try:
+				packet = self.sock.recvfrom(self.bufferSize + 1)
+			except BlockingIOError:
+				return
+			except OSError as excep:
+				self.metrics.recv_failures += 1
+				self.logger.warning("{}: Receive failed: {}".format(self.netType, excep))
+				return
+			data, addr = packet
+			if len(data) > self.bufferSize:
+				self.drop_truncated(addr)
+				continue
+			if self.filterSelf and packet[1][0] == self.selfIP:
+				self.metrics.self_drops += 1
+				self.packetLogger.debug("%s: Received packet from self @ IP: %s", self.netType, packet[1][0])
+				continue
+			self.metrics.packets_in += 1
+			self.metrics.bytes_in += len(packet[0])
+			if self.capture is not None:
+				self.capture.write(DIR_IN, self.netType, packet[1], packet[0])
+			self.packetLogger.info("%s: Received '%s' from %s", self.netType, packet[0], packet[1][0])
+			if self.reassembler is not None and data and data[0] == FRAGMENT_MAGIC:
+				data = self.reassembler.add(data, addr)
+				if data is None:
+					continue
+				packet = (data, addr)
+			yield packet
+
+	def recv_many(self, max_packets=None, block=False):
+		# Drains every datagram currently queued on the socket into a preallocated ring of bytearrays
+		# Returns a list of (memoryview, address) tuples. The views point into the ring and stay valid
+		# until the ring wraps around (RECV_BATCH datagrams later), so copy with bytes() to keep one.
+		# If block is True and the socket is blocking, waits for the first datagram.
+		# Reassembled datagrams are returned as bytes, they are not in the ring.
+		if self.rxRing is None:
+			self.rxRing = [memoryview(bytearray(self.bufferSize + 1)) for _ in range(self.recvBatch)]
+		ring = self.rxRing
+		size = len(ring)
+		limit = size if max_packets is None else min(max_packets, size)
+		recvfrom_into = self.sock.recvfrom_into
+		bufferSize = self.bufferSize
+		filterSelf = self.filterSelf
+		selfIP = self.selfIP
+		reassembler = self.reassembler
+		capture = self.capture
+		i = self.rxNext
+		flags = 0 if block else socket.MSG_DONTWAIT
+		packets = []
+		self_count = 0
+		datagrams = 0
+		nbytes_total = 0
+		while len(packets) < limit:
+			buf = ring[i]
+			try:
+				nbytes, addr = recvfrom_into(buf, 0, flags)
+			except BlockingIOError:
+				break
+			except OSError as excep:
+				self.metrics.recv_failures += 1
+				self.logger.warning("{}: Receive failed: {}".format(self.netType, excep))
+				break
+			flags = socket.MSG_DONTWAIT
+			if nbytes > bufferSize:
+				self.drop_truncated(addr)
+				continue
+			if filterSelf and addr[0] == selfIP:
+				self_count += 1
+				continue
+			datagrams += 1
+			nbytes_total += nbytes
+			if capture is not None:
+				capture.write(DIR_IN, self.netType, addr, buf[:nbytes])
+			if reassembler is not None and nbytes and buf[0] == FRAGMENT_MAGIC:
+				# The fragment is copied out, its ring slot is reused
+				data = reassembler.add(buf[:nbytes], addr)
+				if data is not None:
+					packets.append((data, addr))
+				continue
+			packets.append((buf[:nbytes], addr))
+			i += 1
+			if i == size:
+				i = 0
+		self.rxNext = i
+		metrics = self.metrics
+		metrics.packets_in += datagrams
+		metrics.bytes_in += nbytes_total
+		metrics.self_drops += self_count
+		if self_count:
+			self.packetLogger.debug("%s: Dropped %d packet(s) from self", self.netType, self_count)
+		if packets:
+			self.packetLogger.debug("%s: Received batch of %d packet(s)", self.netType, len(packets))
+		return packets
+
+	def send_many(self, packets, addr=None):
+		# Sends a batch of packets to addr (default: the configured send IP:PORT)
+		# Returns the number of datagrams handed to the kernel, fragments included
+		if addr is None:
+			addr = (self.sendIP, self.sendPORT)
+		if self.fragmenter is not None and any(len(packet) > self.fragmentSize for packet in packets):
+			packets = [fragment for packet in packets for fragment in self.fragmenter.split(packet)]
+		sendto = self.sock.sendto
+		sent = 0
+		nbytes = 0
+		try:
+			for packet in packets:
+				nbytes += sendto(packet, addr)
+				sent += 1
+		except BlockingIOError:
+			self.logger.warning("{}: Send buffer full, {} packet(s) not sent".format(self.netType, len(packets) - sent))
+		except OSError:
+			self.logger.warning("Attempted to send message to the {} - it may not yet be connected".format(self.netType))
+		self.metrics.packets_out += sent
+		self.metrics.bytes_out += nbytes
+		self.metrics.send_failures += len(packets) - sent
+		if self.capture is not None:
+			for i in range(sent):
+				self.capture.write(DIR_OUT, self.netType, addr, packets[i])
+		if sent:
+			self.packetLogger.debug("%s: Sent batch of %d packet(s) to %s", self.netType, sent, addr[0])
+		return sent
+
+	def reassemble(self, data, addr):
+		# For receive paths outside of this class (asyncio): the whole datagram, or None while
+		# fragments of it are still missing
+		if self.reassembler is not None and is_fragment(data):
+			return self.reassembler.add(data, addr)
+		return data
+
+	def drop_truncated(self, addr):
+		self.metrics.truncated += 1
+		self.logger.warning("{}: Dropped a datagram from {} larger than BUFFER_SIZE ({} bytes)".format(
+			self.netType, addr[0], self.bufferSize))
+
+	def set_capture(self, capture):
+		# Records every datagram sent and received from now on to a Networking.capture.CaptureWriter
+		# (None stops recording). LAN and VANET can share one writer.
+		self.capture = capture
+
+	def stats(self):
+		# Counters plus the datagrams the kernel dropped because the receive buffer was full
+		stats = self.metrics.snapshot()
+		stats['transport'] = self.transport
+		if self.fragmenter is not None:
+			stats['fragmentation'] = self.fragmenter.stats()
+		if self.reassembler is not None:
+			stats['reassembly'] = self.reassembler.stats()
+		stats['kernel_drops'] = socket_drops(self.sock) if self.sock is not None else None
+		return stats
@@ -0,0 +1,192 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code splits a forwarding direction of the threaded backend into stages (receive, forward,
+# send) that run on their own threads, connected by bounded ring buffers. A slow or failing send
+# then fills a ring buffer instead of stalling the receive thread, and the ring buffer's counters
+# show it (PIPELINE_* in config/params.yaml).
+#
+# A full ring buffer applies its overflow policy to a new packet:
+#   drop_oldest  the oldest waiting packet is dropped to make room (newest data wins)
+#   drop_newest  the new packet is dropped
+#   block        the producer waits up to block_timeout seconds for room, then drops the new packet
+
+import time
+from threading import Thread, Lock, Condition
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+class RingBuffer:
+
+	def __init__(self, capacity=1024, policy=DROP_OLDEST, block_timeout=0.5):
+		if policy not in POLICIES:
+			raise ValueError("Unknown overflow policy {}".format(policy))
+
+		# Slots are allocated once, items are written in place
+		self.capacity = capacity
+		self.slots = [None] * capacity
+		self.head = 0
+		self.count = 0
+		self.policy = policy
+		self.block_timeout = block_timeout
+
+		lock = Lock()
+		self.not_empty = Condition(lock)
+		self.not_full = Condition(lock)
+
+		# Counters
+		self.puts = 0
+		self.dropped = 0
+		self.blocked = 0
+		self.blocked_time = 0.0
+		self.max_depth = 0
+
+	def __len__(self):
+		return self.count
+
+	def put(self, item):
+		# Returns False if the item (or, with drop_oldest, an older one) was dropped
+		with self.not_full:
+			accepted = True
+			if self.count >= self.capacity:
+				if self.policy == DROP_OLDEST:
+					self.slots[self.head] = None
+					self.head = (self.head + 1) % self.capacity
+					self.count -= 1
+					self.dropped += 1
+					accepted = False
+				elif self.policy == DROP_NEWEST:
+					self.dropped += 1
+					return False
+				else:
+					self.blocked += 1
+					start = time.monotonic()
+					room = self.not_full.wait_for(lambda: self.count < self.capacity, self.block_timeout)
+					self.blocked_time += time.monotonic() - start
+					if not room:
+						self.dropped += 1
+						return False
+			self.slots[(self.head + self.count) % self.capacity] = item
+			self.count += 1
+			self.puts += 1
+			if self.count > self.max_depth:
+				self.max_depth = self.count
+			self.not_empty.notify()
+			return accepted
+
+	def get(self, timeout=None):
+		# Oldest item, or None if nothing arrived within timeout
+		with self.not_empty:
+			if not self.count and not self.not_empty.wait_for(lambda: self.count, timeout):
+				return None
+			item = self.slots[self.head]
+			self.slots[self.head] = None
+			self.head = (self.head + 1) % self.capacity
+			self.count -= 1
+			self.not_full.notify()
+			return item
+
+	def stats(self):
+		return {'capacity': self.capacity, 'depth': self.count, 'max_depth': self.max_depth, 'puts': self.puts,
+			'dropped': self.dropped, 'blocked': self.blocked, 'blocked_s': round(self.blocked_time, 3)}
+
+
+class Stage:
+	# One thread taking items from inbox, calling fn(item), and putting what fn returns (unless None)
+	# into outbox
+
+	def __init__(self, name, fn, inbox, outbox=None, logger=None, error_delay=0.0):
+		self.name = name
+		self.fn = fn
+		self.inbox = inbox
+		self.outbox = outbox
+		self.logger = logger
+		# Pause after a failing fn, e.g. while an interface is down
+		self.error_delay = error_delay
+		self.thread = None
+		self.running = False
+
+		# Counters
+		self.processed = 0
+		self.errors = 0
+
+	def start(self):
+		self.running = True
+		self.thread = Thread(target=self.run, name=self.name, daemon=True)
+		self.thread.start()
+
+	def run(self):
+		while self.running:
+			item = self.inbox.get(0.5)
+			if item is None:
+				continue
+			try:
+				out = self.fn(item)
+			except Exception as excep:
+				self.errors += 1
+				if self.logger:
+					# The traceback of the first failure, then one line per failure
+					self.logger.warning("Stage %s failed: %s", self.name, excep, exc_info=self.errors == 1)
+				if self.error_delay:
+					time.sleep(self.error_delay)
+				continue
+			self.processed += 1
+			if out is not None and self.outbox is not None:
+				self.outbox.put(out)
+
+	def stop(self):
+		self.running = False
+
+	def stats(self):
+		stats = {'processed': self.processed, 'errors': self.errors}
+		stats['queue'] = self.inbox.stats()
+		return stats
+
+
+class Pipeline:
+	# Stages run in the order they were added; put() feeds the first one
+
+	def __init__(self, name, capacity=1024, policy=DROP_OLDEST, block_timeout=0.5, logger=None):
+		self.name = name
+		self.capacity = capacity
+		self.policy = policy
+		self.block_timeout = block_timeout
+		self.logger = logger
+		self.stages = []
+
+	def add_stage(self, name, fn, error_delay=0.0, policy=None):
+		# policy overrides the pipeline's overflow policy for this stage's inbox
+		inbox = RingBuffer(self.capacity, policy or self.policy, self.block_timeout)
+		stage = Stage("{}.{}".format(self.name, name), fn, inbox, logger=self.logger, error_delay=error_delay)
+		if self.stages:
+			self.stages[-1].outbox = inbox
+		self.stages.append(stage)
+		return stage
+
+	def put(self, item):
+		return self.stages[0].inbox.put(item)
+
+	def start(self):
+		for stage in self.stages:
+			stage.start()
+
+	def stop(self):
+		for stage in self.stages:
+			stage.stop()
+
+	def stats(self):
+		return {stage.name.rpartition('.')[2]: stage.stats() for stage in self.stages}
@@ -0,0 +1,434 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code profiles a running radio on demand: stage tracing times the forwarding stages (socket
+# receive and send, the receive threads' handling, the pipeline stages, logging) into one histogram
+# per stage, and profiling runs cProfile and tracemalloc. Both are switched on and off at runtime
+# with a signal (SIGUSR2 tracing, SIGUSR1 profiling) or a command on CONTROL_SOCKET, and write
+# their results to Logs/ when they stop.
+#
+# The stages are functions looked up on every call (instance attributes, module globals, Stage.fn).
+# While tracing or profiling is on they are replaced by timed wrappers, and the originals are put
+# back when both are off, so a radio that is not being profiled runs exactly the code it would run
+# without this module.
+#
+# Before Python 3.12, cProfile only profiles the thread that enabled it, so each forwarding thread
+# gets its own profile, enabled around the outermost stage call it makes. From 3.12 on one profile
+# covers every thread. Profiling slows the stages down, so spans traced at the same time are longer.
+#
+# To send a command to a running radio:
+#   python -m Networking.profiling /tmp/c1t2x_control.sock profile start
+
+import os, sys, io, json, time, socket, signal, marshal, cProfile, tracemalloc
+from threading import Thread, Lock, local
+from queue import SimpleQueue
+from bisect import bisect_left
+
+from Networking.metrics import Histogram
+
+# Span bucket upper bounds in seconds: 1 us doubling up to ~1 s
+SPAN_BOUNDS = tuple(1e-6 * 2 ** i for i in range(21))
+
+# From 3.12 on cProfile uses sys.monitoring, which profiles every thread at once
+GLOBAL_PROFILE = sys.version_info >= (3, 12)
+
+COMMANDS = ("trace start", "trace stop", "profile start", "profile stop", "status")
+
+class _ThreadProfile:
+	__slots__ = ("profile", "depth")
+
+	def __init__(self):
+		self.profile = cProfile.Profile()
+		self.depth = 0
+
+
+class RuntimeProfiler:
+
+	def __init__(self, directory, logger=None, top=40, tracemalloc_frames=10, clock=time.perf_counter):
+
+		self.directory = directory
+		self.logger = logger
+		# Functions listed in the profile summary, frames kept per allocation
+		self.top = top
+		self.tracemalloc_frames = tracemalloc_frames
+		self.clock = clock
+		# (object, attribute, span name) of the stages that can be traced
+		self.targets = []
+		# (object, attribute, original, own attribute) of the wrappers in place
+		self.installed = []
+		self.spans = {}
+		self.tracing = False
+		self.profiling = False
+		self.lock = Lock()
+
+		# Profiles of the current profiling run, one per thread before 3.12
+		self.profile = None
+		self.thread_profiles = []
+		self.local = local()
+		self.started_tracemalloc = False
+
+		# Files written, newest last
+		self.dumps = []
+
+	def add(self, obj, attr, name):
+		# Traces obj.attr as the span name, several targets can share a span
+		with self.lock:
+			self.targets.append((obj, attr, name))
+			self._reinstall()
+
+	def start_tracing(self):
+		with self.lock:
+			if self.tracing:
+				return "tracing already on"
+			self.spans = {}
+			self.tracing = True
+			self._reinstall()
+		self._log("Stage tracing started")
+		return "tracing started"
+
+	def stop_tracing(self):
+		with self.lock:
+			if not self.tracing:
+				return "tracing already off"
+			self.tracing = False
+			self._reinstall()
+		path = self._write("trace", ".json", lambda f: json.dump(self.span_stats(), f, indent=1, sort_keys=True))
+		self._log("Stage tracing stopped, spans written to {}".format(path))
+		return "tracing stopped, spans written to {}".format(path)
+
+	def start_profiling(self):
+		with self.lock:
+			if self.profiling:
+				return "profiling already on"
+			if GLOBAL_PROFILE:
+				profile = cProfile.Profile()
+				try:
+					profile.enable()
+				except ValueError as excep:
+					# Another profiler or debugger holds sys.monitoring
+					return "unable to start profiling: {}".format(excep)
+				self.profile = profile
+			self.thread_profiles = []
+			self.local = local()
+			self.started_tracemalloc = not tracemalloc.is_tracing()
+			if self.started_tracemalloc:
+				tracemalloc.start(self.tracemalloc_frames)
+			self.profiling = True
+			self._reinstall()
+		self._log("Profiling started")
+		return "profiling started"
+
+	def stop_profiling(self):
+		with self.lock:
+			if not self.profiling:
+				return "profiling already off"
+			self.profiling = False
+			self._reinstall()
+			if self.profile is not None:
+				self.profile.disable()
+				profiles = [self.profile]
+				self.profile = None
+			else:
+				profiles = [state.profile for state in self._settled(self.thread_profiles)]
+			self.thread_profiles = []
+			snapshot = tracemalloc.take_snapshot()
+			traced = tracemalloc.get_traced_memory()
+			if self.started_tracemalloc:
+				tracemalloc.stop()
+
+		paths = []
+		if profiles:
+			# Imported here, it pulls in inspect and dataclasses and slows the OBU start
+			import pstats
+			stats = pstats.Stats(*profiles, stream=io.StringIO())
+			# Same format as Stats.dump_stats, for pstats or snakeviz
+			paths.append(self._write("profile", ".pstats", lambda f: marshal.dump(stats.stats, f), binary=True))
+			paths.append(self._write("profile", ".txt", lambda f: self._print_profile(stats, f)))
+		paths.append(self._write("tracemalloc", ".txt", lambda f: self._print_allocations(snapshot, traced, f)))
+		self._log("Profiling stopped, results written to {}".format(", ".join(paths)))
+		return "profiling stopped, results written to {}".format(", ".join(paths))
+
+	def toggle_tracing(self):
+		return self.stop_tracing() if self.tracing else self.start_tracing()
+
+	def toggle_profiling(self):
+		return self.stop_profiling() if self.profiling else self.start_profiling()
+
+	def command(self, line):
+		# One control socket command, returns the reply
+		command = " ".join(line.split()).lower()
+		if command == "trace start":
+			return self.start_tracing()
+		if command == "trace stop":
+			return self.stop_tracing()
+		if command == "profile start":
+			return self.start_profiling()
+		if command == "profile stop":
+			return self.stop_profiling()
+		if command == "status":
+			return json.dumps(self.stats(), indent=1, sort_keys=True)
+		return "unknown command '{}', expected one of: {}".format(line.strip(), ", ".join(COMMANDS))
+
+	def close(self):
+		# Stops tracing and profiling on shutdown, so their results are written
+		if self.profiling:
+			self.stop_profiling()
+		if self.tracing:
+			self.stop_tracing()
+
+	def span_stats(self):
+		stats = {}
+		for name, hist in list(self.spans.items()):
+			# The timed wrappers only update the buckets, total and max
+			hist.count = sum(hist.counts)
+			stats[name] = hist.snapshot()
+		return stats
+
+	def stats(self):
+		return {'tracing': self.tracing, 'profiling': self.profiling, 'stages': sorted({t[2] for t in self.targets}),
+			'spans': self.span_stats(), 'dumps': self.dumps[-10:]}
+
+	def _reinstall(self):
+		# Puts back the original functions, then wraps them again for what is still on
+		# Called with the lock held
+		for obj, attr, original, own in reversed(self.installed):
+			if own:
+				setattr(obj, attr, original)
+			else:
+				delattr(obj, attr)
+		self.installed = []
+		profile = self.profiling and not GLOBAL_PROFILE
+		if not self.tracing and not profile:
+			return
+		for obj, attr, name in self.targets:
+			fn = getattr(obj, attr)
+			own = attr in vars(obj)
+			hist = None
+			if self.tracing:
+				hist = self.spans.get(name)
+				if hist is None:
+					hist = self.spans[name] = Histogram(SPAN_BOUNDS)
+			setattr(obj, attr, self._profiled(fn, hist) if profile else self._timed(fn, hist))
+			self.installed.append((obj, attr, fn, own))
+
+	def _timed(self, fn, hist):
+		# Histogram.observe inlined, the stages are only called with positional arguments
+		clock = self.clock
+		counts = hist.counts
+		bounds = hist.bounds
+
+		def timed(*args):
+			start = clock()
+			try:
+				return fn(*args)
+			finally:
+				elapsed = clock() - start
+				counts[bisect_left(bounds, elapsed)] += 1
+				hist.total += elapsed
+				if elapsed > hist.max:
+					hist.max = elapsed
+		return timed
+
+	def _profiled(self, fn, hist):
+		# Profiles the calling thread for the outermost wrapped call it is in
+		clock = self.clock
+		observe = hist.observe if hist is not None else None
+		thread_profile = self._thread_profile
+
+		def profiled(*args):
+			state = thread_profile()
+			state.depth += 1
+			if state.depth == 1:
+				state.profile.enable()
+			start = clock()
+			try:
+				return fn(*args)
+			finally:
+				if observe is not None:
+					observe(clock() - start)
+				state.depth -= 1
+				if not state.depth:
+					state.profile.disable()
+		return profiled
+
+	def _thread_profile(self):
+		state = getattr(self.local, 'state', None)
+		if state is None:
+			state = self.local.state = _ThreadProfile()
+			self.thread_profiles.append(state)
+		return state
+
+	def _settled(self, states, timeout=1.0):
+		# Gives threads still inside a wrapped call (e.g. a blocking receive) up to timeout seconds
+		# to leave it, so their profiles are not read while they are being written
+		deadline = time.monotonic() + timeout
+		while any(state.depth for state in states) and time.monotonic() < deadline:
+			time.sleep(0.01)
+		return states
+
+	def _print_profile(self, stats, f):
+		stats.stream = f
+		stats.sort_stats('cumulative').print_stats(self.top)
+		stats.sort_stats('tottime').print_stats(self.top)
+
+	def _print_allocations(self, snapshot, traced, f):
+		current, peak = traced
+		f.write("Traced memory: {:.1f} KiB now, {:.1f} KiB peak\n\n".format(current / 1024, peak / 1024))
+		snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+			tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"), tracemalloc.Filter(False, "<unknown>"),
+			tracemalloc.Filter(False, __file__)))
+		for stat in snapshot.statistics('lineno')[:self.top]:
+			f.write("{}\n".format(stat))
+
+	def _write(self, prefix, suffix, write, binary=False):
+		os.makedirs(self.directory, exist_ok=True)
+		path = os.path.join(self.directory, "{}-{}{}".format(prefix, time.strftime("%Y%m%d-%H%M%S"), suffix))
+		with open(path, 'wb' if binary else 'w') as f:
+			write(f)
+		self.dumps.append(path)
+		return path
+
+	def _log(self, message):
+		if self.logger:
+			self.logger.info(message)
+
+
+def install_signal_handlers(profiler, add_signal_handler=None):
+	# SIGUSR1 toggles profiling and SIGUSR2 stage tracing. add_signal_handler(sig, fn) is the asyncio
+	# loop's, otherwise the handlers are set with signal.signal (main thread only)
+	# The handlers only queue the toggle for the ProfilerSignals thread: a toggle takes the profiler
+	# lock, which the interrupted thread may be holding, and stopping can wait up to a second
+	# Returns the thread
+	toggles = SimpleQueue()
+	thread = Thread(target= _run_toggles, args=(toggles, profiler.logger), name="ProfilerSignals")
+	thread.daemon = True
+	thread.start()
+	for name, fn in (('SIGUSR1', profiler.toggle_profiling), ('SIGUSR2', profiler.toggle_tracing)):
+		sig = getattr(signal, name, None)
+		if sig is None:
+			continue
+		if add_signal_handler is not None:
+			add_signal_handler(sig, toggles.put_nowait, fn)
+		else:
+			# SimpleQueue.put is safe to call from a signal handler
+			signal.signal(sig, lambda signum, frame, fn=fn: toggles.put_nowait(fn))
+	return thread
+
+
+def _run_toggles(toggles, logger):
+	while True:
+		fn = toggles.get()
+		try:
+			fn()
+		except Exception:
+			if logger:
+				logger.exception("Profiler signal toggle failed")
+
+
+class ControlServer:
+
+	def __init__(self, handler, path, logger=None):
+
+		# handler(command) returns the reply to one command line
+		self.handler = handler
+		self.path = path
+		self.logger = logger
+		self.sock = None
+		self.thread = None
+
+	def start(self):
+		# Every connection sends one command line and gets the reply, then the socket is closed
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.bind(self.path)
+		self.sock.listen(4)
+		self.thread = Thread(target= self._serve, name="ControlServer")
+		self.thread.daemon = True
+		self.thread.start()
+		if self.logger:
+			self.logger.info("Profiler commands accepted on {}".format(self.path))
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+		try:
+			os.unlink(self.path)
+		except OSError:
+			pass
+
+	def _serve(self):
+		while self.sock is not None:
+			try:
+				conn, _ = self.sock.accept()
+			except OSError:
+				return
+			with conn:
+				try:
+					conn.settimeout(2.0)
+					line = _read_line(conn)
+					try:
+						reply = self.handler(line)
+					except Exception as excep:
+						reply = "error: {}".format(excep)
+						if self.logger:
+							self.logger.exception("Control command '{}' failed".format(line))
+					conn.sendall((reply + "\n").encode('utf-8'))
+				except OSError as excep:
+					if self.logger:
+						self.logger.warning("Unable to answer control command: {}".format(excep))
+
+
+def start_control(profiler, params, logger=None):
+	# Starts CONTROL_SOCKET from config/params.yaml, returns the endpoints for closing
+	if not params.get('CONTROL_SOCKET'):
+		return []
+	try:
+		server = ControlServer(profiler.command, params['CONTROL_SOCKET'], logger)
+		server.start()
+		return [server]
+	except OSError as excep:
+		if logger:
+			logger.warning("Unable to open control socket {}: {}".format(params['CONTROL_SOCKET'], excep))
+		return []
+
+
+def _read_line(conn, limit=4096):
+	data = b""
+	while b"\n" not in data and len(data) < limit:
+		chunk = conn.recv(limit)
+		if not chunk:
+			break
+		data += chunk
+	return data.split(b"\n", 1)[0].decode('utf-8', 'replace')
+
+
+def send_command(path, command):
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+		s.connect(path)
+		s.sendall((command + "\n").encode('utf-8'))
+		chunks = []
+		while True:
+			chunk = s.recv(65536)
+			if not chunk:
+				break
+			chunks.append(chunk)
+	return b"".join(chunks).decode('utf-8')
+
+if __name__ == '__main__':
+	if len(sys.argv) < 3:
+		print("usage: python -m Networking.profiling <control socket> <{}>".format("|".join(COMMANDS)))
+		sys.exit(2)
+	print(send_command(sys.argv[1], " ".join(sys.argv[2:])), end="")
@@ -0,0 +1,97 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code decides how reliably each LAN packet is delivered over the VANET (RELIABILITY in
+# config/params.yaml), by its PSID or its J2735 message type:
+#
+#   best_effort   broadcast once, never acked
+#   repeat        broadcast repeats + 1 times, repeat_interval seconds apart, never acked
+#   acknowledged  sent through the forwarding mode (stop-and-wait or sliding window) until acked,
+#                 and dropped deadline seconds after it was first sent
+#
+# Receivers look up the same policy to decide whether a message is acked, so all radios on the
+# VANET must use the same RELIABILITY configuration.
+
+from Networking.framing import peek_packet
+from Networking.scheduler import class_keys
+
+BEST_EFFORT = 'best_effort'
+REPEAT = 'repeat'
+ACKNOWLEDGED = 'acknowledged'
+MODES = (BEST_EFFORT, REPEAT, ACKNOWLEDGED)
+
+# Used when RELIABILITY_DEFAULT is not configured: every message acked, as before
+DEFAULT_POLICY = {'name': 'default', 'mode': ACKNOWLEDGED, 'deadline': None}
+
+class Reliability:
+	__slots__ = ("name", "mode", "acknowledged", "repeats", "repeat_interval", "deadline", "sent")
+
+	def __init__(self, name, mode=ACKNOWLEDGED, repeats=0, repeat_interval=0.02, deadline=None):
+		if mode not in MODES:
+			raise ValueError("Unknown reliability mode {} of {}".format(mode, name))
+		self.name = name
+		self.mode = mode
+		self.acknowledged = mode == ACKNOWLEDGED
+		# Extra blind copies, only for the repeat mode
+		self.repeats = repeats if mode == REPEAT else 0
+		self.repeat_interval = repeat_interval
+		# Seconds after the first send an acknowledged message is given up on (None: only the retry limit)
+		self.deadline = deadline if deadline else None
+		self.sent = 0
+
+	def stats(self):
+		return {'mode': self.mode, 'sent': self.sent}
+
+
+class ReliabilityPolicy:
+
+	def __init__(self, policies=None, default=None):
+
+		self.by_message = {}
+		self.by_psid = {}
+		self.policies = []
+		for config in policies or ():
+			policy = Reliability(config.get('name', config.get('mode', ACKNOWLEDGED)), config.get('mode', ACKNOWLEDGED),
+				config.get('repeats', 0), config.get('repeat_interval', 0.02), config.get('deadline'))
+			self.policies.append(policy)
+			psids, msg_ids = class_keys(config)
+			for psid in psids:
+				self.by_psid[psid] = policy
+			for msg_id in msg_ids:
+				self.by_message[msg_id] = policy
+		default = dict(DEFAULT_POLICY, **(default or {}))
+		self.default = Reliability(default['name'], default['mode'], default.get('repeats', 0),
+			default.get('repeat_interval', 0.02), default.get('deadline'))
+		self.policies.append(self.default)
+		# Without per-message policies there is nothing to look up
+		self.lookup_packets = bool(self.by_message or self.by_psid)
+
+	def lookup(self, packet):
+		# Reliability of a compact frame or driver packet: by PSID first, then by message type, otherwise the default
+		if not self.lookup_packets:
+			return self.default
+		try:
+			psid, msg_id = peek_packet(packet)
+		except ValueError:
+			return self.default
+		policy = self.by_psid.get(psid) if psid is not None else None
+		if policy is None:
+			policy = self.by_message.get(msg_id, self.default)
+		return policy
+
+	def acknowledged(self, packet):
+		return self.lookup(packet).acknowledged
+
+	def stats(self):
+		return {policy.name: policy.stats() for policy in self.policies}
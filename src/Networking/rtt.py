@@ -0,0 +1,71 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code estimates the send to ack round trip time of the VANET and derives the retransmit
+# timeout (RTO) from it, in the style of TCP (Jacobson/Karels, RFC 6298):
+#
+#   first sample:  SRTT = R, RTTVAR = R / 2
+#   later samples: RTTVAR = 3/4 RTTVAR + 1/4 |SRTT - R|,  SRTT = 7/8 SRTT + 1/8 R
+#   RTO = SRTT + max(granularity, 4 RTTVAR), clamped to [RTO_MIN, RTO_MAX]
+#
+# The n-th retransmit of a message waits RTO * 2^n (at most RTO_MAX), stretched by a random factor
+# of up to RTO_JITTER so that radios that lost the same ack do not retransmit in lockstep. Only
+# messages acked without a retransmit are sampled (Karn's rule).
+
+import random
+
+class RTTEstimator:
+
+	def __init__(self, initial_rto=1.0, min_rto=0.02, max_rto=4.0, jitter=0.25, granularity=0.001):
+
+		self.initial_rto = initial_rto
+		self.min_rto = min_rto
+		self.max_rto = max(max_rto, min_rto)
+		self.jitter = jitter
+		self.granularity = granularity
+
+		self.srtt = None
+		self.rttvar = None
+		self.rto = min(max(initial_rto, min_rto), self.max_rto)
+		self.last_rtt = None
+		self.samples = 0
+
+	def observe(self, rtt):
+		# Adds a round trip time sample, in seconds
+		if self.srtt is None:
+			self.srtt = rtt
+			self.rttvar = rtt / 2
+		else:
+			self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+			self.srtt = 0.875 * self.srtt + 0.125 * rtt
+		self.rto = min(max(self.srtt + max(self.granularity, 4 * self.rttvar), self.min_rto), self.max_rto)
+		self.last_rtt = rtt
+		self.samples += 1
+
+	def timeout(self, attempt=0):
+		# Seconds to wait for an ack after the attempt-th retransmit (0 for the first send)
+		rto = min(self.rto * (2 ** attempt), self.max_rto)
+		if self.jitter:
+			rto *= 1 + random.uniform(0, self.jitter)
+		return rto
+
+	def reset(self):
+		self.srtt = None
+		self.rttvar = None
+		self.rto = min(max(self.initial_rto, self.min_rto), self.max_rto)
+
+	def stats(self):
+		ms = lambda value: None if value is None else round(value * 1e3, 3)
+		return {'srtt_ms': ms(self.srtt), 'rttvar_ms': ms(self.rttvar), 'rto_ms': ms(self.rto),
+			'last_rtt_ms': ms(self.last_rtt), 'samples': self.samples}
@@ -0,0 +1,221 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code orders LAN packets waiting to go out on the VANET (OUTBOUND_CLASSES in config/params.yaml).
+#
+# Every packet is put in a traffic class by its PSID or J2735 message type, read from the driver
+# header (or compact VANET frame header) and the first payload bytes. The highest priority class (lowest number) with a packet
+# waiting is served first, as long as its token bucket allows it. Each class has its own bounded
+# queue that drops its oldest packet when full. In a coalescing class a newer packet from the same
+# source and message type replaces the queued one in place, so only the latest BSM is ever waiting.
+# Packets pushed as held (acknowledged ones) wait in a second queue of their class, which the
+# caller can skip while the forwarding mode has no room: they keep their place, and the packets
+# queued behind them are served first without the held ones being looked at. Entries carry their
+# push order, so a class still sends its packets oldest first when nothing is held back.
+
+import time
+from collections import deque
+
+from Networking.framing import peek_packet
+from Messaging.j2735 import MESSAGE_IDS
+
+# Used when OUTBOUND_CLASSES is not configured: one FIFO, as before
+DEFAULT_CLASSES = [{'name': 'default', 'priority': 0, 'queue_size': 256}]
+
+def class_keys(config):
+	# (PSIDs, J2735 message IDs) a class configuration matches, from its psids and messages lists
+	psids = [int(psid, 0) if isinstance(psid, str) else int(psid) for psid in config.get('psids', ())]
+	msg_ids = [MESSAGE_IDS[msg] if isinstance(msg, str) else int(msg) for msg in config.get('messages', ())]
+	return psids, msg_ids
+
+class TrafficClass:
+	__slots__ = ("name", "priority", "rate", "burst", "tokens", "refilled", "queue_size", "coalesce", "queues", "latest",
+		"enqueued", "sent", "dropped", "coalesced", "max_depth")
+
+	def __init__(self, name, priority=0, rate=0, burst=None, queue_size=256, coalesce=False, now=0.0):
+		self.name = name
+		self.priority = priority
+		# Token bucket: rate packets per second (0 = unlimited), up to burst packets back to back
+		self.rate = rate
+		self.burst = burst if burst else max(rate, 1)
+		self.tokens = self.burst
+		self.refilled = now
+		self.queue_size = queue_size
+		self.coalesce = coalesce
+		# (push order, packet, tag) entries: queues[0] always sent, queues[1] held packets. Coalescing
+		# classes queue (push order, key) and keep the newest (packet, tag) of each key in latest
+		self.queues = (deque(), deque())
+		self.latest = {}
+
+		# Stats
+		self.enqueued = 0
+		self.sent = 0
+		self.dropped = 0
+		self.coalesced = 0
+		self.max_depth = 0
+
+	def __len__(self):
+		return len(self.queues[0]) + len(self.queues[1])
+
+	def refill(self, now):
+		if self.rate and self.tokens < self.burst:
+			self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+		self.refilled = now
+
+	def head(self, hold=False):
+		# Queue holding the oldest packet to send next (skipping held packets with hold), None if none
+		ready, held = self.queues
+		if hold or not held:
+			return ready or None
+		if not ready:
+			return held
+		return ready if ready[0][0] < held[0][0] else held
+
+	def popleft(self, queue):
+		# (packet, tag) of the oldest entry of queue
+		entry = queue.popleft()
+		if self.coalesce:
+			return self.latest.pop(entry[1])
+		return entry[1], entry[2]
+
+	def stats(self):
+		return {'priority': self.priority, 'queue_depth': len(self), 'max_queue_depth': self.max_depth,
+			'enqueued': self.enqueued, 'sent': self.sent, 'dropped': self.dropped, 'coalesced': self.coalesced}
+
+
+class OutboundScheduler:
+
+	def __init__(self, classes=None, default_class=None, clock=time.monotonic):
+
+		self.clock = clock
+		now = clock()
+		classes = classes or DEFAULT_CLASSES
+		self.classes = []
+		self.by_message = {}
+		self.by_psid = {}
+		for config in classes:
+			tc = TrafficClass(config['name'], config.get('priority', 0), config.get('rate', 0), config.get('burst'),
+				config.get('queue_size', 256), config.get('coalesce', False), now)
+			self.classes.append(tc)
+			psids, msg_ids = class_keys(config)
+			for psid in psids:
+				self.by_psid[psid] = tc
+			for msg_id in msg_ids:
+				self.by_message[msg_id] = tc
+		# Served in priority order, ties in configuration order
+		self.classes.sort(key=lambda tc: tc.priority)
+		names = {tc.name: tc for tc in self.classes}
+		self.default = names.get(default_class) or self.classes[-1]
+		# With a single class there is nothing to classify
+		self.classify_packets = len(self.classes) > 1
+		self.size = 0
+		self.pushed = 0
+
+	def __len__(self):
+		return self.size
+
+	def classify(self, packet):
+		# Traffic class of a packet: by PSID first, then by message type, otherwise the default class
+		# Returns (class, message ID)
+		if not self.classify_packets:
+			return self.default, None
+		try:
+			psid, msg_id = peek_packet(packet)
+		except ValueError:
+			return self.default, None
+		tc = self.by_psid.get(psid) if psid is not None else None
+		if tc is None:
+			tc = self.by_message.get(msg_id, self.default)
+		return tc, msg_id
+
+	def push(self, packet, addr=None, tag=None, held=False):
+		# Queues a packet, returns False if that pushed an older packet out of a full queue
+		# tag is handed back with the packet by pop_entry, so the caller looks a packet up only once.
+		# A held packet is passed over by pop(hold=True).
+		tc, msg_id = self.classify(packet)
+		tc.enqueued += 1
+		accepted = True
+		if len(tc) >= tc.queue_size and not (tc.coalesce and (addr[0] if addr else None, msg_id) in tc.latest):
+			tc.popleft(tc.head())
+			tc.dropped += 1
+			self.size -= 1
+			accepted = False
+		self.pushed += 1
+		queue = tc.queues[1 if held else 0]
+		if tc.coalesce:
+			key = (addr[0] if addr else None, msg_id)
+			if key in tc.latest:
+				# Latest wins: replace the queued packet, keeping its place in line
+				tc.latest[key] = (packet, tag)
+				tc.coalesced += 1
+				return True
+			queue.append((self.pushed, key))
+			tc.latest[key] = (packet, tag)
+		else:
+			queue.append((self.pushed, packet, tag))
+		self.size += 1
+		if len(tc) > tc.max_depth:
+			tc.max_depth = len(tc)
+		return accepted
+
+	def pop(self, now=None, hold=False):
+		# Next packet to send, or None if nothing is waiting or every waiting class is rate limited
+		# With hold, held packets are passed over
+		entry = self.pop_entry(now, hold)
+		return None if entry is None else entry[0]
+
+	def pop_entry(self, now=None, hold=False):
+		# pop, returning (packet, tag)
+		if not self.size:
+			return None
+		if now is None:
+			now = self.clock()
+		for tc in self.classes:
+			queue = tc.head(hold)
+			if queue is None:
+				continue
+			if tc.rate:
+				tc.refill(now)
+				if tc.tokens < 1:
+					continue
+				tc.tokens -= 1
+			tc.sent += 1
+			self.size -= 1
+			return tc.popleft(queue)
+		return None
+
+	def next_ready(self, now=None, hold=False):
+		# Seconds until pop(hold=hold) can return a packet, 0 if it can now, None if nothing is waiting
+		if not self.size:
+			return None
+		if now is None:
+			now = self.clock()
+		wait = None
+		for tc in self.classes:
+			if tc.head(hold) is None:
+				continue
+			if not tc.rate:
+				return 0.0
+			tc.refill(now)
+			if tc.tokens >= 1:
+				return 0.0
+			delay = (1 - tc.tokens) / tc.rate
+			if wait is None or delay < wait:
+				wait = delay
+		return wait
+
+	def stats(self):
+		stats = {tc.name: tc.stats() for tc in self.classes}
+		stats['queued'] = self.size
+		return stats
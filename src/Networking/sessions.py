@@ -0,0 +1,120 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code keeps per-peer state for the stop-and-wait forwarding mode and defines its ack frame.
+#
+# Acks name the radio whose message is acked (its IP) and the message (a 64 bit digest), so a
+# radio only releases its retransmit loop for an ack of its own in-flight message. Every radio
+# that receives a broadcast still owes the sender an ack; to keep a VANET with many vehicles from
+# answering every message with a burst of acks, receivers can wait a random fraction of ACK_JITTER
+# and drop their ack if they overhear another radio ack the same message first. Such an ack only
+# proves that one radio received the message, see ack_quorum in forwarding.py.
+#
+# Ack frame (network byte order), sharing the magic byte of the ARQ frames in arq.py:
+#   magic(1) type(1) sender_ip(4) digest(8)
+
+import time, socket, struct, hashlib
+from collections import OrderedDict
+
+from Networking.arq import ARQ_MAGIC
+
+SAW_ACK = 0x03
+SAW_ACK_FRAME = struct.Struct("!BB4sQ")
+
+def message_digest(data):
+	return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+def encode_saw_ack(sender_ip, digest):
+	try:
+		ip = socket.inet_aton(sender_ip)
+	except (OSError, TypeError):
+		ip = bytes(4)
+	return SAW_ACK_FRAME.pack(ARQ_MAGIC, SAW_ACK, ip, digest)
+
+def is_saw_ack(data):
+	return len(data) == SAW_ACK_FRAME.size and data[0] == ARQ_MAGIC and data[1] == SAW_ACK
+
+def decode_saw_ack(data):
+	# Returns (IP of the radio whose message is acked, message digest)
+	_, _, ip, digest = SAW_ACK_FRAME.unpack_from(data)
+	return socket.inet_ntoa(ip), digest
+
+
+class PeerSession:
+	__slots__ = ("ip", "first_seen", "last_seen", "messages", "duplicates", "acks_sent", "acks_received",
+		"acks_suppressed", "pending_ack", "ack_timer")
+
+	def __init__(self, ip, now):
+		self.ip = ip
+		self.first_seen = now
+		self.last_seen = now
+		self.messages = 0
+		self.duplicates = 0
+		self.acks_sent = 0
+		self.acks_received = 0
+		self.acks_suppressed = 0
+		# Digest of the message an ack is waiting to be sent for, and its timer
+		self.pending_ack = None
+		self.ack_timer = None
+
+	def stats(self, now):
+		return {'idle_s': now - self.last_seen, 'messages': self.messages, 'duplicates': self.duplicates,
+			'acks_sent': self.acks_sent, 'acks_received': self.acks_received, 'acks_suppressed': self.acks_suppressed}
+
+
+class PeerTable:
+
+	def __init__(self, max_peers=64, timeout=60.0, clock=time.monotonic):
+
+		# Peers idle for longer than timeout are dropped; past max_peers the least recently heard is
+		self.max_peers = max_peers
+		self.timeout = timeout
+		self.clock = clock
+		self.peers = OrderedDict()
+		self.expired = 0
+
+	def get(self, ip):
+		# Session of a peer, created on first contact and refreshed on every call
+		now = self.clock()
+		peers = self.peers
+		peer = peers.get(ip)
+		if peer is not None:
+			peers.move_to_end(ip)
+		else:
+			while peers:
+				oldest = next(iter(peers.values()))
+				if now - oldest.last_seen <= self.timeout and len(peers) < self.max_peers:
+					break
+				self._drop(peers.popitem(last=False)[1])
+			peer = peers[ip] = PeerSession(ip, now)
+		peer.last_seen = now
+		return peer
+
+	def find(self, ip):
+		# Existing session, without refreshing it
+		return self.peers.get(ip)
+
+	def __len__(self):
+		return len(self.peers)
+
+	def stats(self):
+		now = self.clock()
+		stats = {ip: peer.stats(now) for ip, peer in list(self.peers.items())}
+		stats['expired'] = self.expired
+		return stats
+
+	def _drop(self, peer):
+		if peer.ack_timer is not None:
+			peer.ack_timer.cancel()
+		self.expired += 1
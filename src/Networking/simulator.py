@@ -0,0 +1,300 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code runs a fleet of virtual radios in one process (simulate.py). Each radio has its own
+# Forwarder, the same forwarding logic as the event and asyncio backends, and its VANET socket is
+# replaced by a shared broadcast medium with loss, delay, jitter, duplication and a bandwidth cap.
+#
+# Everything runs on one discrete event loop in simulated time: timers and packet deliveries are
+# kept in a single heap, and time jumps straight to the next event. There is no thread per radio,
+# so 100 radios cost only the forwarding work they do, and a run takes as long as its events
+# need, not as long as the simulated duration.
+#
+# The medium serializes frames on one shared channel: with a bandwidth cap, a frame occupies the
+# channel for its airtime, later frames wait for it, and frames that would wait longer than
+# max_backlog seconds are dropped, as on a saturated WiFi channel. Loss is drawn per receiver.
+# With a contention window, a frame that had to wait for the channel collides with probability
+# 1 - (1 - 1/contention_window)^n, n being the frames still waiting with it (as in CSMA/CA, where
+# they all count down their backoff at once). A collided frame takes its airtime and reaches
+# nobody, so the more radios overload the channel, the less of its capacity carries data.
+
+import heapq, itertools, random, struct
+from collections import deque
+
+from Networking.dispatcher import TimerHandle
+from Networking.forwarding import Forwarder
+from Networking.metrics import Histogram
+from Messaging.j2735 import MESSAGE_IDS
+
+# Bytes a datagram costs on the channel on top of its payload: UDP, IPv4, LLC/SNAP, 802.11 header and FCS
+FRAME_OVERHEAD = 64
+
+# Payload written by the traffic generators after the message ID: origin radio, sequence, send time
+PROBE = struct.Struct("!HHId")
+
+class SimLoop:
+	# call_later/call_at in simulated seconds, run in time order by run_until
+
+	def __init__(self):
+		self.now = 0.0
+		self.events = []
+		self.counter = itertools.count()
+		self.processed = 0
+
+	def time(self):
+		return self.now
+
+	def call_at(self, when, callback):
+		handle = TimerHandle(when, callback)
+		heapq.heappush(self.events, (when, next(self.counter), handle))
+		return handle
+
+	def call_later(self, delay, callback):
+		return self.call_at(self.now + max(delay, 0.0), callback)
+
+	def run_until(self, end):
+		events = self.events
+		while events and events[0][0] <= end:
+			when, _, handle = heapq.heappop(events)
+			if handle.cancelled:
+				continue
+			self.now = when
+			handle.callback()
+			self.processed += 1
+		self.now = end
+
+
+class Medium:
+	# Shared broadcast channel, every frame is delivered to every other radio unless it is lost
+
+	def __init__(self, loop, loss=0.0, delay=0.001, jitter=0.0, duplicate=0.0, bandwidth=0, max_backlog=0.1,
+			contention_window=0, seed=None):
+		self.loop = loop
+		self.loss = loss
+		self.delay = delay
+		self.jitter = jitter
+		self.duplicate = duplicate
+		# Channel capacity in bits per second, 0 for no limit
+		self.bandwidth = bandwidth
+		self.max_backlog = max_backlog
+		# Backoff slots of a waiting frame, 0 for a channel without collisions (bandwidth only)
+		self.contention_window = contention_window
+		self.rng = random.Random(seed)
+		self.radios = []
+		self.busy_until = 0.0
+		# Start times of the frames waiting for the channel, in order
+		self.waiting = deque()
+
+		# Counters
+		self.frames = 0
+		self.bytes = 0
+		self.busy_time = 0.0
+		self.congestion_drops = 0
+		self.collisions = 0
+		self.deliveries = 0
+		self.lost = 0
+		self.duplicated = 0
+
+	def attach(self, radio):
+		self.radios.append(radio)
+
+	def broadcast(self, sender, data):
+		now = self.loop.now
+		arrival = now
+		if self.bandwidth:
+			start = max(now, self.busy_until)
+			if start - now > self.max_backlog:
+				self.congestion_drops += 1
+				return
+			airtime = (len(data) + FRAME_OVERHEAD) * 8 / self.bandwidth
+			self.busy_until = start + airtime
+			self.busy_time += airtime
+			arrival = start + airtime
+			if self.contention_window and start > now:
+				waiting = self.waiting
+				while waiting and waiting[0] <= now:
+					waiting.popleft()
+				collided = self.rng.random() >= (1 - 1 / self.contention_window) ** len(waiting)
+				waiting.append(start)
+				if collided:
+					self.frames += 1
+					self.bytes += len(data)
+					self.collisions += 1
+					return
+		self.frames += 1
+		self.bytes += len(data)
+		arrival += self.delay
+
+		rng = self.rng
+		receivers = []
+		for radio in self.radios:
+			if radio is sender:
+				continue
+			if self.loss and rng.random() < self.loss:
+				self.lost += 1
+				continue
+			receivers.append(radio)
+			if self.duplicate and rng.random() < self.duplicate:
+				self.duplicated += 1
+				receivers.append(radio)
+		self.deliveries += len(receivers)
+		if not self.jitter:
+			# One event for every receiver of the frame
+			self.loop.call_at(arrival, lambda: self._deliver(receivers, data, sender.addr))
+			return
+		for radio in receivers:
+			self.loop.call_at(arrival + rng.uniform(0, self.jitter), lambda radio=radio: radio.receive(data, sender.addr))
+
+	def _deliver(self, receivers, data, addr):
+		for radio in receivers:
+			radio.receive(data, addr)
+
+	def stats(self, elapsed):
+		return {'frames': self.frames, 'bytes': self.bytes, 'deliveries': self.deliveries, 'lost': self.lost,
+			'duplicated': self.duplicated, 'congestion_drops': self.congestion_drops, 'collisions': self.collisions,
+			'utilization': round(min(self.busy_time, elapsed) / elapsed, 3) if elapsed else None}
+
+
+class Traffic:
+	# A periodic LAN message every radio sends, as a carma-cohda-dsrc-driver packet
+	__slots__ = ("name", "msg_id", "psid", "rate", "size", "header", "sent", "delivered", "duplicates", "latency")
+
+	def __init__(self, name, rate, size=200, psid=0x20, message=None):
+		self.name = name
+		self.msg_id = MESSAGE_IDS[message or name]
+		self.psid = psid
+		self.rate = rate
+		self.size = max(size, 2 + PROBE.size)
+		self.header = ("Version=0.7\nType={}\nPSID={:#x}\nPriority=7\nTxMode=CONT\nTxChannel=172\nTxInterval=0\n"
+			"DeliveryStart=\nDeliveryStop=\nSignature=False\nEncryption=False\nPayload=").format(name, psid).encode('ascii')
+
+		# Counters, over all radios
+		self.sent = 0
+		self.delivered = 0
+		self.duplicates = 0
+		self.latency = Histogram()
+
+	def packet(self, origin, seq, now):
+		payload = struct.pack("!H", self.msg_id) + PROBE.pack(0, origin, seq, now)
+		payload += bytes(self.size - len(payload))
+		return self.header + payload.hex().encode('ascii') + b"\n"
+
+	def stats(self, radios):
+		expected = self.sent * (radios - 1)
+		stats = {'sent': self.sent, 'delivered': self.delivered, 'duplicates': self.duplicates,
+			'delivery_ratio': round(self.delivered / expected, 4) if expected else None}
+		stats['latency'] = self.latency.snapshot()
+		del stats['latency']['buckets_ms']
+		return stats
+
+
+class VirtualRadio:
+
+	def __init__(self, index, loop, medium, traffic, logger, forwarder_options=None):
+		self.index = index
+		self.ip = "10.0.{}.{}".format(index // 250, index % 250 + 1)
+		self.addr = (self.ip, 1516)
+		self.loop = loop
+		self.medium = medium
+		self.traffic = {t.msg_id: t for t in traffic}
+		self.lan_addr = ("192.168.0.{}".format(index % 250 + 2), 5398)
+		# Sequences delivered to the LAN per (origin, message ID), to count duplicates
+		self.seen = {}
+
+		options = dict(forwarder_options or {})
+		options['self_ip'] = self.ip
+		self.forwarder = Forwarder(self.to_lan, self.to_vanet, loop.call_later, logger, clock=loop.time, **options)
+		medium.attach(self)
+
+	def start(self, rng, duration):
+		for traffic in self.traffic.values():
+			if traffic.rate > 0:
+				self.loop.call_at(rng.uniform(0, 1.0 / traffic.rate), lambda t=traffic: self._generate(t, 0, duration))
+
+	def _generate(self, traffic, seq, duration):
+		traffic.sent += 1
+		self.forwarder.on_lan_packet((traffic.packet(self.index, seq, self.loop.now), self.lan_addr))
+		when = self.loop.now + 1.0 / traffic.rate
+		if when < duration:
+			self.loop.call_at(when, lambda: self._generate(traffic, seq + 1, duration))
+
+	def to_vanet(self, data):
+		self.medium.broadcast(self, data)
+
+	def receive(self, data, addr):
+		self.forwarder.on_vanet_packet((data, addr))
+
+	def to_lan(self, payload):
+		# The payload the driver would get on the LAN
+		msg_id = ((payload[0] << 8) | payload[1]) & 0x7FFF
+		traffic = self.traffic.get(msg_id)
+		if traffic is None:
+			return
+		_, origin, seq, sent = PROBE.unpack_from(payload, 2)
+		key = (origin, msg_id)
+		delivered = self.seen.get(key)
+		if delivered is None:
+			delivered = self.seen[key] = set()
+		if seq in delivered:
+			traffic.duplicates += 1
+			return
+		delivered.add(seq)
+		traffic.delivered += 1
+		traffic.latency.observe(self.loop.now - sent)
+
+
+class Simulation:
+
+	def __init__(self, radios=50, traffic=None, medium_options=None, forwarder_options=None, logger=None, seed=1):
+		self.loop = SimLoop()
+		self.rng = random.Random(seed)
+		# Forwarders draw ack delays, timeout jitter and ARQ sequence numbers from the random module
+		random.seed(seed)
+		self.medium = Medium(self.loop, seed=seed, **(medium_options or {}))
+		self.traffic = traffic if traffic is not None else [Traffic('BSM', 10), Traffic('MobilityRequest', 1, 300, 0xBFEE)]
+		self.radios = [VirtualRadio(i, self.loop, self.medium, self.traffic, logger, forwarder_options) for i in range(radios)]
+		self.duration = 0.0
+
+	def run(self, duration, drain=2.0):
+		# Generates traffic for duration seconds, then lets retransmits and acks settle for drain seconds
+		self.duration = duration
+		for radio in self.radios:
+			radio.start(self.rng, duration)
+		self.loop.run_until(duration + drain)
+		for radio in self.radios:
+			radio.forwarder.close()
+
+	def stats(self):
+		# Counters summed over all radios, the sliding window counts its frames and acks in the ARQ classes
+		# Congestion control rates and loads are summed too, and divided into averages below
+		totals = {}
+		for radio in self.radios:
+			stats = radio.forwarder.stats()
+			for section in ('forwarding', 'arq_sender', 'arq_receiver', 'congestion'):
+				values = stats if section == 'forwarding' else stats.get(section)
+				if values is None:
+					continue
+				total = totals.setdefault(section, {})
+				for key, value in values.items():
+					if isinstance(value, (int, float)):
+						total[key] = total.get(key, 0) + value
+		congestion = totals.get('congestion')
+		if congestion:
+			for key in ('rate', 'min_rate_seen', 'tokens', 'peers', 'rx_pps', 'load', 'loss'):
+				congestion[key] = round(congestion[key] / len(self.radios), 3)
+		stats = {'radios': len(self.radios), 'duration': self.duration, 'events': self.loop.processed,
+			'traffic': {t.name: t.stats(len(self.radios)) for t in self.traffic},
+			'medium': self.medium.stats(self.loop.now)}
+		stats.update(totals)
+		return stats
@@ -0,0 +1,104 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# This code measures how long the OBU takes from process start until it forwards: the time of each
+# start-up phase (imports, configs, interfaces, ...), when it was ready to forward, and when it sent
+# its first packet on either network. Times count from the start of the process as recorded by the
+# kernel, so interpreter start-up and imports are included (to within the 10 ms resolution of
+# /proc). The results are logged and part of the stats ('startup').
+#
+# The first packet is caught by watch(), which puts a one-shot wrapper on the send function and
+# takes it off again at that first call.
+
+import os, time
+
+def process_age():
+	# Seconds since this process started, 0 where /proc is not available
+	try:
+		with open("/proc/self/stat") as f:
+			# Field 22 is the start time in clock ticks since boot, counted after the ")" ending the name
+			start_ticks = int(f.read().rpartition(")")[2].split()[19])
+		return max(system_uptime() - start_ticks / os.sysconf('SC_CLK_TCK'), 0.0)
+	except (OSError, ValueError, IndexError, TypeError):
+		return 0.0
+
+def system_uptime():
+	# Seconds since boot, None where /proc is not available
+	try:
+		with open("/proc/uptime") as f:
+			return float(f.read().split()[0])
+	except (OSError, ValueError, IndexError):
+		return None
+
+
+class StartupTimer:
+
+	def __init__(self, logger=None, clock=time.monotonic):
+
+		self.logger = logger
+		self.clock = clock
+		now = clock()
+		self.start = now - process_age()
+		self.last = self.start
+		# (phase, seconds), in order
+		self.phases = []
+		# Seconds after process start, None until then
+		self.ready = None
+		self.first_packet = None
+		self.first_packet_path = None
+		self.uptime_at_ready = None
+
+	def mark(self, phase):
+		# Ends a start-up phase that began at the previous mark (or process start)
+		now = self.clock()
+		self.phases.append((phase, now - self.last))
+		self.last = now
+
+	def set_ready(self):
+		self.ready = self.clock() - self.start
+		self.uptime_at_ready = system_uptime()
+		if self.logger:
+			self.logger.info("Ready to forward {:.3f} s after process start ({})".format(self.ready,
+				", ".join("{} {:.3f} s".format(phase, seconds) for phase, seconds in self.phases)))
+
+	def forwarded(self, path):
+		if self.first_packet is not None:
+			return
+		self.first_packet = self.clock() - self.start
+		self.first_packet_path = path
+		if self.logger:
+			self.logger.info("First packet forwarded ({}) {:.3f} s after process start".format(path, self.first_packet))
+
+	def watch(self, obj, attr, path):
+		# Records the first call of obj.attr as the first forwarded packet on path
+		original = getattr(obj, attr)
+		own = attr in vars(obj)
+
+		def first(*args):
+			# Only taken off if nothing wrapped it since (e.g. stage tracing), otherwise it stays in the
+			# chain and is restored with it later
+			if getattr(obj, attr, None) is first:
+				if own:
+					setattr(obj, attr, original)
+				else:
+					delattr(obj, attr)
+			self.forwarded(path)
+			return original(*args)
+		setattr(obj, attr, first)
+
+	def stats(self):
+		return {'phases_s': {phase: round(seconds, 4) for phase, seconds in self.phases},
+			'ready_s': None if self.ready is None else round(self.ready, 4),
+			'first_packet_s': None if self.first_packet is None else round(self.first_packet, 4),
+			'first_packet_path': self.first_packet_path, 'uptime_at_ready_s': self.uptime_at_ready}
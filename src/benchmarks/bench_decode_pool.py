@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Measures UPER MessageFrame decode throughput on the calling thread and with a DecodePool of
+# increasing worker counts, next to a multiprocessing.Pool that returns pickled values.
+#
+# The J2735 ASN.1 files are not part of this repository, so the payloads are BSMs with path
+# history encoded with a reduced BSM spec that has the same structure and similar size.
+#
+#   python -m benchmarks.bench_decode_pool --workers 1 2 3 --messages 5000
+
+import argparse, os, time, random, multiprocessing
+
+from Messaging.j2735 import J2735Codec, FRAME_TYPE
+from Messaging.decode_pool import DecodePool
+
+SPEC = """
+BenchBSM DEFINITIONS AUTOMATIC TAGS ::= BEGIN
+MessageFrame ::= SEQUENCE { messageId INTEGER (0..32767), value BasicSafetyMessage }
+BasicSafetyMessage ::= SEQUENCE { coreData BSMcoreData, partII SEQUENCE (SIZE(1..8)) OF PartIIcontent OPTIONAL, ... }
+BSMcoreData ::= SEQUENCE {
+	msgCnt INTEGER (0..127), id OCTET STRING (SIZE(4)), secMark INTEGER (0..65535),
+	lat INTEGER (-900000000..900000001), long INTEGER (-1799999999..1800000001), elev INTEGER (-4096..61439),
+	accuracy PositionalAccuracy, transmission ENUMERATED { neutral, park, forwardGears, reverseGears, reserved1, reserved2, reserved3, unavailable },
+	speed INTEGER (0..8191), heading INTEGER (0..28800), angle INTEGER (-126..127),
+	accelSet AccelerationSet4Way, brakes BrakeSystemStatus, size VehicleSize }
+PositionalAccuracy ::= SEQUENCE { semiMajor INTEGER (0..255), semiMinor INTEGER (0..255), orientation INTEGER (0..65535) }
+AccelerationSet4Way ::= SEQUENCE { long INTEGER (-2000..2001), lat INTEGER (-2000..2001), vert INTEGER (-127..127), yaw INTEGER (-32767..32767) }
+BrakeSystemStatus ::= SEQUENCE { wheelBrakes BIT STRING (SIZE(5)), traction ENUMERATED { unavailable, off, on, engaged },
+	abs ENUMERATED { unavailable, off, on, engaged }, scs ENUMERATED { unavailable, off, on, engaged } }
+VehicleSize ::= SEQUENCE { width INTEGER (0..1023), length INTEGER (0..4095) }
+PartIIcontent ::= SEQUENCE { partII-Id INTEGER (0..63), pathHistory SEQUENCE (SIZE(1..23)) OF PathPoint }
+PathPoint ::= SEQUENCE { latOffset INTEGER (-131072..131071), lonOffset INTEGER (-131072..131071),
+	elevationOffset INTEGER (-2048..2047), timeOffset INTEGER (1..65535) }
+END
+"""
+
+def bench_codec():
+	import asn1tools
+	return J2735Codec(asn1tools.compile_string(SPEC, 'uper'), "bench spec")
+
+def bsm(codec, rng):
+	path = [{'latOffset': rng.randint(-1000, 1000), 'lonOffset': rng.randint(-1000, 1000),
+		'elevationOffset': rng.randint(-10, 10), 'timeOffset': i * 10 + 1} for i in range(rng.randint(5, 15))]
+	value = {'coreData': {'msgCnt': rng.randint(0, 127), 'id': os.urandom(4), 'secMark': rng.randint(0, 59999),
+		'lat': 423600000 + rng.randint(-1000, 1000), 'long': -710900000 + rng.randint(-1000, 1000), 'elev': 100,
+		'accuracy': {'semiMajor': 10, 'semiMinor': 10, 'orientation': 0}, 'transmission': 'forwardGears',
+		'speed': rng.randint(0, 1500), 'heading': rng.randint(0, 28800), 'angle': 0,
+		'accelSet': {'long': 0, 'lat': 0, 'vert': 0, 'yaw': 0},
+		'brakes': {'wheelBrakes': (b'\x00', 5), 'traction': 'off', 'abs': 'off', 'scs': 'off'},
+		'size': {'width': 200, 'length': 500}},
+		'partII': [{'partII-Id': 0, 'pathHistory': path}]}
+	return codec.encode(FRAME_TYPE, {'messageId': 20, 'value': value})
+
+_pool_codec = None
+
+def _pickle_decode(data):
+	return _pool_codec.decode(FRAME_TYPE, data)
+
+def run_inline(codec, payloads):
+	start = time.perf_counter()
+	for data in payloads:
+		codec.decode(FRAME_TYPE, data)
+	return time.perf_counter() - start
+
+def run_decode_pool(codec, payloads, workers):
+	pool = DecodePool(codec, workers=workers, slots=256)
+	try:
+		start = time.perf_counter()
+		pending = []
+		for data in payloads:
+			future = pool.submit(data)
+			while future is None:
+				# All slots busy, wait for the oldest decode
+				pending.pop(0).result()
+				future = pool.submit(data)
+			pending.append(future)
+		for future in pending:
+			future.result()
+		elapsed = time.perf_counter() - start
+		stats = pool.stats()
+	finally:
+		pool.close()
+	return elapsed, stats
+
+def run_pickle_pool(codec, payloads, workers):
+	global _pool_codec
+	_pool_codec = codec
+	with multiprocessing.get_context('fork').Pool(workers) as pool:
+		start = time.perf_counter()
+		pool.map(_pickle_decode, payloads, chunksize=1)
+		return time.perf_counter() - start
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--messages", type=int, default=5000, help="MessageFrames decoded per measurement")
+	parser.add_argument("--workers", type=int, nargs="*", default=[1, 2, 3], help="worker process counts")
+	args = parser.parse_args()
+
+	codec = bench_codec()
+	rng = random.Random(1)
+	payloads = [bsm(codec, rng) for _ in range(args.messages)]
+	print("{} BSMs, {:.0f} bytes on average, {} CPUs".format(len(payloads), sum(map(len, payloads)) / len(payloads),
+		os.cpu_count()))
+
+	elapsed = run_inline(codec, payloads)
+	baseline = len(payloads) / elapsed
+	print("  {:<28} {:>9.0f} msg/s".format("inline (one thread)", baseline))
+	for workers in args.workers:
+		elapsed, stats = run_decode_pool(codec, payloads, workers)
+		rate = len(payloads) / elapsed
+		print("  {:<28} {:>9.0f} msg/s  x{:.2f}  ({} pickled)".format(
+			"DecodePool, {} worker(s)".format(workers), rate, rate / baseline, stats['pickled']))
+		elapsed = run_pickle_pool(codec, payloads, workers)
+		rate = len(payloads) / elapsed
+		print("  {:<28} {:>9.0f} msg/s  x{:.2f}".format("multiprocessing.Pool, {}".format(workers), rate, rate / baseline))
+
+if __name__ == '__main__':
+	main()
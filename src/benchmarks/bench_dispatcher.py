@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Compares per-packet forwarding latency and CPU use of the threaded recv_many/loop_time loop
+# against the UDPDispatcher event backend. A UDP_NET on loopback relays every packet it receives
+# to a sink socket, and the sink measures the time from send to arrival.
+#
+#   python -m benchmarks.bench_dispatcher --packets 5000 --rate 1000
+
+import argparse, socket, struct, time
+from threading import Thread
+
+from Networking.networking import UDP_NET
+from Networking.dispatcher import UDPDispatcher
+from benchmarks.common import quiet_logger, free_port, loopback_params, percentile
+
+STAMP = struct.Struct("!Iq")
+STOP = b"stop"
+
+def threaded_relay(net, loop_time):
+	# Same shape as the OBU listening threads
+	def run():
+		while True:
+			for data, _ in net.recv_many(block=True):
+				if data == STOP:
+					return
+				net.send_data(bytes(data))
+			time.sleep(loop_time)
+	t = Thread(target= run)
+	t.daemon = True
+	t.start()
+	return t
+
+def event_relay(net):
+	dispatcher = UDPDispatcher()
+	dispatcher.register(net, lambda pkt: net.send_data(pkt[0]))
+	dispatcher.start()
+	return dispatcher
+
+def run_case(name, backend, packets, rate, size, loop_time):
+	relay_port, sink_port = free_port(), free_port()
+	net = UDP_NET(CONFIG_FILE='BENCH_params.yaml', logger=quiet_logger(), params=loopback_params(relay_port, sink_port))
+	net.start_connection()
+
+	sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	sink.bind(("127.0.0.1", sink_port))
+	sink.settimeout(1.0)
+	source = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+	if backend == 'threaded':
+		relay = threaded_relay(net, loop_time)
+	else:
+		relay = event_relay(net)
+
+	latencies = []
+	def receive():
+		while len(latencies) < packets:
+			try:
+				data = sink.recv(65535)
+			except socket.timeout:
+				return
+			seq, sent = STAMP.unpack_from(data)
+			latencies.append((time.perf_counter_ns() - sent) / 1000.0)
+	receiver = Thread(target= receive)
+	receiver.start()
+
+	padding = b"\0" * max(size - STAMP.size, 0)
+	interval = 1.0 / rate
+	cpu_start = time.process_time()
+	wall_start = time.perf_counter()
+	next_send = wall_start
+	for seq in range(packets):
+		source.sendto(STAMP.pack(seq, time.perf_counter_ns()) + padding, ("127.0.0.1", relay_port))
+		next_send += interval
+		delay = next_send - time.perf_counter()
+		if delay > 0:
+			time.sleep(delay)
+	receiver.join()
+	wall = time.perf_counter() - wall_start
+	cpu = time.process_time() - cpu_start
+
+	# Idle cost: how much CPU the relay burns with no traffic at all
+	idle_start = time.process_time()
+	time.sleep(1.0)
+	idle_cpu = time.process_time() - idle_start
+
+	if backend == 'threaded':
+		source.sendto(STOP, ("127.0.0.1", relay_port))
+		relay.join(1.0)
+	else:
+		relay.stop()
+	net.sock.close()
+	sink.close()
+	source.close()
+
+	latencies.sort()
+	print("{:<24} recv {:>6}/{:<6} p50 {:>8.1f} us  p99 {:>8.1f} us  max {:>9.1f} us  cpu {:>5.1f}%  idle cpu {:>5.1f}%".format(
+		name, len(latencies), packets, percentile(latencies, 50), percentile(latencies, 99),
+		latencies[-1] if latencies else float('nan'), 100.0 * cpu / wall, 100.0 * idle_cpu))
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--packets", type=int, default=5000, help="packets per case")
+	parser.add_argument("--rate", type=float, default=1000.0, help="packets per second")
+	parser.add_argument("--size", type=int, default=200, help="payload size in bytes")
+	parser.add_argument("--loop-time", type=float, nargs="*", default=[1e-07, 1e-03], help="loop_time values for the threaded backend")
+	args = parser.parse_args()
+
+	print("{} packets of {} bytes at {} pps over loopback".format(args.packets, args.size, args.rate))
+	for loop_time in args.loop_time:
+		run_case("threaded loop_time={:g}".format(loop_time), 'threaded', args.packets, args.rate, args.size, loop_time)
+	run_case("event (epoll)", 'event', args.packets, args.rate, args.size, None)
+
+if __name__ == '__main__':
+	main()
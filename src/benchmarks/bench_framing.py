@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Compares the original str based strip_header against the Networking.framing parser on
+# carma-cohda-dsrc-driver packets of a few payload sizes.
+#
+#   python -m benchmarks.bench_framing
+
+import argparse, os, timeit
+from binascii import unhexlify
+
+from Networking.framing import strip_header, parse_dsrc
+
+HEADER = (b"Version=0.7\nType=BSM\nPSID=0x20\nPriority=7\nTxMode=CONT\nTxChannel=172\nTxInterval=0\n"
+	b"DeliveryStart=\nDeliveryStop=\nSignature=False\nEncryption=False\n")
+
+def driver_packet(payload):
+	return HEADER + b"Payload=" + payload.hex().encode('ascii') + b"\n"
+
+# The implementation this module replaced, kept here as the baseline
+def legacy_strip_header(packet):
+	data = packet.decode('ascii')
+	idx = data.find("Payload=")
+	payload = data[idx+8:-1]
+	encoded = payload.encode('utf-8')
+	return unhexlify(encoded)
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--number", type=int, default=100000, help="calls per measurement")
+	parser.add_argument("--sizes", type=int, nargs="*", default=[40, 300, 1400], help="UPER payload sizes in bytes")
+	args = parser.parse_args()
+
+	for size in args.sizes:
+		payload = b"\x00\x14" + os.urandom(size - 2)
+		packet = driver_packet(payload)
+		view = memoryview(bytearray(packet))
+		assert legacy_strip_header(packet) == strip_header(packet) == strip_header(view) == parse_dsrc(packet).payload
+
+		print("UPER payload {} bytes, driver packet {} bytes".format(size, len(packet)))
+		for name, fn, arg in (
+				("legacy strip_header", legacy_strip_header, packet),
+				("strip_header", strip_header, packet),
+				("strip_header(view)", strip_header, view),
+				("parse_dsrc", parse_dsrc, packet),
+				("parse_dsrc(view)", parse_dsrc, view)):
+			t = timeit.timeit(lambda: fn(arg), number=args.number)
+			print("  {:<22} {:>7.3f} us/pkt".format(name, 1e6 * t / args.number))
+
+if __name__ == '__main__':
+	main()
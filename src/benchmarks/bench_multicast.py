@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Measures the receive load a radio's own transmissions cause with the broadcast and the multicast
+# TRANSPORT: a UDP_NET sends packets in batches and drains its socket after each batch, counting the
+# datagrams, receive calls and CPU time spent on packets it sent itself.
+#
+# It needs a multicast capable interface with an IPv4 address, e.g. wlan0 on the Pi. The loopback
+# interface loops multicast back regardless of IP_MULTICAST_LOOP, so it cannot show the difference.
+#
+#   python -m benchmarks.bench_multicast --interface wlan0 --packets 20000
+
+import argparse, time, select
+import netifaces as ni
+
+from Networking.networking import UDP_NET
+from benchmarks.common import quiet_logger, free_port
+
+def endpoint(transport, interface, port, group):
+	addr = ni.ifaddresses(interface)[ni.AF_INET][0]
+	broadcast = addr.get('broadcast', '255.255.255.255')
+	params = {'sendIP': broadcast, 'sendPORT': port, 'recvIP': broadcast, 'recvPORT': port, 'BUFFER_SIZE': 4096,
+		'INTERFACE': interface, 'TRANSPORT': transport, 'MULTICAST_GROUP': group, 'MULTICAST_LOOP': False}
+	net = UDP_NET(CONFIG_FILE='VANET_params.yaml', logger=quiet_logger(), params=params)
+	net.start_connection()
+	net.setblocking(False)
+	return net
+
+def run(transport, args):
+	net = endpoint(transport, args.interface, free_port(), args.group)
+	payload = bytes(args.size)
+	calls = 0
+	received = 0
+	cpu = 0.0
+	try:
+		for _ in range(0, args.packets, args.batch):
+			for _ in range(args.batch):
+				net.send_data(payload)
+			# Give the kernel time to loop the batch back, then drain it like the event backend would
+			select.select([net.sock], [], [], 0.01)
+			start = time.process_time()
+			for _ in net.recv_pending():
+				received += 1
+			calls += 1
+			cpu += time.process_time() - start
+		stats = net.stats()
+	finally:
+		net.sock.close()
+	return {'sent': stats['packets_out'], 'own_received': stats['self_drops'] + received, 'forwarded': received,
+		'drain_calls': calls, 'cpu_s': cpu}
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--interface", default="wlan0", help="VANET interface with an IPv4 address")
+	parser.add_argument("--group", default="239.192.0.17", help="multicast group")
+	parser.add_argument("--packets", type=int, default=20000, help="packets sent per transport")
+	parser.add_argument("--batch", type=int, default=50, help="packets sent between two socket drains")
+	parser.add_argument("--size", type=int, default=200, help="payload bytes")
+	args = parser.parse_args()
+
+	results = {transport: run(transport, args) for transport in ('broadcast', 'multicast')}
+	print("{} packets of {} bytes on {}".format(args.packets, args.size, args.interface))
+	print("  {:<10} {:>8} {:>13} {:>10} {:>10} {:>14}".format("", "sent", "own received", "forwarded", "recv CPU", "per sent pkt"))
+	for transport, r in results.items():
+		print("  {:<10} {:>8} {:>13} {:>10} {:>8.3f} s {:>11.2f} us".format(transport, r['sent'], r['own_received'],
+			r['forwarded'], r['cpu_s'], r['cpu_s'] / max(r['sent'], 1) * 1e6))
+	saved = results['broadcast']['cpu_s'] - results['multicast']['cpu_s']
+	print("  multicast saves {} receives and {:.3f} s of receive CPU ({:.2f} us per sent packet)".format(
+		results['broadcast']['own_received'] - results['multicast']['own_received'], saved,
+		saved / max(results['broadcast']['sent'], 1) * 1e6))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Measures the per-packet cost of draining a full socket buffer with recv_packets (one recvfrom
+# and one formatted log line per datagram), recv_pending, and the batched recv_many ring, and of
+# sending with send_data versus send_many.
+#
+#   python -m benchmarks.bench_recv_many --packets 2000 --size 300
+
+import argparse, socket, time
+
+from Networking.networking import UDP_NET
+from benchmarks.common import quiet_logger, free_port, loopback_params
+
+def make_net(port):
+	net = UDP_NET(CONFIG_FILE='BENCH_params.yaml', logger=quiet_logger(), params=loopback_params(port, port))
+	net.start_connection()
+	net.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+	net.setblocking(False)
+	return net
+
+def fill(port, packets, payload):
+	with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+		for _ in range(packets):
+			s.sendto(payload, ("127.0.0.1", port))
+
+def drain_recv_packets(net):
+	count = 0
+	while True:
+		try:
+			packet = net.sock.recvfrom(net.bufferSize)
+		except BlockingIOError:
+			return count
+		# recv_packets body without the exception path, so the measurement is the per-packet work
+		if packet[1][0] != net.selfIP or not net.filterSelf:
+			net.logger.info("{}: Received '{}' from {}".format(net.netType, packet[0], packet[1][0]))
+			count += 1
+
+def drain_recv_pending(net):
+	count = 0
+	for _ in net.recv_pending():
+		count += 1
+	return count
+
+def drain_recv_many(net):
+	count = 0
+	while True:
+		batch = net.recv_many()
+		if not batch:
+			return count
+		count += len(batch)
+
+def bench_recv(name, drain, packets, payload, rounds):
+	port = free_port()
+	net = make_net(port)
+	total = 0.0
+	received = 0
+	for _ in range(rounds):
+		fill(port, packets, payload)
+		start = time.perf_counter()
+		received += drain(net)
+		total += time.perf_counter() - start
+	net.sock.close()
+	print("{:<16} {:>8} pkts  {:>7.2f} us/pkt".format(name, received, 1e6 * total / max(received, 1)))
+
+def bench_send(packets, payload, rounds):
+	sink_port = free_port()
+	sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+	sink.bind(("127.0.0.1", sink_port))
+	net = UDP_NET(CONFIG_FILE='BENCH_params.yaml', logger=quiet_logger(), params=loopback_params(free_port(), sink_port))
+	net.start_connection()
+	batch = [payload] * packets
+
+	for name in ("send_data", "send_many"):
+		total = 0.0
+		for _ in range(rounds):
+			start = time.perf_counter()
+			if name == "send_data":
+				for packet in batch:
+					net.send_data(packet)
+			else:
+				net.send_many(batch)
+			total += time.perf_counter() - start
+			sink.setblocking(False)
+			try:
+				while sink.recv(65535):
+					pass
+			except BlockingIOError:
+				pass
+		print("{:<16} {:>8} pkts  {:>7.2f} us/pkt".format(name, packets * rounds, 1e6 * total / (packets * rounds)))
+	net.sock.close()
+	sink.close()
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--packets", type=int, default=2000, help="datagrams queued per round")
+	parser.add_argument("--size", type=int, default=300, help="datagram size in bytes")
+	parser.add_argument("--rounds", type=int, default=20)
+	args = parser.parse_args()
+
+	payload = bytes(range(256)) * (args.size // 256) + bytes(args.size % 256)
+	print("{} rounds of {} datagrams of {} bytes over loopback".format(args.rounds, args.packets, args.size))
+	bench_recv("recv_packets", drain_recv_packets, args.packets, payload, args.rounds)
+	bench_recv("recv_pending", drain_recv_pending, args.packets, payload, args.rounds)
+	bench_recv("recv_many", drain_recv_many, args.packets, payload, args.rounds)
+	bench_send(args.packets, payload, args.rounds)
+
+if __name__ == '__main__':
+	main()
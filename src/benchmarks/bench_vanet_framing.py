@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Compares what a message costs on the VANET as a forwarded carma-cohda-dsrc-driver packet and
+# as a compact frame (VANET_FRAMING): bytes per datagram, 802.11 OFDM airtime per frame, and the
+# CPU time to translate at the sender and strip at the receiver.
+#
+# Airtime is for broadcast data frames at a fixed PHY rate: preamble and SIGNAL field, then OFDM
+# symbols for the service/tail bits and the MAC frame (IPv4, LLC/SNAP, 802.11 header and FCS around
+# the UDP datagram). Datagrams over a 1500 byte MTU go out as several IP fragments, each its own
+# frame. Channel time adds DIFS and the mean CWmin backoff every broadcast frame waits.
+#
+#   python -m benchmarks.bench_vanet_framing --sizes 40 200 1000 --rate 6
+#   python -m benchmarks.bench_vanet_framing --capture Captures/field.bin
+
+import argparse, math, os, timeit
+
+from Networking.framing import CompactFramer, parse_dsrc, strip_header, vanet_payload, sender_id
+from benchmarks.bench_framing import driver_packet
+
+# Bytes around an IP fragment: IPv4 20, LLC/SNAP 8, 802.11 data header 24, FCS 4
+FRAME_OVERHEAD = 56
+UDP_HEADER = 8
+# IP payload per fragment with a 1500 byte MTU
+FRAGMENT_SIZE = 1480
+
+# OFDM timing in microseconds: (preamble + SIGNAL, symbol, slot, SIFS) for 20 MHz (802.11a/g)
+# and 10 MHz (802.11p) channels
+PHY = {20: (20, 4, 9, 16), 10: (40, 8, 13, 32)}
+CW_MIN = 15
+
+def fragments(datagram):
+	# IP payload bytes of each frame a UDP datagram is sent as
+	size = datagram + UDP_HEADER
+	return [min(FRAGMENT_SIZE, size - start) for start in range(0, size, FRAGMENT_SIZE)]
+
+def airtime_us(datagram, rate_mbps, bandwidth):
+	preamble, symbol, _, _ = PHY[bandwidth]
+	bits_per_symbol = rate_mbps * symbol
+	# 16 service bits and 6 tail bits are sent with every MAC frame
+	return sum(preamble + math.ceil((16 + 8 * (size + FRAME_OVERHEAD) + 6) / bits_per_symbol) * symbol
+		for size in fragments(datagram))
+
+def channel_us(datagram, rate_mbps, bandwidth):
+	# Frame airtime plus DIFS and the mean backoff of each broadcast frame
+	_, _, slot, sifs = PHY[bandwidth]
+	return airtime_us(datagram, rate_mbps, bandwidth) + len(fragments(datagram)) * (sifs + 2 * slot + CW_MIN * slot / 2)
+
+def payloads_from_capture(path):
+	# Driver packets the OBU received from the LAN
+	from Networking.capture import read_capture, capture_files, DIR_IN
+	packets = []
+	for fpath in capture_files(path):
+		for _, direction, interface, _, data in read_capture(fpath):
+			if direction == DIR_IN and interface == 'LAN':
+				packets.append(bytes(data))
+	return packets
+
+def report(name, packets, args):
+	framer = CompactFramer(sender_id("192.168.10.21"))
+	frames = [framer.frame(packet) for packet in packets]
+	driver_bytes = sum(map(len, packets))
+	compact_bytes = sum(map(len, frames))
+	driver_air = sum(airtime_us(len(p), args.rate, args.bandwidth) for p in packets)
+	compact_air = sum(airtime_us(len(f), args.rate, args.bandwidth) for f in frames)
+	driver_chan = sum(channel_us(len(p), args.rate, args.bandwidth) for p in packets)
+	compact_chan = sum(channel_us(len(f), args.rate, args.bandwidth) for f in frames)
+	driver_frames = sum(len(fragments(len(p))) for p in packets)
+	compact_frames = sum(len(fragments(len(f))) for f in frames)
+	n = len(packets)
+	print(name if n == 1 else "{} ({} packets, {} not driver packets)".format(name, n, framer.passed))
+	print("  {:<10} {:>9} {:>7} {:>12} {:>12}".format("", "bytes", "frames", "airtime us", "channel us"))
+	print("  {:<10} {:>9.0f} {:>7.2f} {:>12.0f} {:>12.0f}".format("driver", driver_bytes / n, driver_frames / n,
+		driver_air / n, driver_chan / n))
+	print("  {:<10} {:>9.0f} {:>7.2f} {:>12.0f} {:>12.0f}".format("compact", compact_bytes / n, compact_frames / n,
+		compact_air / n, compact_chan / n))
+	print("  {:<10} {:>8.1f}% {:>7} {:>11.1f}% {:>11.1f}%".format("saved", 100 * (1 - compact_bytes / driver_bytes),
+		"", 100 * (1 - compact_air / driver_air), 100 * (1 - compact_chan / driver_chan)))
+	if args.number:
+		packet, frame = packets[0], frames[0]
+		cost = lambda fn: timeit.timeit(fn, number=args.number) / args.number * 1e6
+		print("  sender    translate {:.2f} us (parse_dsrc alone {:.2f} us)".format(
+			cost(lambda: framer.frame(packet)), cost(lambda: parse_dsrc(packet))))
+		print("  receiver  strip_header {:.2f} us, compact payload {:.2f} us".format(
+			cost(lambda: strip_header(packet)), cost(lambda: vanet_payload(frame))))
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--sizes", type=int, nargs="*", default=[40, 200, 400, 1000], help="UPER payload sizes in bytes")
+	parser.add_argument("--capture", help="capture file (CAPTURE_FILE) whose LAN packets are measured instead")
+	parser.add_argument("--rate", type=float, default=6, help="PHY rate of broadcast frames in Mbps")
+	parser.add_argument("--bandwidth", type=int, choices=sorted(PHY), default=20, help="channel width in MHz")
+	parser.add_argument("--number", type=int, default=100000, help="calls per CPU time measurement, 0 to skip")
+	args = parser.parse_args()
+
+	print("{} Mbps, {} MHz channel".format(args.rate, args.bandwidth))
+	if args.capture:
+		packets = payloads_from_capture(args.capture)
+		if not packets:
+			raise SystemExit("No LAN packets in {}".format(args.capture))
+		report(args.capture, packets, args)
+		return
+	for size in args.sizes:
+		report("UPER payload {} bytes".format(size), [driver_packet(b"\x00\x14" + os.urandom(size - 2))], args)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,50 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Shared helpers for the benchmarks. Benchmarks are run from the src directory, e.g.
+#   python -m benchmarks.bench_dispatcher
+
+import logging, socket
+
+def quiet_logger(name="c1t2x_bench"):
+	# Keeps UDP_NET logging out of the measurement
+	logger = logging.getLogger(name)
+	logger.setLevel(logging.WARNING)
+	if not logger.handlers:
+		logger.addHandler(logging.NullHandler())
+	logger.propagate = False
+	return logger
+
+def free_port():
+	with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+		s.bind(("127.0.0.1", 0))
+		return s.getsockname()[1]
+
+def loopback_params(recv_port, send_port, buffer_size=4096):
+	# UDP_NET params for an endpoint on the loopback interface
+	return {
+		'sendIP': '127.0.0.1',
+		'sendPORT': send_port,
+		'recvIP': '127.0.0.1',
+		'recvPORT': recv_port,
+		'BUFFER_SIZE': buffer_size,
+		'INTERFACE': 'lo',
+		'FILTER_SELF': False,
+	}
+
+def percentile(sorted_values, p):
+	if not sorted_values:
+		return float('nan')
+	k = min(int(round(p / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+	return sorted_values[k]
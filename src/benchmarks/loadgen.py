@@ -0,0 +1,172 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Load generation and round trip measurement for broadcaster.py --bench.
+#
+# Every benchmark packet starts with a magic, a sequence number and the sender's monotonic send
+# time, padded to the requested size. The returner echoes packets unchanged, so the broadcaster can
+# compute round trip time, loss, reordering and duplicates from the echoes alone.
+
+import time, random, struct
+from threading import Thread
+
+from benchmarks.common import percentile, loopback_params, free_port, quiet_logger
+
+BENCH_MAGIC = b"C1TB"
+BENCH_HEADER = struct.Struct("!4sIq")
+
+def make_packet(seq, size):
+	header = BENCH_HEADER.pack(BENCH_MAGIC, seq, time.monotonic_ns())
+	return header + bytes(max(size - BENCH_HEADER.size, 0))
+
+def parse_packet(data):
+	# Returns (seq, send time in ns), or None if data is not a benchmark packet
+	if len(data) < BENCH_HEADER.size or data[:4] != BENCH_MAGIC:
+		return None
+	_, seq, sent = BENCH_HEADER.unpack_from(data)
+	return seq, sent
+
+
+class BenchReport:
+
+	def __init__(self):
+		self.sent = 0
+		self.sent_bytes = 0
+		self.received = 0
+		self.received_bytes = 0
+		self.duplicates = 0
+		self.reordered = 0
+		self.foreign = 0
+		self.highest = -1
+		self.seen = set()
+		self.rtts = []
+		self.start = None
+		self.stop = None
+
+	def on_send(self, size):
+		self.sent += 1
+		self.sent_bytes += size
+
+	def on_receive(self, data):
+		now = time.monotonic_ns()
+		parsed = parse_packet(data)
+		if parsed is None:
+			self.foreign += 1
+			return
+		seq, sent = parsed
+		if seq in self.seen:
+			self.duplicates += 1
+			return
+		self.seen.add(seq)
+		if seq < self.highest:
+			self.reordered += 1
+		else:
+			self.highest = seq
+		self.received += 1
+		self.received_bytes += len(data)
+		self.rtts.append((now - sent) / 1e6)
+
+	def summary(self):
+		elapsed = max((self.stop or time.monotonic()) - self.start, 1e-9)
+		rtts = sorted(self.rtts)
+		loss = self.sent - self.received
+		return {
+			'duration_s': elapsed,
+			'sent': self.sent,
+			'received': self.received,
+			'sent_pps': self.sent / elapsed,
+			'sent_mbps': 8 * self.sent_bytes / elapsed / 1e6,
+			'received_pps': self.received / elapsed,
+			'received_mbps': 8 * self.received_bytes / elapsed / 1e6,
+			'loss': loss,
+			'loss_pct': 100.0 * loss / self.sent if self.sent else 0.0,
+			'reordered': self.reordered,
+			'duplicates': self.duplicates,
+			'foreign': self.foreign,
+			'rtt_p50_ms': percentile(rtts, 50),
+			'rtt_p99_ms': percentile(rtts, 99),
+			'rtt_p999_ms': percentile(rtts, 99.9),
+			'rtt_max_ms': rtts[-1] if rtts else float('nan'),
+		}
+
+	def print_report(self):
+		s = self.summary()
+		print("----------------------------------------------------")
+		print("Benchmark report ({:.2f} s)".format(s['duration_s']))
+		print("  sent      {:>9} pkts  {:>10.1f} pps  {:>8.3f} Mbps".format(s['sent'], s['sent_pps'], s['sent_mbps']))
+		print("  echoed    {:>9} pkts  {:>10.1f} pps  {:>8.3f} Mbps".format(s['received'], s['received_pps'], s['received_mbps']))
+		print("  loss      {:>9} pkts  ({:.2f}%)".format(s['loss'], s['loss_pct']))
+		print("  reordered {:>9}   duplicates {}   non-benchmark {}".format(s['reordered'], s['duplicates'], s['foreign']))
+		print("  rtt ms    p50 {:.3f}   p99 {:.3f}   p99.9 {:.3f}   max {:.3f}".format(
+			s['rtt_p50_ms'], s['rtt_p99_ms'], s['rtt_p999_ms'], s['rtt_max_ms']))
+		print("----------------------------------------------------")
+
+
+def run_load(send_fn, report, rate, sizes, burst, duration):
+	# Sends bursts of `burst` packets so that the average rate is `rate` packets per second
+	# Packet sizes are drawn from `sizes` (a single size gives a fixed size stream)
+	interval = burst / float(rate)
+	report.start = time.monotonic()
+	end = report.start + duration
+	next_burst = report.start
+	seq = 0
+	while True:
+		now = time.monotonic()
+		if now >= end:
+			break
+		if now < next_burst:
+			time.sleep(next_burst - now)
+			continue
+		for _ in range(burst):
+			size = sizes[0] if len(sizes) == 1 else random.choice(sizes)
+			send_fn(make_packet(seq, size))
+			report.on_send(size)
+			seq += 1
+		next_burst += interval
+
+
+def listen(recv_fn, report, stop):
+	# recv_fn() returns one packet tuple or None, like UDP_NET.recv_packets
+	while not stop[0]:
+		pkt = recv_fn()
+		if pkt:
+			report.on_receive(pkt[0])
+
+
+def localhost_pair(buffer_size=65535):
+	# A broadcaster endpoint and an in-process returner that echoes everything back over loopback,
+	# standing in for a second radio on the VANET
+	from Networking.networking import UDP_NET
+	here, there = free_port(), free_port()
+	logger = quiet_logger()
+	near = UDP_NET(CONFIG_FILE='VANET_params.yaml', logger=logger, params=loopback_params(here, there, buffer_size))
+	far = UDP_NET(CONFIG_FILE='VANET_params.yaml', logger=logger, params=loopback_params(there, here, buffer_size))
+	near.start_connection()
+	far.start_connection()
+	for net in (near, far):
+		net.sock.settimeout(0.2)
+
+	def echo():
+		while far.sock is not None:
+			try:
+				data = far.sock.recv(far.bufferSize)
+			except OSError:
+				if far.sock.fileno() < 0:
+					return
+				continue
+			far.sock.sendto(data, (far.sendIP, far.sendPORT))
+	t = Thread(target= echo)
+	t.daemon = True
+	t.start()
+	return near, far
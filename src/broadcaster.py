@@ -14,12 +14,13 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
-import os, time, sys
-from ruamel.yaml import YAML
+import os, time, sys, getpass
 from threading import Thread
-import asn1tools
+import argparse
 
 from Networking.networking import UDP_NET
+from Networking.configs import load_yaml
+from Messaging.j2735 import compile_spec
 
 # initialize errors
 error = False
@@ -32,9 +33,7 @@ script_dir = os.path.dirname(__file__)
 fpath = 'config/params.yaml'
 file_path = os.path.join(script_dir, fpath)
 try:
-    y = YAML(typ='safe')
-    with open(file_path,'r') as f:
-        params = y.load(f)
+    params = load_yaml(file_path)
     parseLANPacket = params['LAN_DECODE']
     parseVANETPacket = params['VANET_DECODE']
     radioApps = params['RADIO_APPS']
@@ -46,10 +45,21 @@ except Exception as e:
     print("Unable to import yaml configs")
     raise e
 
-netTestType = sys.argv[1]
-if sys.argv[1] == "vanet":
+parser = argparse.ArgumentParser()
+parser.add_argument("net", help="network to test: vanet or lan")
+parser.add_argument("--bench", help="run a load benchmark against returner.py --bench instead of the loop test", action="store_true")
+parser.add_argument("--localhost", help="benchmark against an in-process returner on the loopback interface", action="store_true")
+parser.add_argument("--rate", help="average send rate (packets per second)", type=float, default=100.0)
+parser.add_argument("--size", help="packet size(s) in bytes, several sizes are mixed at random", type=int, nargs="+", default=[200])
+parser.add_argument("--burst", help="packets sent back to back per burst", type=int, default=1)
+parser.add_argument("--duration", help="seconds to send for", type=float, default=10.0)
+parser.add_argument("--drain", help="seconds to wait for late echoes after sending stops", type=float, default=1.0)
+args = parser.parse_args()
+
+netTestType = args.net
+if args.net == "vanet":
     netTestType="VANET"
-elif sys.argv[1] =="lan":
+elif args.net =="lan":
     netTestType="LAN"
 else:
     print("invalid network test type......exiting")
@@ -63,14 +73,16 @@ MyUserName DEFINITIONS ::= BEGIN
     }
 END
 '''
-myUName = asn1tools.compile_string(SPECIFICATION,'uper')
-uName = str(os.getlogin())
+# Compiled once and cached with the J2735 codec
+myUName = compile_spec(SPECIFICATION, os.path.join(script_dir, params.get('CODEC_CACHE_DIR', 'Cache')))
+# getlogin() fails without a controlling terminal (cron, ssh -T), getuser() does not
+uName = str(getpass.getuser())
 msg = {'number': 22, 'text': uName}
 encoded = myUName.encode('Message', msg)
 
 # instantiate networks
 # LAN
-if netTestType=="LAN":
+if netTestType=="LAN" and not args.localhost:
     try:
         lan = UDP_NET(CONFIG_FILE='LAN_params.yaml')
     except:
@@ -81,7 +93,7 @@ if netTestType=="LAN":
         if printData:
             print("Not connected to a LAN interface")
 # VANET
-if netTestType=="VANET":
+if netTestType=="VANET" and not args.localhost:
     try:
         vanet = UDP_NET(CONFIG_FILE='VANET_params.yaml', print_data=True)
     except:
@@ -169,11 +181,42 @@ def main():
         print("Keyboard Interrupt Occurred")
     finally:
         error = True
-       
+
+def bench():
+    # Load benchmark: sequence numbered, timestamped packets at the configured rate,
+    # echoed back by returner.py --bench (or an in-process returner with --localhost)
+    from benchmarks.loadgen import BenchReport, run_load, listen, localhost_pair
+
+    if args.localhost:
+        net, standIn = localhost_pair()
+    else:
+        net = vanet if netTestType == "VANET" else lan
+
+    report = BenchReport()
+    stop = [False]
+    listener = Thread(target= listen, args=(net.recv_packets, report, stop))
+    listener.daemon = True
+    listener.start()
+
+    print("Sending {} pps, sizes {}, bursts of {}, for {} s".format(args.rate, args.size, args.burst, args.duration))
+    try:
+        run_load(net.send_data, report, args.rate, args.size, args.burst, args.duration)
+        report.stop = time.monotonic()
+        time.sleep(args.drain)
+    except KeyboardInterrupt:
+        print("Keyboard Interrupt Occurred")
+    if report.stop is None:
+        report.stop = time.monotonic()
+    stop[0] = True
+    report.print_report()
+
 # code starts here
 if __name__ == '__main__':
 
     # print to terminal that C1T2X radio is starting up
     print("----------------------------------------------------\nSTARTING C1T2X RADIO\n----------------------------------------------------")
-    
-    main()
+
+    if args.bench:
+        bench()
+    else:
+        main()
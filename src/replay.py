@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Replays a packet capture (CAPTURE_FILE in config/params.yaml) recorded by a radio.
+#
+#   --target net        sends the captured datagrams with UDP_NET to a running OBU, by default the
+#                       LAN/VANET receive ports of the local OBU
+#   --target forwarder  pushes them straight into an in-process Forwarder, to profile the
+#                       forwarding logic with a real traffic mix and no sockets
+#
+# --speed 1 keeps the original timing, 2 replays twice as fast, 0 replays as fast as possible.
+
+import os, time, heapq, itertools, argparse
+
+from Networking import configs
+from Networking.capture import read_capture, capture_files, DIR_IN, DIR_OUT
+from Networking.dispatcher import TimerHandle
+from benchmarks.common import quiet_logger
+
+def load_yaml(fpath):
+	script_dir = os.path.dirname(__file__)
+	return configs.load_yaml(os.path.join(script_dir, fpath))
+
+def parse_dest(dest):
+	ip, _, port = dest.rpartition(':')
+	return ip or '127.0.0.1', int(port)
+
+def records(path, direction, interface):
+	# Captured (time_ns, interface, addr, data) to replay, from the rotated files oldest first
+	for fpath in capture_files(path):
+		for time_ns, rec_dir, rec_if, addr, data in read_capture(fpath):
+			if direction is not None and rec_dir != direction:
+				continue
+			if interface is not None and rec_if != interface:
+				continue
+			yield time_ns, rec_if, addr, data
+
+
+class InlineTimers:
+	# call_later for a Forwarder driven from the replay loop instead of an event loop. time() is the
+	# Forwarder's clock: once the capture is replayed, drain() jumps it to each remaining timer
+
+	def __init__(self):
+		self.timers = []
+		self.counter = itertools.count()
+		self.skipped = 0.0
+
+	def time(self):
+		return time.monotonic() + self.skipped
+
+	def call_later(self, delay, callback):
+		handle = TimerHandle(self.time() + delay, callback)
+		heapq.heappush(self.timers, (handle.when, next(self.counter), handle))
+		return handle
+
+	def run_due(self):
+		now = self.time()
+		while self.timers and self.timers[0][0] <= now:
+			_, _, handle = heapq.heappop(self.timers)
+			if not handle.cancelled:
+				handle.callback()
+
+	def drain(self):
+		# Runs every timer left (retransmits, repeats, delayed acks) without waiting for it, along
+		# with the ones they schedule, until none is left
+		while self.timers:
+			when, _, handle = heapq.heappop(self.timers)
+			if handle.cancelled:
+				continue
+			self.skipped += max(when - self.time(), 0.0)
+			handle.callback()
+
+
+def net_target(args):
+	# One UDP_NET per interface, sending to the OBU under test from an ephemeral port
+	from Networking.networking import UDP_NET
+	logger = quiet_logger("c1t2x_replay")
+	nets = {}
+	for name, dest in (('LAN', args.lan_dest), ('VANET', args.vanet_dest)):
+		config = load_yaml('Networking/config/{}_params.yaml'.format(name))
+		ip, port = parse_dest(dest) if dest else ('127.0.0.1', config['recvPORT'])
+		params = dict(config, sendIP=ip, sendPORT=port, recvIP='0.0.0.0', recvPORT=0, INTERFACE='lo', FILTER_SELF=False)
+		net = UDP_NET(CONFIG_FILE='{}_params.yaml'.format(name), logger=logger, params=params)
+		net.start_connection()
+		nets[name] = net
+		print("{} packets -> {}:{}".format(name, ip, port))
+
+	def send(interface, addr, data):
+		nets[interface or 'VANET'].send_data(data)
+
+	def report():
+		for name, net in nets.items():
+			print("  {:<6} {}".format(name, net.stats()))
+	return send, None, report
+
+def forwarder_target(args):
+	# The Forwarder as the OBU builds it from config/params.yaml, its timers run between records
+	from Networking.forwarding import make_forwarder
+	params = load_yaml('config/params.yaml')
+	vanet_params = load_yaml('Networking/config/VANET_params.yaml')
+	timers = InlineTimers()
+	out = {'LAN': 0, 'VANET': 0}
+
+	def send_lan(packet):
+		out['LAN'] += 1
+
+	def send_vanet(packet):
+		out['VANET'] += 1
+
+	options = {'mode': args.mode} if args.mode else {}
+	forwarder = make_forwarder(params, send_lan, send_vanet, timers.call_later, quiet_logger("c1t2x_replay"),
+		parse_vanet=params['VANET_DECODE'], fragment_size=vanet_params.get('FRAGMENT_SIZE', 0), clock=timers.time, **options)
+
+	def send(interface, addr, data):
+		if interface == 'LAN':
+			forwarder.on_lan_packet((data, addr))
+		else:
+			forwarder.on_vanet_packet((data, addr))
+
+	def report():
+		print("  forwarded to LAN {}   to VANET {}".format(out['LAN'], out['VANET']))
+		print("  {}".format(forwarder.stats()))
+	return send, timers, report
+
+def replay(args):
+	direction = {'in': DIR_IN, 'out': DIR_OUT, 'all': None}[args.direction]
+	interface = None if args.interface == 'all' else args.interface.upper()
+	if not capture_files(args.capture):
+		raise SystemExit("No capture file at {}".format(args.capture))
+	if args.target == 'net':
+		send, timers, report = net_target(args)
+	else:
+		send, timers, report = forwarder_target(args)
+
+	count = 0
+	start = time.monotonic()
+	for _ in range(args.loop):
+		first = None
+		loop_start = time.monotonic()
+		for time_ns, rec_if, addr, data in records(args.capture, direction, interface):
+			if args.speed > 0:
+				if first is None:
+					first = time_ns
+				# Original (or scaled) offset from the first record of the capture
+				delay = loop_start + (time_ns - first) / 1e9 / args.speed - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+			send(rec_if, addr, data)
+			count += 1
+			if timers is not None:
+				timers.run_due()
+	elapsed = max(time.monotonic() - start, 1e-9)
+	if timers is not None:
+		# Retransmits and acks still pending, so the stats show how the replayed messages ended
+		timers.drain()
+
+	print("----------------------------------------------------")
+	print("Replayed {} packets in {:.3f} s ({:.1f} pps)".format(count, elapsed, count / elapsed))
+	report()
+	print("----------------------------------------------------")
+
+# code starts here
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("capture", help="capture file (CAPTURE_FILE), rotated files are replayed first")
+	parser.add_argument("--target", help="where packets are replayed to", choices=['net', 'forwarder'], default='net')
+	parser.add_argument("--speed", help="timing scale: 1 original, 2 twice as fast, 0 as fast as possible", type=float, default=1.0)
+	parser.add_argument("--direction", help="which captured packets to replay", choices=['in', 'out', 'all'], default='in')
+	parser.add_argument("--interface", help="only replay packets of one network", choices=['lan', 'vanet', 'all'], default='all')
+	parser.add_argument("--loop", help="replay the capture this many times", type=int, default=1)
+	parser.add_argument("--lan-dest", help="IP:PORT LAN packets are sent to (--target net)")
+	parser.add_argument("--vanet-dest", help="IP:PORT VANET packets are sent to (--target net)")
+	parser.add_argument("--mode", help="forwarding mode of the in-process Forwarder (--target forwarder)", choices=['stop_and_wait', 'sliding_window'])
+	args = parser.parse_args()
+
+	replay(args)
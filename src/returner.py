@@ -14,12 +14,13 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
-import os, time, sys
-from ruamel.yaml import YAML
+import os, time, sys, getpass
 from threading import Thread
-import asn1tools
+import argparse
 
 from Networking.networking import UDP_NET
+from Networking.configs import load_yaml
+from Messaging.j2735 import compile_spec
 
 # initialize errors
 error = False
@@ -32,9 +33,7 @@ script_dir = os.path.dirname(__file__)
 fpath = 'config/params.yaml'
 file_path = os.path.join(script_dir, fpath)
 try:
-    y = YAML(typ='safe')
-    with open(file_path,'r') as f:
-        params = y.load(f)
+    params = load_yaml(file_path)
     parseLANPacket = params['LAN_DECODE']
     parseVANETPacket = params['VANET_DECODE']
     radioApps = params['RADIO_APPS']
@@ -46,10 +45,15 @@ except Exception as e:
     print("Unable to import yaml configs")
     raise e
 
-netTestType = sys.argv[1]
-if sys.argv[1] == "vanet":
+parser = argparse.ArgumentParser()
+parser.add_argument("net", help="network to test: vanet or lan")
+parser.add_argument("--bench", help="echo every packet unchanged for broadcaster.py --bench, without decoding or printing it", action="store_true")
+args = parser.parse_args()
+
+netTestType = args.net
+if args.net == "vanet":
     netTestType="VANET"
-elif sys.argv[1] =="lan":
+elif args.net =="lan":
     netTestType="LAN"
 else:
     print("invalid network test type......exiting")
@@ -63,8 +67,10 @@ MyUserName DEFINITIONS ::= BEGIN
     }
 END
 '''
-myUName = asn1tools.compile_string(SPECIFICATION,'uper')
-uName = str(os.getlogin())
+# Compiled once and cached with the J2735 codec
+myUName = compile_spec(SPECIFICATION, os.path.join(script_dir, params.get('CODEC_CACHE_DIR', 'Cache')))
+# getlogin() fails without a controlling terminal (cron, ssh -T), getuser() does not
+uName = str(getpass.getuser())
 msg = {'number': 22, 'text': uName}
 encoded = myUName.encode('Message', msg)
 
@@ -113,7 +119,8 @@ def VANET_listening_thread():
             pkt = vanet.recv_packets()
 
             if pkt:
-                print(myUName.decode('Message',pkt[0]))
+                if not args.bench:
+                    print(myUName.decode('Message',pkt[0]))
                 sendVANET(pkt[0])
         except:
             if printData:
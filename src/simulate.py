@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Runs a fleet of virtual radios on a simulated VANET (Networking/simulator.py) and reports delivery,
+# latency, ack and channel statistics. The forwarding settings come from config/params.yaml, so a
+# configuration can be tried on 100 radios before it goes on the Pis.
+#
+#   python simulate.py --radios 50 --duration 10 --loss 0.05 --jitter 0.002 --bandwidth 6e6
+#   python simulate.py --radios 100 --mode sliding_window --bsm-rate 10 --mobility-rate 2
+
+import time, json, argparse
+
+from Networking.simulator import Simulation, Traffic, FRAME_OVERHEAD
+from Networking.forwarding import forwarding_options
+from benchmarks.common import quiet_logger
+from replay import load_yaml
+
+def forwarder_options(params, args):
+	options = forwarding_options(params)
+	options.update(mode=args.mode or options['mode'], max_peers=max(options['max_peers'], args.radios),
+		framing=args.framing or options['framing'], congestion=congestion_options(params, args))
+	return options
+
+def congestion_options(params, args):
+	# The simulated channel's bit rate and frame overhead replace the ones of the radios' WiFi
+	options = params.get('CONGESTION_CONTROL')
+	if not options or args.no_congestion_control:
+		return None
+	options = dict(options)
+	if args.bandwidth:
+		options.update(bitrate=args.bandwidth, frame_overhead=FRAME_OVERHEAD)
+	return options
+
+def report(stats, wall):
+	print("----------------------------------------------------")
+	print("{} radios, {:.1f} s simulated in {:.2f} s ({} events, {:.0f} events/s)".format(stats['radios'],
+		stats['duration'], wall, stats['events'], stats['events'] / max(wall, 1e-9)))
+	for name, traffic in stats['traffic'].items():
+		latency = traffic['latency']
+		print("  {:<16} sent {:>7}  delivered {:>8}  ratio {}  LAN duplicates {}  latency p50 {} p99 {} max {:.1f} ms".format(
+			name, traffic['sent'], traffic['delivered'], traffic['delivery_ratio'], traffic['duplicates'],
+			fmt_ms(latency['p50_ms'], latency['max_ms']), fmt_ms(latency['p99_ms'], latency['max_ms']), latency['max_ms']))
+	delivered = sum(traffic['delivered'] for traffic in stats['traffic'].values())
+	print("  goodput          {:.0f} messages/s delivered to the LANs".format(delivered / max(stats['duration'], 1e-9)))
+	print("  medium           {}".format(stats['medium']))
+	for section in ('forwarding', 'arq_sender', 'arq_receiver', 'congestion'):
+		if section in stats:
+			print("  {:<16} {}".format(section, stats[section]))
+	print("----------------------------------------------------")
+
+def fmt_ms(value, max_ms):
+	# Quantiles are histogram bucket bounds, never report one above the largest sample
+	return "-" if value is None else "{:.1f}".format(min(value, max_ms))
+
+# code starts here
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--radios", help="virtual radios on the VANET", type=int, default=50)
+	parser.add_argument("--duration", help="simulated seconds of traffic", type=float, default=10.0)
+	parser.add_argument("--drain", help="simulated seconds after the traffic stops for acks and retransmits", type=float, default=2.0)
+	parser.add_argument("--mode", help="forwarding mode, FORWARDING_MODE by default", choices=['stop_and_wait', 'sliding_window'])
+	parser.add_argument("--framing", help="VANET framing, VANET_FRAMING by default", choices=['compact', 'driver'])
+	parser.add_argument("--loss", help="probability a frame is lost, per receiver", type=float, default=0.0)
+	parser.add_argument("--delay", help="propagation and stack delay in seconds", type=float, default=0.001)
+	parser.add_argument("--jitter", help="random extra delay in seconds, per receiver", type=float, default=0.0)
+	parser.add_argument("--duplicate", help="probability a frame is received twice, per receiver", type=float, default=0.0)
+	parser.add_argument("--bandwidth", help="channel capacity in bits/s shared by all radios, 0 for no limit", type=float, default=0)
+	parser.add_argument("--max-backlog", help="seconds a frame may wait for the channel before it is dropped", type=float, default=0.1)
+	parser.add_argument("--contention-window", help="backoff slots of frames waiting for the channel, 0 for no collisions (with --bandwidth)", type=int, default=0)
+	parser.add_argument("--bsm-rate", help="BSMs per second per radio (best effort with the default RELIABILITY)", type=float, default=10)
+	parser.add_argument("--bsm-size", help="BSM payload bytes", type=int, default=200)
+	parser.add_argument("--mobility-rate", help="MobilityRequests per second per radio (acknowledged)", type=float, default=1)
+	parser.add_argument("--mobility-size", help="MobilityRequest payload bytes", type=int, default=300)
+	parser.add_argument("--no-congestion-control", help="ignore CONGESTION_CONTROL, every radio sends at the full rate of its LAN", action="store_true")
+	parser.add_argument("--seed", help="random seed of the medium and the radios", type=int, default=1)
+	parser.add_argument("--json", help="print the stats as JSON", action="store_true")
+	args = parser.parse_args()
+
+	params = load_yaml('config/params.yaml')
+	traffic = [Traffic('BSM', args.bsm_rate, args.bsm_size, 0x20),
+		Traffic('MobilityRequest', args.mobility_rate, args.mobility_size, 0xBFEE)]
+	sim = Simulation(args.radios, traffic,
+		medium_options={'loss': args.loss, 'delay': args.delay, 'jitter': args.jitter, 'duplicate': args.duplicate,
+			'bandwidth': args.bandwidth, 'max_backlog': args.max_backlog, 'contention_window': args.contention_window},
+		forwarder_options=forwarder_options(params, args), logger=quiet_logger("c1t2x_simulate"), seed=args.seed)
+
+	start = time.perf_counter()
+	sim.run(args.duration, args.drain)
+	wall = time.perf_counter() - start
+	if args.json:
+		print(json.dumps(sim.stats(), indent=2))
+	else:
+		report(sim.stats(), wall)
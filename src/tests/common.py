@@ -0,0 +1,91 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Shared helpers for the unit tests. Tests are run from the src directory, e.g.
+#   python -m pytest -q tests
+# or without pytest
+#   python -m unittest discover -s tests -t .
+
+import logging, struct
+
+from Messaging.j2735 import MESSAGE_IDS
+
+class FakeClock:
+	# Manually advanced clock, passed as clock= so timeouts run without sleeping
+
+	def __init__(self, now=1000.0):
+		self.now = now
+
+	def __call__(self):
+		return self.now
+
+	def advance(self, seconds):
+		self.now += seconds
+
+
+class FakeTimers:
+	# call_later for a Forwarder: timers only run when the test advances the clock
+
+	def __init__(self, clock):
+		self.clock = clock
+		self.timers = []
+
+	def call_later(self, delay, callback):
+		timer = _Timer(self.clock() + delay, callback)
+		self.timers.append(timer)
+		return timer
+
+	def advance(self, seconds):
+		# Moves the clock forward, running every timer that comes due on the way in time order
+		end = self.clock() + seconds
+		while True:
+			due = [timer for timer in self.timers if not timer.cancelled and timer.when <= end]
+			if not due:
+				break
+			timer = min(due, key=lambda timer: timer.when)
+			self.timers.remove(timer)
+			self.clock.now = max(self.clock.now, timer.when)
+			timer.callback()
+		self.clock.now = end
+
+
+class _Timer:
+	__slots__ = ("when", "callback", "cancelled")
+
+	def __init__(self, when, callback):
+		self.when = when
+		self.callback = callback
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+
+def driver_packet(msg_type, psid, payload):
+	# A carma-cohda-dsrc-driver packet as it arrives on the LAN
+	header = ("Version=0.7\nType={}\nPSID={:#x}\nPriority=7\nTxMode=CONT\nTxChannel=172\nTxInterval=0\n"
+		"DeliveryStart=\nDeliveryStop=\nSignature=False\nEncryption=False\nPayload=").format(msg_type, psid)
+	return header.encode('ascii') + payload.hex().encode('ascii') + b"\n"
+
+def lan_packet(msg_type, psid=0x20, size=20, tag=0):
+	# Driver packet of a J2735 message type, tag makes otherwise identical packets differ
+	return driver_packet(msg_type, psid, struct.pack("!HI", MESSAGE_IDS[msg_type], tag) + bytes(size))
+
+def quiet_logger(name="c1t2x_test"):
+	logger = logging.getLogger(name)
+	logger.setLevel(logging.CRITICAL)
+	if not logger.handlers:
+		logger.addHandler(logging.NullHandler())
+	logger.propagate = False
+	return logger
@@ -0,0 +1,207 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import unittest
+
+from Networking.arq import (ARQSender, ARQReceiver, encode_ack, decode_ack, decode_data, pack_ip, seq_diff,
+	SEQ_MASK, SACK_BITS)
+from tests.common import FakeClock
+
+class SeqDiffTest(unittest.TestCase):
+
+	def test_wraps(self):
+		self.assertEqual(seq_diff(1, SEQ_MASK), 2)
+		self.assertEqual(seq_diff(SEQ_MASK, 1), -2)
+		self.assertEqual(seq_diff(5, 5), 0)
+
+
+class ARQSenderTest(unittest.TestCase):
+
+	def setUp(self):
+		self.clock = FakeClock()
+		self.sent = []
+		self.sender = ARQSender(self.sent.append, window_size=4, retransmit_interval=0.1, max_retries=2,
+			clock=self.clock, self_ip="10.0.0.1")
+
+	def ack(self, cumulative, sack=0, ip="10.0.0.1"):
+		self.sender.on_ack(encode_ack(pack_ip(ip), cumulative & SEQ_MASK, sack))
+
+	def test_window_fills(self):
+		for i in range(4):
+			self.assertTrue(self.sender.send(b"m%d" % i, block=False))
+		self.assertFalse(self.sender.send(b"m4", block=False))
+		self.assertEqual(self.sender.in_flight(), 4)
+		self.assertEqual(len(self.sent), 4)
+
+	def test_window_is_capped_by_the_sack_bitmap(self):
+		sender = ARQSender(self.sent.append, window_size=1000, clock=self.clock)
+		self.assertEqual(sender.window_size, SACK_BITS)
+
+	def test_cumulative_ack_slides_the_window(self):
+		base = self.sender.base
+		for i in range(4):
+			self.sender.send(b"m%d" % i, block=False)
+		self.ack(base + 2)
+		self.assertEqual(self.sender.base, (base + 2) & SEQ_MASK)
+		self.assertEqual(self.sender.acked, 2)
+		self.assertTrue(self.sender.send(b"m4", block=False))
+
+	def test_sack_releases_frames_past_a_gap(self):
+		base = self.sender.base
+		for i in range(4):
+			self.sender.send(b"m%d" % i, block=False)
+		# base is missing, base + 2 and base + 3 arrived
+		self.ack(base, 0b110)
+		self.assertEqual(self.sender.acked, 2)
+		self.assertEqual(sorted(seq_diff(seq, base) for seq in self.sender.outstanding), [0, 1])
+		# Only the missing frames are retransmitted
+		self.sent.clear()
+		self.clock.advance(1.0)
+		self.sender.poll()
+		self.assertEqual(sorted(seq_diff(decode_data(frame)[0], base) for frame in self.sent), [0, 1])
+		# Once they arrive the window is empty
+		self.ack(base + 4)
+		self.assertEqual(self.sender.in_flight(), 0)
+		self.assertEqual(self.sender.acked, 4)
+
+	def test_acks_outside_the_window_are_ignored(self):
+		base = self.sender.base
+		self.sender.send(b"m0", block=False)
+		self.ack(base + 10)
+		self.ack(base - 1)
+		self.assertEqual(self.sender.acked, 0)
+		self.assertEqual(self.sender.in_flight(), 1)
+
+	def test_acks_for_another_radio_are_ignored(self):
+		base = self.sender.base
+		self.sender.send(b"m0", block=False)
+		self.ack(base + 1, ip="10.0.0.2")
+		self.assertEqual(self.sender.foreign_acks, 1)
+		self.assertEqual(self.sender.in_flight(), 1)
+
+	def test_frames_expire_after_max_retries(self):
+		self.sender.send(b"m0", block=False)
+		for _ in range(3):
+			self.clock.advance(10.0)
+			self.sender.poll()
+		self.assertEqual(self.sender.retransmits, 2)
+		self.assertEqual(self.sender.expired, 1)
+		self.assertEqual(self.sender.in_flight(), 0)
+
+	def test_deadline_drops_unacked_frames(self):
+		self.sender.send(b"m0", block=False, deadline=0.05)
+		self.clock.advance(0.06)
+		self.assertIsNone(self.sender.poll())
+		self.assertEqual(self.sender.expired, 1)
+		self.assertEqual(self.sender.retransmits, 0)
+
+	def test_rtt_only_sampled_without_retransmits(self):
+		base = self.sender.base
+		self.sender.send(b"m0", block=False)
+		self.clock.advance(0.05)
+		self.ack(base + 1)
+		self.assertEqual(self.sender.rtt.samples, 1)
+		self.sender.send(b"m1", block=False)
+		self.clock.advance(1.0)
+		self.sender.poll()
+		self.ack(base + 2)
+		self.assertEqual(self.sender.rtt.samples, 1)
+
+
+class ARQReceiverTest(unittest.TestCase):
+
+	def setUp(self):
+		self.delivered = []
+		self.acks = []
+		self.receiver = ARQReceiver(lambda payload, addr: self.delivered.append(payload), self.acks.append)
+		self.frames = []
+		self.sender = ARQSender(self.frames.append, window_size=8, self_ip="10.0.0.1")
+		self.addr = ("10.0.0.1", 1516)
+
+	def test_in_order_delivery(self):
+		for i in range(3):
+			self.sender.send(b"m%d" % i, block=False)
+		for frame in self.frames:
+			self.receiver.on_data(frame, self.addr)
+		self.assertEqual(self.delivered, [b"m0", b"m1", b"m2"])
+		_, cumulative, sack = decode_ack(self.acks[-1])
+		self.assertEqual(cumulative, (self.sender.base + 3) & SEQ_MASK)
+		self.assertEqual(sack, 0)
+
+	def test_out_of_order_frames_are_sacked_and_delivered_at_once(self):
+		for i in range(4):
+			self.sender.send(b"m%d" % i, block=False)
+		self.receiver.on_data(self.frames[0], self.addr)
+		self.receiver.on_data(self.frames[2], self.addr)
+		self.receiver.on_data(self.frames[3], self.addr)
+		self.assertEqual(self.delivered, [b"m0", b"m2", b"m3"])
+		_, cumulative, sack = decode_ack(self.acks[-1])
+		self.assertEqual(cumulative, (self.sender.base + 1) & SEQ_MASK)
+		self.assertEqual(sack, 0b11)
+		# The ack releases everything but the missing frame
+		self.sender.on_ack(self.acks[-1])
+		self.assertEqual(self.sender.in_flight(), 3)
+		self.assertEqual(len(self.sender.outstanding), 1)
+
+	def test_duplicates_are_acked_again_but_delivered_once(self):
+		self.sender.send(b"m0", block=False)
+		self.receiver.on_data(self.frames[0], self.addr)
+		self.receiver.on_data(self.frames[0], self.addr)
+		self.assertEqual(self.delivered, [b"m0"])
+		self.assertEqual(self.receiver.duplicates, 1)
+		self.assertEqual(len(self.acks), 2)
+
+	def test_window_base_skips_frames_the_sender_gave_up_on(self):
+		clock = FakeClock()
+		frames = []
+		sender = ARQSender(frames.append, window_size=8, max_retries=0, clock=clock)
+		sender.send(b"lost", block=False)
+		sender.send(b"m1", block=False)
+		self.receiver.on_data(frames[1], self.addr)
+		sender.on_ack(self.acks[-1])
+		clock.advance(10.0)
+		sender.poll()
+		sender.send(b"m2", block=False)
+		self.receiver.on_data(frames[-1], self.addr)
+		_, cumulative, sack = decode_ack(self.acks[-1])
+		self.assertEqual(cumulative, sender.next_seq)
+		self.assertEqual(sack, 0)
+		self.assertEqual(self.delivered, [b"m1", b"m2"])
+
+	def test_idle_peers_expire(self):
+		clock = FakeClock()
+		receiver = ARQReceiver(lambda payload, addr: None, self.acks.append, peer_timeout=5.0, clock=clock)
+		self.sender.send(b"m0", block=False)
+		receiver.on_data(self.frames[0], self.addr)
+		clock.advance(6.0)
+		receiver.on_data(self.frames[0], ("10.0.0.2", 1516))
+		self.assertEqual(list(receiver.peers), ["10.0.0.2"])
+		self.assertEqual(receiver.stats()['expired_peers'], 1)
+
+	def test_peers_are_capped(self):
+		clock = FakeClock()
+		receiver = ARQReceiver(lambda payload, addr: None, self.acks.append, max_peers=2, clock=clock)
+		self.sender.send(b"m0", block=False)
+		for i in range(3):
+			receiver.on_data(self.frames[0], ("10.0.0.%d" % i, 1516))
+			clock.advance(1.0)
+		# Hearing from the first radio again keeps it over the second one
+		receiver.on_data(self.frames[0], ("10.0.0.1", 1516))
+		receiver.on_data(self.frames[0], ("10.0.0.3", 1516))
+		self.assertEqual(list(receiver.peers), ["10.0.0.1", "10.0.0.3"])
+		self.assertEqual(receiver.stats()['expired_peers'], 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,103 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import unittest
+
+from Networking.congestion import CongestionController
+from Networking.forwarding import Forwarder
+from tests.common import FakeClock, FakeTimers, lan_packet, quiet_logger
+
+class CongestionControllerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.clock = FakeClock()
+		self.losses = [0, 0, 0]
+		self.cc = CongestionController(max_rate=100.0, min_rate=2.0, burst=4, interval=1.0, bitrate=1e6, frame_overhead=0,
+			target_load=0.5, density_coefficient=5, loss_threshold=0.2, decrease=0.5, increase=10.0,
+			loss_source=lambda: tuple(self.losses), clock=self.clock)
+
+	def test_burst_then_rate(self):
+		for _ in range(4):
+			self.assertTrue(self.cc.ready())
+			self.cc.on_transmit(100)
+		self.assertFalse(self.cc.ready())
+		self.assertAlmostEqual(self.cc.delay(), 0.01)
+		self.clock.advance(0.011)
+		self.assertTrue(self.cc.ready())
+
+	def test_retransmits_go_into_debt(self):
+		for _ in range(10):
+			self.cc.on_transmit(100)
+		self.assertEqual(self.cc.tokens, -4)
+		self.assertEqual(self.cc.transmissions, 10)
+
+	def test_acks_take_no_tokens(self):
+		self.cc.on_transmit(20, data=False)
+		self.assertEqual(self.cc.tokens, 4)
+		self.assertEqual(self.cc.transmissions, 0)
+
+	def test_density_limit(self):
+		for i in range(10):
+			self.cc.on_receive("10.0.0.%d" % i, 10)
+		self.clock.advance(1.0)
+		self.cc.update(self.clock())
+		self.assertEqual(self.cc.peers, 10)
+		self.assertAlmostEqual(self.cc.rate, 50.0)
+
+	def test_load_limit(self):
+		# 40 packets of 5000 bytes sent in one second: 1.6 Mbit on a 1 Mbit channel
+		for _ in range(40):
+			self.cc.on_transmit(5000)
+		self.clock.advance(1.0)
+		self.cc.update(self.clock())
+		self.assertAlmostEqual(self.cc.load, 0.8)
+		self.assertAlmostEqual(self.cc.rate, 40 * 0.5 / 0.8)
+
+	def test_loss_cuts_the_sent_rate(self):
+		for _ in range(20):
+			self.cc.on_transmit(10)
+		self.losses = [20, 20, 10]
+		self.clock.advance(1.0)
+		self.cc.update(self.clock())
+		self.assertAlmostEqual(self.cc.rate, 20 * 0.5)
+		self.assertEqual(self.cc.decreases, 1)
+
+	def test_rate_grows_additively_and_stays_in_bounds(self):
+		self.cc.rate = 10.0
+		self.clock.advance(1.0)
+		self.cc.update(self.clock())
+		self.assertAlmostEqual(self.cc.rate, 20.0)
+		self.losses = [10, 100, 10]
+		self.clock.advance(1.0)
+		self.cc.update(self.clock())
+		self.assertEqual(self.cc.rate, 2.0)
+
+
+	def test_fragments_are_counted_one_by_one(self):
+		clock = FakeClock()
+		sent = []
+		forwarder = Forwarder(lambda payload: None, sent.append, FakeTimers(clock).call_later, quiet_logger(),
+			reliability_default={'mode': 'best_effort'}, congestion={'max_rate': 100.0, 'burst': 10, 'frame_overhead': 0},
+			fragment_size=100, clock=clock)
+		packet = lan_packet('MAP', size=150)
+		forwarder.on_lan_packet((packet, ("192.168.0.2", 5398)))
+		congestion = forwarder.congestion
+		count = -(-len(packet) // 90)
+		self.assertEqual(len(sent), 1)
+		self.assertEqual(congestion.transmissions, count)
+		self.assertEqual(congestion.tokens, 10 - count)
+		self.assertEqual(congestion.window_bytes, len(packet) + 10 * count)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,85 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import os, time
+import unittest
+
+from Messaging.decode_pool import DecodePool
+from Messaging.j2735 import MessageFrame, FRAME_TYPE
+
+class FakeCodec:
+	# Decodes to the payload itself; in a worker process, b"die" kills it and b"hang" never returns
+
+	def __init__(self):
+		self.parent = os.getpid()
+
+	def decode(self, type_name, data):
+		if os.getpid() != self.parent:
+			if data.startswith(b"die"):
+				os._exit(3)
+			if data.startswith(b"hang"):
+				time.sleep(30)
+		return {'payload': bytes(data)}
+
+	def encode(self, type_name, value):
+		return value['payload']
+
+
+class DecodePoolTest(unittest.TestCase):
+
+	def pool(self, workers, **options):
+		pool = DecodePool(FakeCodec(), workers=workers, slots=8, payload_size=64, result_size=256, **options)
+		self.addCleanup(pool.close)
+		return pool
+
+	def test_decode_in_workers(self):
+		pool = self.pool(2)
+		futures = [pool.submit(b"\x00\x14%d" % i) for i in range(6)]
+		self.assertEqual([future.result(5) for future in futures], [{'payload': b"\x00\x14%d" % i} for i in range(6)])
+		self.assertEqual(pool.stats()['decoded'], 6)
+
+	def test_dead_worker_decodes_are_finished_inline(self):
+		pool = self.pool(1)
+		future = pool.submit(b"die now")
+		self.assertEqual(future.result(5), {'payload': b"die now"})
+		stats = pool.stats()
+		self.assertEqual((stats['workers'], stats['worker_deaths'], stats['recovered']), (0, 1, 1))
+		self.assertEqual(stats['free_slots'], 8)
+		# No worker left, the caller decodes
+		self.assertIsNone(pool.submit(b"\x00\x14"))
+		self.assertEqual(pool.decode(FRAME_TYPE, b"\x00\x14"), {'payload': b"\x00\x14"})
+		self.assertEqual(pool.stats()['decoded_inline'], 1)
+
+	def test_new_decodes_go_to_the_live_workers(self):
+		pool = self.pool(2)
+		pool.submit(b"die now").result(5)
+		deadline = time.monotonic() + 5
+		while pool.stats()['worker_deaths'] == 0 and time.monotonic() < deadline:
+			time.sleep(0.01)
+		futures = [pool.submit(b"\x00\x14%d" % i) for i in range(4)]
+		self.assertNotIn(None, futures)
+		self.assertEqual(len([future.result(5) for future in futures]), 4)
+		self.assertEqual(pool.stats()['workers'], 1)
+
+	def test_value_falls_back_to_inline_decoding(self):
+		pool = self.pool(1, timeout=0.1)
+		frame = MessageFrame(b"hang\x00\x14", pool)
+		frame.prefetch()
+		start = time.monotonic()
+		self.assertEqual(frame.value, {'payload': b"hang\x00\x14"})
+		self.assertLess(time.monotonic() - start, 2.0)
+		self.assertEqual(pool.stats()['decoded_inline'], 1)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,105 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import unittest
+
+from Networking.dedup import DedupCache
+from Networking.forwarding import Forwarder
+from Networking.framing import CompactFramer
+from tests.common import FakeClock, FakeTimers, lan_packet, quiet_logger
+
+class DedupCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.clock = FakeClock()
+		self.cache = DedupCache(max_entries=3, ttl=10.0, clock=self.clock)
+
+	def test_hit_and_miss(self):
+		self.assertFalse(self.cache.seen(("10.0.0.1", 1)))
+		self.assertTrue(self.cache.seen(("10.0.0.1", 1)))
+		self.assertFalse(self.cache.seen(("10.0.0.2", 1)))
+		self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+	def test_keys_expire(self):
+		self.cache.seen("a")
+		self.clock.advance(10.5)
+		self.assertFalse(self.cache.seen("a"))
+		self.assertEqual(self.cache.expirations, 1)
+
+	def test_oldest_key_is_evicted(self):
+		for key in "abcd":
+			self.cache.seen(key)
+		self.assertEqual(self.cache.evictions, 1)
+		self.assertFalse(self.cache.seen("a"))
+		self.assertTrue(self.cache.seen("d"))
+
+	def test_copies_do_not_extend_expiry(self):
+		self.cache.seen("a")
+		for _ in range(3):
+			self.clock.advance(3.0)
+			self.assertTrue(self.cache.seen("a"))
+		self.clock.advance(1.5)
+		self.assertFalse(self.cache.seen("a"))
+
+
+class ForwarderDedupTest(unittest.TestCase):
+
+	def setUp(self):
+		self.clock = FakeClock()
+		self.timers = FakeTimers(self.clock)
+		self.lan = []
+		self.forwarder = Forwarder(self.lan.append, lambda data: None, self.timers.call_later, quiet_logger(),
+			clock=self.clock)
+
+	def test_compact_frames_are_keyed_on_sequence_number(self):
+		framer = CompactFramer(seq=0)
+		packet = lan_packet('MobilityRequest')
+		first, second = framer.frame(packet), framer.frame(packet)
+		for frame in (first, first, second):
+			self.forwarder.on_vanet_packet((frame, ("10.0.0.2", 1516)))
+		self.assertEqual(len(self.lan), 2)
+		self.assertEqual(self.forwarder.counters.duplicates, 1)
+
+	def test_driver_packets_are_keyed_on_digest(self):
+		packet = lan_packet('MobilityRequest')
+		for _ in range(2):
+			self.forwarder.on_vanet_packet((packet, ("10.0.0.2", 1516)))
+		self.assertEqual(len(self.lan), 1)
+
+
+	def test_identical_best_effort_messages_are_all_forwarded(self):
+		forwarder = Forwarder(self.lan.append, lambda data: None, self.timers.call_later, quiet_logger(),
+			reliability=[{'name': 'periodic', 'mode': 'best_effort', 'messages': ['BSM', 'MAP']}], clock=self.clock)
+		packet = lan_packet('MAP')
+		for _ in range(5):
+			forwarder.on_vanet_packet((packet, ("10.0.0.2", 1516)))
+			self.clock.advance(1.0)
+		self.assertEqual(len(self.lan), 5)
+		self.assertEqual(forwarder.counters.duplicates, 0)
+
+	def test_repeats_are_suppressed_within_their_window(self):
+		forwarder = Forwarder(self.lan.append, lambda data: None, self.timers.call_later, quiet_logger(),
+			reliability=[{'name': 'spat', 'mode': 'repeat', 'repeats': 2, 'repeat_interval': 0.05, 'messages': ['SPAT']}],
+			clock=self.clock)
+		packet = lan_packet('SPAT')
+		# The message and its two repeats, then the same bytes again as the next message
+		for delay in (0.05, 0.05, 1.0, 0.0):
+			forwarder.on_vanet_packet((packet, ("10.0.0.2", 1516)))
+			self.clock.advance(delay)
+		self.assertEqual(len(self.lan), 2)
+		self.assertEqual(forwarder.counters.duplicates, 2)
+		self.assertEqual(forwarder.stats()['repeat_dedup']['spat']['hits'], 2)
+
+if __name__ == '__main__':
+	unittest.main()
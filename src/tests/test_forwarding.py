@@ -0,0 +1,221 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import unittest
+
+from Networking.forwarding import Forwarder, make_forwarder
+from Networking.framing import strip_header
+from Networking.startup import StartupTimer
+from tests.common import FakeClock, FakeTimers, lan_packet, quiet_logger
+from replay import InlineTimers
+
+RELIABILITY = [{'name': 'periodic', 'mode': 'best_effort', 'messages': ['BSM']}]
+
+class Radio:
+	# A Forwarder whose VANET is a list of other radios, with frames arriving after a short delay
+
+	def __init__(self, ip, timers, mode='stop_and_wait', **options):
+		self.ip = ip
+		self.timers = timers
+		self.lan = []
+		self.others = []
+		# Drops the next frames sent while above 0
+		self.lose = 0
+		self.sent = 0
+		self.forwarder = Forwarder(self.lan.append, self.send, timers.call_later, quiet_logger(), mode=mode,
+			self_ip=ip, retransmit_interval=0.1, reliability=RELIABILITY, rto_jitter=0, clock=timers.clock, **options)
+
+	def send(self, data):
+		self.sent += 1
+		if self.lose:
+			self.lose -= 1
+			return
+		for radio in self.others:
+			self.timers.call_later(0.001, lambda radio=radio: radio.forwarder.on_vanet_packet((data, (self.ip, 1516))))
+
+def network(count, mode='stop_and_wait', **options):
+	timers = FakeTimers(FakeClock())
+	radios = [Radio("10.0.0.%d" % (i + 1), timers, mode, **options) for i in range(count)]
+	for radio in radios:
+		radio.others = [other for other in radios if other is not radio]
+	return timers, radios
+
+
+class ForwarderTest(unittest.TestCase):
+
+	def test_stop_and_wait_delivers_in_order(self):
+		timers, (a, b) = network(2)
+		packets = [lan_packet('MobilityRequest', tag=i) for i in range(5)]
+		for packet in packets:
+			a.forwarder.on_lan_packet((packet, ("192.168.0.2", 5398)))
+		timers.advance(1.0)
+		self.assertEqual(b.lan, [strip_header(packet) for packet in packets])
+		self.assertEqual(a.forwarder.counters.retransmits, 0)
+		self.assertIsNone(a.forwarder.in_flight)
+
+	def test_stop_and_wait_retransmits_lost_messages_once_delivered(self):
+		timers, (a, b) = network(2)
+		packet = lan_packet('MobilityRequest')
+		# The message arrives, but the ack does not
+		b.lose = 1
+		a.forwarder.on_lan_packet((packet, ("192.168.0.2", 5398)))
+		timers.advance(5.0)
+		self.assertEqual(b.lan, [strip_header(packet)])
+		self.assertEqual(a.forwarder.counters.retransmits, 1)
+		self.assertEqual(b.forwarder.counters.duplicates, 1)
+		self.assertIsNone(a.forwarder.in_flight)
+
+	def test_best_effort_is_not_acked(self):
+		timers, (a, b) = network(2)
+		a.forwarder.on_lan_packet((lan_packet('BSM'), ("192.168.0.2", 5398)))
+		timers.advance(1.0)
+		self.assertEqual(len(b.lan), 1)
+		self.assertEqual(b.forwarder.counters.acks_sent, 0)
+		self.assertEqual(a.sent, 1)
+
+	def test_waiting_acknowledged_message_does_not_hold_back_best_effort(self):
+		# With the default single outbound class, best effort packets queue behind acknowledged ones
+		timers, (a, b) = network(2)
+		b.lose = 100
+		a.forwarder.on_lan_packet((lan_packet('MobilityRequest', tag=1), ("192.168.0.2", 5398)))
+		a.forwarder.on_lan_packet((lan_packet('MobilityRequest', tag=2), ("192.168.0.2", 5398)))
+		bsm = lan_packet('BSM')
+		a.forwarder.on_lan_packet((bsm, ("192.168.0.2", 5398)))
+		timers.advance(0.01)
+		self.assertIn(strip_header(bsm), b.lan)
+		self.assertEqual(len(a.forwarder.pending), 1)
+
+	def test_message_the_lan_did_not_take_is_not_acked(self):
+		for mode in ('stop_and_wait', 'sliding_window'):
+			timers, (a, b) = network(2, mode)
+			refused = []
+			def send_lan(payload):
+				if not refused:
+					refused.append(payload)
+					return False
+				b.lan.append(payload)
+			b.forwarder.send_lan = send_lan
+			packet = lan_packet('MobilityRequest')
+			a.forwarder.on_lan_packet((packet, ("192.168.0.2", 5398)))
+			timers.advance(0.05)
+			self.assertEqual(b.forwarder.counters.acks_sent, 0, mode)
+			timers.advance(5.0)
+			self.assertEqual(b.lan, [strip_header(packet)], mode)
+			self.assertEqual(b.forwarder.counters.lan_drops, 1, mode)
+			self.assertGreater(a.forwarder.stats()['arq_sender']['retransmits'] if mode == 'sliding_window'
+				else a.forwarder.counters.retransmits, 0, mode)
+
+	def test_sliding_window_recovers_losses(self):
+		timers, (a, b) = network(2, 'sliding_window', window_size=8)
+		packets = [lan_packet('MobilityRequest', tag=i) for i in range(20)]
+		a.lose = 3
+		for packet in packets:
+			a.forwarder.on_lan_packet((packet, ("192.168.0.2", 5398)))
+			timers.advance(0.01)
+		timers.advance(5.0)
+		self.assertEqual(sorted(b.lan), sorted(strip_header(packet) for packet in packets))
+		self.assertEqual(a.forwarder.arq_sender.in_flight(), 0)
+
+	def test_compact_framing(self):
+		timers, (a, b) = network(2, framing='compact')
+		packet = lan_packet('MobilityRequest')
+		a.forwarder.on_lan_packet((packet, ("192.168.0.2", 5398)))
+		timers.advance(1.0)
+		self.assertEqual(b.lan, [strip_header(packet)])
+
+
+
+class AckQuorumTest(unittest.TestCase):
+
+	def test_stop_and_wait_waits_for_the_quorum(self):
+		timers, (a, b, c) = network(3, ack_quorum=2)
+		packet = lan_packet('MobilityRequest')
+		# c receives the message but its ack is lost, b's ack alone does not release it
+		c.lose = 1
+		a.forwarder.on_lan_packet((packet, ("192.168.0.2", 5398)))
+		timers.advance(0.05)
+		self.assertIsNotNone(a.forwarder.in_flight)
+		timers.advance(5.0)
+		self.assertIsNone(a.forwarder.in_flight)
+		self.assertEqual(a.forwarder.counters.retransmits, 1)
+		self.assertEqual((b.lan, c.lan), ([strip_header(packet)], [strip_header(packet)]))
+
+	def test_acks_are_not_suppressed(self):
+		timers, (a, b, c) = network(3, ack_quorum=2, ack_jitter=0.05)
+		a.forwarder.on_lan_packet((lan_packet('MobilityRequest'), ("192.168.0.2", 5398)))
+		timers.advance(1.0)
+		self.assertIsNone(a.forwarder.in_flight)
+		self.assertEqual(b.forwarder.counters.acks_suppressed + c.forwarder.counters.acks_suppressed, 0)
+		self.assertEqual(a.forwarder.counters.retransmits, 0)
+
+	def test_too_few_radios(self):
+		timers, (a, b) = network(2, ack_quorum=2)
+		a.forwarder.on_lan_packet((lan_packet('MobilityRequest'), ("192.168.0.2", 5398)))
+		timers.advance(1.0)
+		self.assertIsNotNone(a.forwarder.in_flight)
+		self.assertGreater(a.forwarder.counters.retransmits, 0)
+
+	def test_sliding_window_waits_for_the_quorum(self):
+		timers, (a, b, c) = network(3, 'sliding_window', window_size=8, ack_quorum=2)
+		packets = [lan_packet('MobilityRequest', tag=i) for i in range(5)]
+		c.lose = 5
+		for packet in packets:
+			a.forwarder.on_lan_packet((packet, ("192.168.0.2", 5398)))
+		timers.advance(0.05)
+		self.assertEqual(a.forwarder.arq_sender.in_flight(), 5)
+		timers.advance(5.0)
+		self.assertEqual(a.forwarder.arq_sender.in_flight(), 0)
+		self.assertGreater(a.forwarder.arq_sender.retransmits, 0)
+		self.assertEqual(sorted(c.lan), sorted(strip_header(packet) for packet in packets))
+
+
+class StartupWatchTest(unittest.TestCase):
+
+	def test_acks_are_not_the_first_forwarded_packet(self):
+		for mode in ('stop_and_wait', 'sliding_window'):
+			timers, (a, b) = network(2, mode)
+			sender, receiver = StartupTimer(), StartupTimer()
+			sender.watch(a.forwarder, '_transmit', 'LAN -> VANET')
+			receiver.watch(b.forwarder, '_transmit', 'LAN -> VANET')
+			a.forwarder.on_lan_packet((lan_packet('MobilityRequest'), ("192.168.0.2", 5398)))
+			timers.advance(1.0)
+			self.assertEqual(b.sent, 1, mode)
+			self.assertIsNone(receiver.first_packet, mode)
+			self.assertEqual(sender.first_packet_path, 'LAN -> VANET', mode)
+
+class MakeForwarderTest(unittest.TestCase):
+
+	def test_params_are_applied(self):
+		params = {'FORWARDING_MODE': 'sliding_window', 'DEDUP_CACHE_SIZE': 16, 'DEDUP_TTL': 5.0, 'ACK_JITTER': 0.05,
+			'ACK_QUORUM': 2, 'RELIABILITY': RELIABILITY}
+		forwarder = make_forwarder(params, None, None, None, quiet_logger(), fragment_size=200)
+		self.assertTrue(forwarder.sliding_window)
+		self.assertEqual((forwarder.dedup.max_entries, forwarder.dedup.ttl), (16, 5.0))
+		self.assertEqual((forwarder.ack_jitter, forwarder.ack_quorum, forwarder.fragment_size), (0.05, 2, 200))
+		self.assertFalse(make_forwarder(params, None, None, None, quiet_logger(), mode='stop_and_wait').sliding_window)
+
+	def test_replay_timers_drain(self):
+		timers = InlineTimers()
+		sent = []
+		forwarder = make_forwarder({}, None, sent.append, timers.call_later, quiet_logger(), clock=timers.time)
+		# Nobody acks, so the message is retransmitted until the forwarder gives up on it
+		forwarder.on_lan_packet((lan_packet('MobilityRequest'), ("192.168.0.2", 5398)))
+		timers.drain()
+		self.assertEqual(timers.timers, [])
+		self.assertIsNone(forwarder.in_flight)
+		self.assertEqual(forwarder.counters.ack_timeouts, 1)
+		self.assertGreater(len(sent), 1)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,113 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import unittest
+
+from Networking.fragments import Fragmenter, Reassembler, is_fragment, fragment_sizes, FRAGMENT_HEADER, MAX_FRAGMENTS
+from tests.common import FakeClock
+
+ADDR = ("10.0.0.1", 1516)
+
+class FragmenterTest(unittest.TestCase):
+
+	def test_small_packets_are_not_split(self):
+		fragmenter = Fragmenter(100)
+		packet = bytes(100)
+		self.assertEqual(fragmenter.split(packet), [packet])
+		self.assertEqual(fragmenter.fragmented, 0)
+
+	def test_fragments_fit_the_fragment_size(self):
+		fragmenter = Fragmenter(100)
+		fragments = fragmenter.split(bytes(range(256)) * 2)
+		self.assertEqual(len(fragments), 6)
+		self.assertTrue(all(len(fragment) <= 100 and is_fragment(fragment) for fragment in fragments))
+
+	def test_fragment_sizes_match_the_split(self):
+		fragmenter = Fragmenter(100)
+		for size in (0, 99, 100, 101, 180, 450, 1000):
+			self.assertEqual([len(fragment) for fragment in fragmenter.split(bytes(size))], list(fragment_sizes(size, 100)))
+		self.assertEqual(fragment_sizes(5000, 0), (5000,))
+
+	def test_limits(self):
+		with self.assertRaises(ValueError):
+			Fragmenter(FRAGMENT_HEADER.size)
+		with self.assertRaises(ValueError):
+			Fragmenter(20).split(bytes((20 - FRAGMENT_HEADER.size) * MAX_FRAGMENTS + 1))
+
+
+class ReassemblerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.clock = FakeClock()
+		self.reassembler = Reassembler(timeout=2.0, max_messages=4, max_bytes=10000, clock=self.clock)
+		self.packet = bytes(i % 251 for i in range(1000))
+		self.fragments = Fragmenter(300).split(self.packet)
+
+	def add_all(self, fragments, addr=ADDR):
+		results = [self.reassembler.add(fragment, addr) for fragment in fragments]
+		return [result for result in results if result is not None]
+
+	def test_in_order(self):
+		self.assertEqual(self.add_all(self.fragments), [self.packet])
+		self.assertEqual(self.reassembler.stats()['pending'], 0)
+		self.assertEqual(self.reassembler.buffered, 0)
+
+	def test_reordered(self):
+		fragments = self.fragments
+		self.assertEqual(self.add_all([fragments[2], fragments[0], fragments[3], fragments[1]]), [self.packet])
+
+	def test_last_fragment_first(self):
+		self.assertEqual(self.add_all(list(reversed(self.fragments))), [self.packet])
+
+	def test_interleaved_senders(self):
+		other = Fragmenter(300).split(bytes(700))
+		results = []
+		for i in range(len(self.fragments)):
+			results.append(self.reassembler.add(self.fragments[i], ADDR))
+			if i < len(other):
+				results.append(self.reassembler.add(other[i], ("10.0.0.2", 1516)))
+		self.assertEqual(sorted(len(result) for result in results if result is not None), [700, 1000])
+
+	def test_duplicates_are_dropped(self):
+		fragments = self.fragments
+		self.assertEqual(self.add_all([fragments[0], fragments[0]] + fragments[1:] + [fragments[1]]), [self.packet])
+		self.assertEqual(self.reassembler.duplicates, 2)
+
+	def test_incomplete_messages_time_out(self):
+		self.add_all(self.fragments[:-1])
+		self.clock.advance(2.5)
+		self.assertIsNone(self.reassembler.add(self.fragments[-1], ADDR))
+		self.assertEqual(self.reassembler.timeouts, 1)
+
+	def test_oldest_message_is_evicted(self):
+		for _ in range(5):
+			self.add_all(Fragmenter(300).split(bytes(1000))[:1])
+		self.assertEqual(self.reassembler.evicted, 1)
+		self.assertEqual(len(self.reassembler.partial), 4)
+
+	def test_truncated_fragments_are_invalid(self):
+		fragments = self.fragments
+		self.assertEqual(self.add_all([fragments[0], fragments[1][:-1]] + fragments[2:]), [])
+		self.assertEqual(self.reassembler.invalid, 1)
+		self.assertIsNone(self.reassembler.add(fragments[0][:FRAGMENT_HEADER.size - 1], ADDR))
+		self.assertEqual(self.reassembler.invalid, 2)
+
+	def test_oversized_messages_are_invalid(self):
+		fragments = Fragmenter(1000).split(bytes(20000))
+		self.assertEqual(self.add_all(fragments), [])
+		self.assertEqual(self.reassembler.invalid, len(fragments))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,93 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import unittest
+from unittest import mock
+
+from Networking.framing import (parse_dsrc, strip_header, peek_packet, packet_psid, vanet_payload, CompactFramer,
+	decode_compact, sender_id, is_compact)
+from Networking.forwarding import Forwarder
+from tests.common import lan_packet, quiet_logger
+
+class DriverPacketTest(unittest.TestCase):
+
+	def setUp(self):
+		self.packet = lan_packet('MobilityRequest', psid=0xBFEE, size=10, tag=7)
+
+	def test_parse(self):
+		packet = parse_dsrc(self.packet)
+		self.assertEqual(packet.msg_type, 'MobilityRequest')
+		self.assertEqual(packet.psid, 0xBFEE)
+		self.assertEqual(packet.payload, strip_header(self.packet))
+
+	def test_strip_header_of_views(self):
+		self.assertEqual(strip_header(memoryview(bytearray(self.packet))), strip_header(self.packet))
+		self.assertEqual(strip_header(self.packet[:-1]), strip_header(self.packet))
+
+	def test_peek(self):
+		self.assertEqual(peek_packet(self.packet), (0xBFEE, 240))
+		self.assertEqual(packet_psid(self.packet), 0xBFEE)
+
+	def test_not_a_driver_packet(self):
+		with self.assertRaises(ValueError):
+			strip_header(b"Version=0.7\nType=BSM\n")
+
+
+class CompactFrameTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		framer = CompactFramer(sender_id("10.0.0.1"), seq=0)
+		packet = lan_packet('BSM', psid=0x20)
+		frame = framer.frame(packet)
+		self.assertTrue(is_compact(frame))
+		decoded = decode_compact(frame)
+		self.assertEqual((decoded.psid, decoded.seq, decoded.sender), (0x20, 1, sender_id("10.0.0.1")))
+		self.assertEqual(vanet_payload(frame), strip_header(packet))
+		self.assertEqual(peek_packet(frame), (0x20, 20))
+		self.assertEqual(packet_psid(frame), 0x20)
+		self.assertEqual(decode_compact(framer.frame(packet)).seq, 2)
+
+	def test_other_packets_pass_unchanged(self):
+		framer = CompactFramer()
+		self.assertEqual(framer.frame(b"hello"), b"hello")
+		self.assertEqual(framer.passed, 1)
+
+	def test_unknown_version(self):
+		frame = bytearray(CompactFramer().frame(lan_packet('BSM')))
+		frame[1] = 99
+		with self.assertRaises(ValueError):
+			vanet_payload(bytes(frame))
+
+
+class ForwardingPathTest(unittest.TestCase):
+
+	def test_driver_header_is_not_parsed_to_forward(self):
+		lan = []
+		forwarder = Forwarder(lan.append, lambda data: None, lambda delay, callback: None, quiet_logger(), parse_vanet=True)
+		packet = lan_packet('BSM')
+		with mock.patch('Networking.framing.parse_header', side_effect=AssertionError("header parsed")):
+			forwarder.on_vanet_packet((packet, ("10.0.0.2", 1516)))
+		self.assertEqual(lan, [strip_header(packet)])
+
+	def test_radio_apps_get_the_psid(self):
+		routed = []
+		forwarder = Forwarder(lambda payload: None, lambda data: None, lambda delay, callback: None, quiet_logger(),
+			on_message=lambda frame, addr, source, psid: routed.append((frame.name, source, psid)))
+		forwarder.on_vanet_packet((lan_packet('BSM', psid=0x20), ("10.0.0.2", 1516)))
+		forwarder.on_vanet_packet((CompactFramer().frame(lan_packet('SPAT', psid=0x82)), ("10.0.0.3", 1516)))
+		self.assertEqual(routed, [('BSM', 'VANET', 0x20), ('SPAT', 'VANET', 0x82)])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,58 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import logging
+import unittest
+from queue import SimpleQueue
+
+from Networking.logs import _LazyQueueHandler
+
+class LazyQueueHandlerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.queue = SimpleQueue()
+		self.logger = logging.getLogger("tests.logs")
+		self.logger.propagate = False
+		self.logger.setLevel(logging.INFO)
+		self.logger.handlers = [_LazyQueueHandler(self.queue)]
+
+	def test_reused_buffer_is_copied(self):
+		buffer = bytearray(b"first")
+		self.logger.info("received %s from %s", memoryview(buffer), ("10.0.0.1", 5000))
+		buffer[:] = b"again"
+		record = self.queue.get_nowait()
+		self.assertEqual(record.getMessage(), "received b'first' from ('10.0.0.1', 5000)")
+
+	def test_immutable_args_stay_lazy(self):
+		self.logger.info("sent %d bytes to %s", 20, "10.0.0.2")
+		record = self.queue.get_nowait()
+		self.assertEqual(record.args, (20, "10.0.0.2"))
+		self.assertEqual(record.msg, "sent %d bytes to %s")
+
+	def test_mutable_args_are_formatted_now(self):
+		peers = ["10.0.0.1"]
+		self.logger.info("peers %s", peers)
+		peers.append("10.0.0.2")
+		record = self.queue.get_nowait()
+		self.assertIsNone(record.args)
+		self.assertEqual(record.getMessage(), "peers ['10.0.0.1']")
+
+	def test_mapping_args(self):
+		buffer = bytearray(b"abc")
+		self.logger.info("%(data)s", {"data": buffer})
+		buffer[:] = b"xyz"
+		self.assertEqual(self.queue.get_nowait().getMessage(), "b'abc'")
+
+if __name__ == '__main__':
+	unittest.main()
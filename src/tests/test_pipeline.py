@@ -0,0 +1,45 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import logging
+import unittest
+
+from Networking.pipeline import Pipeline, DROP_OLDEST, DROP_NEWEST
+from tests.common import quiet_logger
+
+class PipelineTest(unittest.TestCase):
+
+	def test_stage_policy_overrides_the_pipeline(self):
+		pipeline = Pipeline("test", capacity=2, policy=DROP_OLDEST)
+		pipeline.add_stage("first", lambda item: item)
+		send = pipeline.add_stage("send", lambda item: None, policy=DROP_NEWEST)
+		self.assertEqual([send.inbox.put(i) for i in range(3)], [True, True, False])
+		self.assertEqual([send.inbox.get(0), send.inbox.get(0)], [0, 1])
+		self.assertEqual(pipeline.stages[0].inbox.policy, DROP_OLDEST)
+
+	def test_stage_failures_are_logged_as_warnings(self):
+		logger = quiet_logger()
+		pipeline = Pipeline("test", logger=logger)
+		def fail(item):
+			raise OSError("interface down")
+		stage = pipeline.add_stage("send", fail)
+		stage.running = True
+		stage.inbox.get = lambda timeout: stage.stop() or b"packet"
+		with self.assertLogs(logger, logging.WARNING) as logs:
+			stage.run()
+		self.assertEqual(stage.errors, 1)
+		self.assertIn("interface down", logs.output[0])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,59 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import os, time, signal, tempfile, unittest
+
+from Networking.profiling import RuntimeProfiler, install_signal_handlers
+
+def wait_for(condition, timeout=2.0):
+	deadline = time.monotonic() + timeout
+	while not condition() and time.monotonic() < deadline:
+		time.sleep(0.01)
+	return condition()
+
+class SignalHandlerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.profiler = RuntimeProfiler(self.directory.name)
+
+	def tearDown(self):
+		self.profiler.close()
+		self.directory.cleanup()
+
+	def test_loop_handlers_queue_the_toggle(self):
+		handlers = {}
+		install_signal_handlers(self.profiler, lambda sig, fn, *args: handlers.__setitem__(sig, (fn, args)))
+		fn, args = handlers[signal.SIGUSR2]
+		with self.profiler.lock:
+			fn(*args)
+			self.assertFalse(self.profiler.tracing)
+		self.assertTrue(wait_for(lambda: self.profiler.tracing))
+
+	@unittest.skipUnless(hasattr(signal, 'SIGUSR2'), "no SIGUSR2")
+	def test_signal_while_the_lock_is_held(self):
+		previous = signal.getsignal(signal.SIGUSR2), signal.getsignal(signal.SIGUSR1)
+		try:
+			install_signal_handlers(self.profiler)
+			with self.profiler.lock:
+				os.kill(os.getpid(), signal.SIGUSR2)
+				# The handler has run by now, it must not have waited for the lock
+				time.sleep(0.05)
+			self.assertTrue(wait_for(lambda: self.profiler.tracing))
+		finally:
+			signal.signal(signal.SIGUSR2, previous[0])
+			signal.signal(signal.SIGUSR1, previous[1])
+
+if __name__ == '__main__':
+	unittest.main()
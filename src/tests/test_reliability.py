@@ -0,0 +1,59 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import unittest
+
+from Networking.reliability import ReliabilityPolicy, Reliability
+from Networking.framing import CompactFramer
+from tests.common import lan_packet
+
+POLICIES = [
+	{'name': 'periodic', 'mode': 'best_effort', 'messages': ['BSM']},
+	{'name': 'map', 'mode': 'repeat', 'messages': ['MAP'], 'repeats': 2},
+	{'name': 'mobility', 'mode': 'acknowledged', 'messages': ['MobilityRequest'], 'deadline': 5.0},
+	{'name': 'private', 'mode': 'best_effort', 'psids': ['0xBFEE']},
+]
+
+class ReliabilityPolicyTest(unittest.TestCase):
+
+	def setUp(self):
+		self.policy = ReliabilityPolicy(POLICIES, {'mode': 'acknowledged', 'deadline': 120.0})
+
+	def test_lookup_by_message(self):
+		self.assertEqual(self.policy.lookup(lan_packet('BSM')).name, 'periodic')
+		self.assertEqual(self.policy.lookup(lan_packet('MAP')).repeats, 2)
+		self.assertEqual(self.policy.lookup(lan_packet('MobilityRequest')).deadline, 5.0)
+
+	def test_psid_takes_precedence(self):
+		self.assertEqual(self.policy.lookup(lan_packet('MobilityRequest', psid=0xBFEE)).name, 'private')
+
+	def test_default(self):
+		policy = self.policy.lookup(lan_packet('SPAT'))
+		self.assertIs(policy, self.policy.default)
+		self.assertTrue(policy.acknowledged)
+		self.assertIs(self.policy.lookup(b"not a driver packet"), self.policy.default)
+
+	def test_compact_frames(self):
+		framer = CompactFramer()
+		self.assertTrue(self.policy.acknowledged(framer.frame(lan_packet('MobilityRequest'))))
+		self.assertFalse(self.policy.acknowledged(framer.frame(lan_packet('BSM'))))
+
+	def test_repeats_only_in_repeat_mode(self):
+		self.assertEqual(Reliability('x', 'best_effort', repeats=3).repeats, 0)
+		with self.assertRaises(ValueError):
+			Reliability('x', 'sometimes')
+
+
+if __name__ == '__main__':
+	unittest.main()
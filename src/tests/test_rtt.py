@@ -0,0 +1,65 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import unittest
+
+from Networking.rtt import RTTEstimator
+
+class RTTEstimatorTest(unittest.TestCase):
+
+	def test_initial_timeout(self):
+		rtt = RTTEstimator(initial_rto=1.0, min_rto=0.02, max_rto=4.0, jitter=0)
+		self.assertEqual(rtt.timeout(), 1.0)
+
+	def test_first_sample(self):
+		rtt = RTTEstimator(jitter=0)
+		rtt.observe(0.1)
+		self.assertAlmostEqual(rtt.srtt, 0.1)
+		self.assertAlmostEqual(rtt.rttvar, 0.05)
+		self.assertAlmostEqual(rtt.rto, 0.3)
+
+	def test_later_samples(self):
+		rtt = RTTEstimator(jitter=0)
+		rtt.observe(0.1)
+		rtt.observe(0.2)
+		self.assertAlmostEqual(rtt.rttvar, 0.75 * 0.05 + 0.25 * 0.1)
+		self.assertAlmostEqual(rtt.srtt, 0.875 * 0.1 + 0.125 * 0.2)
+
+	def test_clamped(self):
+		rtt = RTTEstimator(min_rto=0.02, max_rto=4.0, jitter=0)
+		for _ in range(20):
+			rtt.observe(0.0001)
+		self.assertEqual(rtt.rto, 0.02)
+		rtt.observe(10.0)
+		self.assertEqual(rtt.rto, 4.0)
+
+	def test_backoff(self):
+		rtt = RTTEstimator(initial_rto=0.1, max_rto=1.0, jitter=0)
+		self.assertEqual([rtt.timeout(n) for n in range(5)], [0.1, 0.2, 0.4, 0.8, 1.0])
+
+	def test_jitter_only_stretches(self):
+		rtt = RTTEstimator(initial_rto=0.1, jitter=0.25)
+		for _ in range(50):
+			self.assertTrue(0.1 <= rtt.timeout() <= 0.125)
+
+	def test_reset(self):
+		rtt = RTTEstimator(initial_rto=1.0, jitter=0)
+		rtt.observe(0.1)
+		rtt.reset()
+		self.assertIsNone(rtt.srtt)
+		self.assertEqual(rtt.timeout(), 1.0)
+
+
+if __name__ == '__main__':
+	unittest.main()
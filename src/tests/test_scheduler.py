@@ -0,0 +1,145 @@
+# Written by the USDOT Volpe National Transportation Systems Center
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import unittest
+
+from Networking.scheduler import OutboundScheduler
+from tests.common import FakeClock, lan_packet
+
+CLASSES = [
+	{'name': 'mobility', 'priority': 0, 'messages': ['MobilityRequest', 'SPAT'], 'queue_size': 4},
+	{'name': 'status', 'priority': 1, 'messages': ['BSM'], 'rate': 10, 'burst': 2, 'coalesce': True, 'queue_size': 4},
+	{'name': 'default', 'priority': 2, 'queue_size': 8},
+]
+
+class OutboundSchedulerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.clock = FakeClock()
+		self.scheduler = OutboundScheduler(CLASSES, 'default', self.clock)
+
+	def drain(self, hold=False):
+		packets = []
+		while True:
+			packet = self.scheduler.pop(hold=hold)
+			if packet is None:
+				return packets
+			packets.append(packet)
+
+	def test_single_class_is_fifo(self):
+		scheduler = OutboundScheduler(clock=self.clock)
+		packets = [lan_packet('BSM', tag=i) for i in range(3)] + [lan_packet('MobilityRequest')]
+		for packet in packets:
+			scheduler.push(packet)
+		self.assertEqual([scheduler.pop() for _ in range(4)], packets)
+		self.assertIsNone(scheduler.pop())
+
+	def test_priority_order(self):
+		bsm = lan_packet('BSM')
+		other = lan_packet('MAP')
+		request = lan_packet('MobilityRequest')
+		for packet in (other, bsm, request):
+			self.scheduler.push(packet, ("192.168.0.2", 5398))
+		self.assertEqual(self.drain(), [request, bsm, other])
+
+	def test_psid_takes_precedence(self):
+		scheduler = OutboundScheduler([{'name': 'fast', 'psids': [0xBFEE]}, {'name': 'default', 'priority': 1}], 'default', self.clock)
+		scheduler.push(lan_packet('BSM'))
+		fast = lan_packet('BSM', psid=0xBFEE)
+		scheduler.push(fast)
+		self.assertEqual(scheduler.pop(), fast)
+
+	def test_coalescing_keeps_the_latest_in_place(self):
+		addr = ("192.168.0.2", 5398)
+		first = lan_packet('BSM', tag=1)
+		latest = lan_packet('BSM', tag=2)
+		other = lan_packet('BSM', tag=3)
+		self.scheduler.push(first, addr)
+		self.scheduler.push(other, ("192.168.0.3", 5398))
+		self.scheduler.push(latest, addr)
+		self.assertEqual(len(self.scheduler), 2)
+		self.assertEqual(self.drain(), [latest, other])
+		self.assertEqual(self.scheduler.classes[1].coalesced, 1)
+
+	def test_full_queue_drops_the_oldest(self):
+		packets = [lan_packet('SPAT', tag=i) for i in range(5)]
+		accepted = [self.scheduler.push(packet) for packet in packets]
+		self.assertEqual(accepted, [True] * 4 + [False])
+		self.assertEqual(self.drain(), packets[1:])
+
+	def test_rate_limit(self):
+		for i in range(3):
+			self.scheduler.push(lan_packet('BSM', tag=i), ("192.168.0.%d" % i, 5398))
+		self.assertEqual(len(self.drain()), 2)
+		self.assertAlmostEqual(self.scheduler.next_ready(), 0.1)
+		self.clock.advance(0.1)
+		self.assertEqual(len(self.drain()), 1)
+		self.assertIsNone(self.scheduler.next_ready())
+
+	def test_rate_limited_class_does_not_block_lower_classes(self):
+		for i in range(3):
+			self.scheduler.push(lan_packet('BSM', tag=i), ("192.168.0.%d" % i, 5398))
+		other = lan_packet('MAP')
+		self.scheduler.push(other)
+		self.assertEqual(self.drain()[-1], other)
+		self.assertEqual(len(self.scheduler), 1)
+
+	def test_hold_skips_held_classes(self):
+		request = lan_packet('MobilityRequest')
+		bsm = lan_packet('BSM')
+		self.scheduler.push(request, held=True)
+		self.scheduler.push(bsm)
+		self.assertEqual(self.drain(hold=True), [bsm])
+		self.assertEqual(self.drain(), [request])
+
+	def test_held_packet_does_not_block_its_class(self):
+		request = lan_packet('MobilityRequest', tag=1)
+		spat = lan_packet('SPAT')
+		later = lan_packet('MobilityRequest', tag=2)
+		for packet in (request, spat, later):
+			self.scheduler.push(packet, held=packet is not spat)
+		self.assertEqual(self.scheduler.next_ready(hold=True), 0.0)
+		self.assertEqual(self.drain(hold=True), [spat])
+		self.assertIsNone(self.scheduler.next_ready(hold=True))
+		self.assertEqual(self.drain(), [request, later])
+
+	def test_held_and_ready_packets_keep_their_order(self):
+		packets = [lan_packet('SPAT', tag=i) for i in range(4)]
+		for i, packet in enumerate(packets):
+			self.scheduler.push(packet, held=i % 2 == 0)
+		self.assertEqual(self.drain(), packets)
+
+	def test_full_queue_drops_the_oldest_of_either_lane(self):
+		packets = [lan_packet('SPAT', tag=i) for i in range(5)]
+		accepted = [self.scheduler.push(packet, held=i == 0) for i, packet in enumerate(packets)]
+		self.assertEqual(accepted, [True] * 4 + [False])
+		self.assertEqual(self.drain(), packets[1:])
+		self.assertEqual(self.scheduler.classes[0].dropped, 1)
+
+	def test_held_packet_does_not_block_a_coalescing_class(self):
+		first = lan_packet('BSM', tag=1)
+		second = lan_packet('BSM', tag=2)
+		self.scheduler.push(first, ("192.168.0.2", 5398), held=True)
+		self.scheduler.push(second, ("192.168.0.3", 5398))
+		self.assertEqual(self.drain(hold=True), [second])
+		self.assertEqual(self.drain(), [first])
+		self.assertEqual(self.scheduler.classes[1].latest, {})
+
+	def test_tag_comes_back_with_the_packet(self):
+		bsm = lan_packet('BSM')
+		self.scheduler.push(bsm, ("192.168.0.2", 5398), tag='policy')
+		self.assertEqual(self.scheduler.pop_entry(), (bsm, 'policy'))
+
+if __name__ == '__main__':
+	unittest.main()